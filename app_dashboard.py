@@ -3,13 +3,14 @@ import pandas as pd
 import plotly.graph_objects as go
 import plotly.express as px
 from datetime import datetime, timedelta
-import ast
 import io
 
 # Importar módulos locales
 import config
 import services
 import ui
+import metricas
+import perfil
 
 # --- 1. CONFIGURACIÓN DE PÁGINA Y ESTILOS ---
 st.set_page_config(
@@ -21,7 +22,7 @@ st.set_page_config(
 # HELPER: Gráfico de Pastel Mejorado
 def create_improved_pie(df_in, col_val, col_name, title, threshold=0.02, show_percent_only=True):
     # Agrupar y ordenar
-    df_g = df_in.groupby(col_name)[col_val].sum().reset_index().sort_values(col_val, ascending=False)
+    df_g = df_in.groupby(col_name, observed=True)[col_val].sum().reset_index().sort_values(col_val, ascending=False)
     
     # Calcular %
     total = df_g[col_val].sum()
@@ -47,6 +48,9 @@ def create_improved_pie(df_in, col_val, col_name, title, threshold=0.02, show_pe
     return fig
 
 
+# Perfilador del render (opcional): abre el registro de este rerun
+perfil.iniciar()
+
 # Cargar estilos
 ui.load_styles()
 
@@ -56,54 +60,68 @@ st.title("Alrotek Monitor v1")
 
 with st.expander("⚙️ Configuración", expanded=True):
     tc_odoo = services.get_current_usd_rate()
-    col_conf1, col_conf2 = st.columns(2)
+    col_conf1, col_conf2, col_conf3 = st.columns([2, 2, 1])
     with col_conf1: tc_usd = st.number_input("TC (USD -> CRC)", value=float(tc_odoo), format="%.2f")
-    with col_conf2: st.info(f"TC VIGENTE ODOO: ₡{tc_usd:,.2f}")
+    with col_conf2: st.info(f"TC VIGENTE ODOO: ₡{tc_odoo:,.2f}")
+    # Con el TC de Odoo cada monto se convierte con la tasa de su fecha; si se edita, se aplica ese TC fijo
+    tc_manual = tc_usd if round(tc_usd, 2) != round(tc_odoo, 2) else None
+    with col_conf3:
+        # La facturación se sincroniza de forma incremental; esto descarta la copia y recarga todo
+        if st.button("🔄 Recarga completa", help="Descarga de nuevo todas las facturas desde Odoo"):
+            services.forzar_recarga_completa()
+            st.rerun()
+        st.checkbox("Ver memoria", key="ver_memoria", help="Tamaño en memoria de cada dataset antes/después de compactar")
+        st.checkbox("Perfilar render", key="perfil_activo", help="Tiempo por sección y bloque (datos / transformación / figura / serialización)")
+
+# Navegación: a diferencia de st.tabs, solo se ejecuta la sección elegida (la elección queda en session_state)
+NOMBRES_SECCIONES = ["📊 Visión General", "📈 Rentabilidad Proyectos", "📦 Productos", "🕸️ Baja Rotación", "💰 Cartera", "👥 Segmentación", "💼 Vendedores", "🔍 Radiografía", "📥 Descargas"]
+seccion_activa = st.radio("Sección", NOMBRES_SECCIONES, horizontal=True, key="seccion_activa", label_visibility="collapsed")
+
+with st.spinner('Cargando...'), perfil.medir("Carga inicial", 'datos'):
+    # Facturas ya unidas con provincia/zona/categoría del cliente y compactadas (category + downcast)
+    # Cada frame llega con su versión (momento de descarga): los memos se indexan con ella, no con la vigente después
+    df_main, version_ventas = services.cargar_ventas_clientes()
+    df_metas = services.cargar_metas()
+    df_prod, version_prod = services.cargar_detalle_productos.con_version()
+    df_an, version_an = services.cargar_estructura_analitica.con_version()
 
-# SE AGREGÓ 'tab_down' AL FINAL
-tab_kpis, tab_renta, tab_prod, tab_inv, tab_cx, tab_cli, tab_vend, tab_det, tab_down = st.tabs(["📊 Visión General", "📈 Rentabilidad Proyectos", "📦 Productos", "🕸️ Baja Rotación", "💰 Cartera", "👥 Segmentación", "💼 Vendedores", "🔍 Radiografía", "📥 Descargas"])
+ui.caption_edad_datos({"Facturas": services.estado_cache('datos_generales'), "Productos": services.estado_cache('detalle_productos')})
+if st.session_state.get("ver_memoria"):
+    st.dataframe(services.reporte_memoria().style.format({'Antes_MB': '{:.2f}', 'Despues_MB': '{:.2f}', 'Ahorro_Pct': '{:.0f}%'}), use_container_width=True, hide_index=True)
 
-with st.spinner('Cargando...'):
-    df_main = services.cargar_datos_generales()
-    df_metas = services.cargar_metas()
-    df_prod = services.cargar_detalle_productos()
-    df_an = services.cargar_estructura_analitica()
-    
-    if not df_main.empty:
-        df_info = services.cargar_datos_clientes_extendido(df_main['ID_Cliente'].unique().tolist())
-        if not df_info.empty:
-            df_main = pd.merge(df_main, df_info, on='ID_Cliente', how='left')
-            df_main[['Provincia', 'Zona_Comercial', 'Categoria_Cliente']] = df_main[['Provincia', 'Zona_Comercial', 'Categoria_Cliente']].fillna('Sin Dato')
-        else:
-            # FIX: Inicializar columnas vacías si falla la carga extendida
-            df_main['Provincia'] = 'Sin Dato'
-            df_main['Zona_Comercial'] = 'Sin Dato'
-            df_main['Categoria_Cliente'] = 'Sin Dato'
+# Cubos de agregados: se recalculan solo cuando cambia la versión de los datos
+cubo = services.cubo_ventas(version_ventas, df_main)
+cubo_cli = services.cubo_clientes(version_ventas, df_main)
+# Particiones por año y listas de filtros: un dict por versión de datos en vez de escanear fechas en cada rerun
+por_anio = services.particiones_por_anio(version_ventas, df_main, 'invoice_date')
+dims = services.dimensiones(version_ventas, df_main)
 
 # === PESTAÑA 1: VISIÓN GENERAL ===
-with tab_kpis:
+def seccion_kpis():
     if not df_main.empty:
         col_f, _ = st.columns([1,3])
-        with col_f: anio_sel = st.selectbox("📅 Año Fiscal", sorted(df_main['invoice_date'].dt.year.unique(), reverse=True))
-        df_anio = df_main[df_main['invoice_date'].dt.year == anio_sel]
-        df_ant = df_main[df_main['invoice_date'].dt.year == (anio_sel - 1)]
+        with col_f: anio_sel = st.selectbox("📅 Año Fiscal", dims['anios'])
+        df_anio = services.filas_anio(por_anio, anio_sel, df_main)
+        c_anio = cubo[cubo['Anio'] == anio_sel]
+        c_ant = cubo[cubo['Anio'] == (anio_sel - 1)]
         
-        venta = df_anio['Venta_Neta_USD'].sum()
-        delta = ((venta - df_ant['Venta_Neta_USD'].sum()) / df_ant['Venta_Neta_USD'].sum() * 100) if df_ant['Venta_Neta_USD'].sum() > 0 else 0
+        venta = c_anio['Venta_Neta_USD'].sum()
+        delta = ((venta - c_ant['Venta_Neta_USD'].sum()) / c_ant['Venta_Neta_USD'].sum() * 100) if c_ant['Venta_Neta_USD'].sum() > 0 else 0
         meta = df_metas[df_metas['Anio'] == anio_sel]['Dolares'].sum()
         
         c1, c2, c3, c4 = st.columns(4)
         with c1: ui.card_kpi("Venta Total (USD)", venta, "border-green", f"{delta:+.1f}% vs Anterior", formato="usd")
         with c2: ui.card_kpi("Meta Anual (USD)", meta, "bg-dark-blue", formato="usd")
         with c3: ui.card_kpi("Cumplimiento", f"{(venta/meta*100) if meta>0 else 0:.1f}%", "border-blue", formato="raw")
-        with c4: ui.card_kpi("Ticket Prom. (USD)", (venta/df_anio['name'].nunique()) if df_anio['name'].nunique()>0 else 0, "border-purple", formato="usd")
+        with c4: ui.card_kpi("Ticket Prom. (USD)", (venta/c_anio['Facturas'].sum()) if c_anio['Facturas'].sum()>0 else 0, "border-purple", formato="usd")
         
         st.divider()
-        st.download_button("📥 Descargar", data=ui.convert_df_to_excel(df_anio[['invoice_date', 'name', 'Cliente', 'amount_untaxed_signed']]), file_name=f"Ventas_{anio_sel}.xlsx")
+        with perfil.medir("Excel ventas del año", 'serializacion'): xls_anio = ui.convert_df_to_excel(df_anio[['invoice_date', 'name', 'Cliente', 'amount_untaxed_signed']])
+        st.download_button("📥 Descargar", data=xls_anio, file_name=f"Ventas_{anio_sel}.xlsx")
 
         st.markdown(f"### 🎯 Cumplimiento de Meta USD ({anio_sel})")
-        v_act = df_anio.groupby('Mes_Num')['Venta_Neta_USD'].sum().reset_index().rename(columns={'Venta_Neta_USD': 'Actual'})
-        v_meta = df_metas[df_metas['Anio'] == anio_sel].groupby('Mes_Num')['Dolares'].sum().reset_index().rename(columns={'Dolares': 'Meta'})
+        v_act = services.rebanar(c_anio, 'Venta_Neta_USD', 'Mes_Num').rename(columns={'Venta_Neta_USD': 'Actual'})
+        v_meta = df_metas[df_metas['Anio'] == anio_sel].groupby('Mes_Num', observed=True)['Dolares'].sum().reset_index().rename(columns={'Dolares': 'Meta'})
         df_gm = pd.DataFrame({'Mes_Num': range(1, 13)}).merge(v_act, on='Mes_Num', how='left').merge(v_meta, on='Mes_Num', how='left').fillna(0)
         df_gm['Mes'] = df_gm['Mes_Num'].map({1:'Ene',2:'Feb',3:'Mar',4:'Abr',5:'May',6:'Jun',7:'Jul',8:'Ago',9:'Sep',10:'Oct',11:'Nov',12:'Dic'})
         
@@ -128,18 +146,18 @@ with tab_kpis:
                                marker_color=['#2ecc71' if r>=m else '#e74c3c' for r,m in zip(df_gm['Actual'], df_gm['Meta'])],
                                text=df_gm['Label'], textposition='auto'))
         fig_m.add_trace(go.Scatter(x=df_gm['Mes'], y=df_gm['Meta'], name='Meta (USD)', line=dict(color='#f1c40f', width=3, dash='dash')))
-        st.plotly_chart(ui.config_plotly(fig_m), use_container_width=True)
+        ui.grafico(fig_m, "Meta vs Real")
 
         st.divider()
         st.markdown(f"### 🗓️ Comparativo USD: {anio_sel} vs {anio_sel-1}")
-        v_ant_g = df_ant.groupby('Mes_Num')['Venta_Neta_USD'].sum().reset_index().rename(columns={'Venta_Neta_USD': 'Anterior'})
+        v_ant_g = services.rebanar(c_ant, 'Venta_Neta_USD', 'Mes_Num').rename(columns={'Venta_Neta_USD': 'Anterior'})
         df_gc = pd.DataFrame({'Mes_Num': range(1, 13)}).merge(v_act, on='Mes_Num', how='left').merge(v_ant_g, on='Mes_Num', how='left').fillna(0)
         df_gc['Mes'] = df_gc['Mes_Num'].map({1:'Ene',2:'Feb',3:'Mar',4:'Abr',5:'May',6:'Jun',7:'Jul',8:'Ago',9:'Sep',10:'Oct',11:'Nov',12:'Dic'})
         
         fig_c = go.Figure()
         fig_c.add_trace(go.Bar(x=df_gc['Mes'], y=df_gc['Actual'], name=f'{anio_sel}', marker_color='#2980b9', text=df_gc['Actual'], texttemplate='%{y:$.3s}', textposition='auto'))
         fig_c.add_trace(go.Bar(x=df_gc['Mes'], y=df_gc['Anterior'], name=f'{anio_sel-1}', marker_color='#95a5a6', text=df_gc['Anterior'], texttemplate='%{y:$.3s}', textposition='auto'))
-        st.plotly_chart(ui.config_plotly(fig_c), use_container_width=True)
+        ui.grafico(fig_c, "Comparativo anual")
 
 # --- NUEVO: GRÁFICO VENTAS SEMANA ACTUAL ---
         st.divider()
@@ -151,24 +169,26 @@ with tab_kpis:
         fin_semana = inicio_semana + timedelta(days=6)
         
         # Filtrar datos de la semana actual
-        mask_semana = (df_main['invoice_date'].dt.date >= inicio_semana.date()) & \
-                      (df_main['invoice_date'].dt.date <= fin_semana.date())
-        df_semana = df_main[mask_semana].copy()
+        with perfil.medir("Semana actual"):
+            mask_semana = (df_main['invoice_date'].dt.date >= inicio_semana.date()) & \
+                          (df_main['invoice_date'].dt.date <= fin_semana.date())
+            df_semana = df_main[mask_semana].copy()
         
         if not df_semana.empty:
-            # Mapeo manual para asegurar nombres en español
-            df_semana['Dia_Num'] = df_semana['invoice_date'].dt.weekday
-            mapa_dias = {0: 'Lunes', 1: 'Martes', 2: 'Miércoles', 3: 'Jueves', 4: 'Viernes', 5: 'Sábado', 6: 'Domingo'}
-            df_semana['Dia_Nom'] = df_semana['Dia_Num'].map(mapa_dias)
-            
-            # Agrupar y ordenar
-            v_semana = df_semana.groupby(['Dia_Num', 'Dia_Nom'])['Venta_Neta'].sum().reset_index().sort_values('Dia_Num')
+            with perfil.medir("Semana actual"):
+                # Mapeo manual para asegurar nombres en español
+                df_semana['Dia_Num'] = df_semana['invoice_date'].dt.weekday
+                mapa_dias = {0: 'Lunes', 1: 'Martes', 2: 'Miércoles', 3: 'Jueves', 4: 'Viernes', 5: 'Sábado', 6: 'Domingo'}
+                df_semana['Dia_Nom'] = df_semana['Dia_Num'].map(mapa_dias)
+                
+                # Agrupar y ordenar
+                v_semana = df_semana.groupby(['Dia_Num', 'Dia_Nom'], observed=True)['Venta_Neta'].sum().reset_index().sort_values('Dia_Num')
             
             # Crear gráfico
-            fig_w = px.bar(v_semana, x='Dia_Nom', y='Venta_Neta', text_auto='.2s', 
+            with perfil.medir("Semana actual", 'figura'): fig_w = px.bar(v_semana, x='Dia_Nom', y='Venta_Neta', text_auto='.2s', 
                            title=f"Semana del {inicio_semana.strftime('%d/%m')} al {fin_semana.strftime('%d/%m')}")
             fig_w.update_traces(marker_color='#1abc9c') # Color cian para diferenciar
-            st.plotly_chart(ui.config_plotly(fig_w), use_container_width=True)
+            ui.grafico(fig_w, "Semana actual")
         else:
             st.info(f"💤 No hay ventas registradas aún en la semana del {inicio_semana.strftime('%d/%m')}.")
         
@@ -177,22 +197,13 @@ with tab_kpis:
         with c_mix:
             st.subheader("📊 Mix por Plan")
             if not df_prod.empty:
-                df_l = df_prod[df_prod['date'].dt.year == anio_sel].copy()
-                mapa = dict(zip(df_an['id_cuenta_analitica'].astype(str), df_an['Plan_Nombre'])) if not df_an.empty else {}
-                def clasif(d):
-                    if not d: return "Retail"
-                    try: return mapa.get(str(list((d if isinstance(d,dict) else ast.literal_eval(str(d))).keys())[0]), "Otro")
-                    except: return "Otro"
-                df_l['Plan'] = df_l['analytic_distribution'].apply(clasif)
-                
-                df_l['Mes_Num'] = df_l['date'].dt.month
-                df_l['Mes_Nom'] = df_l['date'].dt.strftime('%m-%b')
-                
-                df_grp = df_l.groupby(['Mes_Num', 'Mes_Nom', 'Plan'])['Venta_Neta'].sum().reset_index().sort_values('Mes_Num')
+                cubo_p = services.cubo_planes(version_prod, version_an, df_prod, df_an)
+                df_grp = cubo_p[cubo_p['Anio'] == anio_sel].drop(columns='Anio').sort_values('Mes_Num')
+                df_grp['Mes_Nom'] = pd.to_datetime({'year': anio_sel, 'month': df_grp['Mes_Num'], 'day': 1}).dt.strftime('%m-%b')
                 
                 # --- NUEVO: Cálculo de % por mes ---
                 # 1. Calcular el total vendido por mes para usarlo de base (100%)
-                df_grp['Total_Mes'] = df_grp.groupby('Mes_Num')['Venta_Neta'].transform('sum')
+                df_grp['Total_Mes'] = df_grp.groupby('Mes_Num', observed=True)['Venta_Neta'].transform('sum')
                 
                 # 2. Calcular el porcentaje formateado (ej. 25.4%)
                 df_grp['Pct_Texto'] = df_grp.apply(lambda x: f"{x['Venta_Neta']/x['Total_Mes']:.1%}" if x['Total_Mes'] != 0 else "0%", axis=1)
@@ -205,13 +216,13 @@ with tab_kpis:
                 # 4. Ajustar para que el texto se vea bien dentro de la barra
                 fig_mix.update_traces(textposition='inside', textfont_size=10)
                 
-                st.plotly_chart(ui.config_plotly(fig_mix), use_container_width=True)
+                ui.grafico(fig_mix, "Mix por Plan")
        
         with c_top:
             st.subheader("🏆 Top Vendedores")
-            r_act = df_anio.groupby('Vendedor')['Venta_Neta'].sum().reset_index()
-            r_ant = df_ant.groupby('Vendedor')['Venta_Neta'].sum().reset_index().rename(columns={'Venta_Neta':'Venta_Ant'})
-            r_fin = pd.merge(r_act, r_ant, on='Vendedor', how='left').fillna(0)
+            r_act = services.rebanar(c_anio, 'Venta_Neta', 'Vendedor')
+            r_ant = services.rebanar(c_ant, 'Venta_Neta', 'Vendedor').rename(columns={'Venta_Neta':'Venta_Ant'})
+            r_fin = pd.merge(r_act, r_ant, on='Vendedor', how='left').fillna({'Venta_Ant': 0})
             
             def txt(row):
                 d = ((row['Venta_Neta'] - row['Venta_Ant'])/row['Venta_Ant']*100) if row['Venta_Ant']>0 else 100
@@ -219,11 +230,12 @@ with tab_kpis:
                 return f"₡{row['Venta_Neta']/1e6:.1f}M {i} {d:.0f}%"
             
             r_fin['T'] = r_fin.apply(txt, axis=1)
-            st.plotly_chart(ui.config_plotly(go.Figure(go.Bar(x=r_fin.sort_values('Venta_Neta').tail(20)['Venta_Neta'], y=r_fin.sort_values('Venta_Neta').tail(20)['Vendedor'], orientation='h', text=r_fin.sort_values('Venta_Neta').tail(20)['T'], textposition='auto', marker_color='#2ecc71'))), use_container_width=True)
+            ui.grafico(go.Figure(go.Bar(x=r_fin.sort_values('Venta_Neta').tail(20)['Venta_Neta'], y=r_fin.sort_values('Venta_Neta').tail(20)['Vendedor'], orientation='h', text=r_fin.sort_values('Venta_Neta').tail(20)['T'], textposition='auto', marker_color='#2ecc71')), "Ranking vendedores")
 
 # === PESTAÑA 2: PROYECTOS (ESTRUCTURA v10.7) ===
-with tab_renta:
-    df_pnl = services.cargar_pnl_historico()
+def seccion_renta():
+    df_pnl = services.cargar_pnl_agrupado()
+    ui.caption_edad_datos({"Contabilidad": services.estado_cache('pnl_agrupado')})
     if not df_an.empty:
         c1, c2 = st.columns(2)
         mapa_c = dict(zip(df_an['id_cuenta_analitica'].astype(float), df_an['Plan_Nombre']))
@@ -244,8 +256,8 @@ with tab_renta:
             # Cargas Operativas
             df_h = services.cargar_detalle_horas_mes(sel_ids)
             df_s, _, bods = services.cargar_inventario_ubicacion_proyecto_v4(sel_ids, proys)
-            df_c = services.cargar_compras_pendientes_v7_json_scanner(sel_ids, tc_usd)
-            df_fe = services.cargar_facturacion_estimada_v2(sel_ids, tc_usd)
+            df_c = services.cargar_compras_pendientes_v7_json_scanner(sel_ids, tc_manual)
+            df_fe = services.cargar_facturacion_estimada_v2(sel_ids, tc_manual)
             
             # CALCULOS FINALES v10.7 (ALERTA OPERATIVA)
             # 1. Ingresos (Total Proyecto)
@@ -313,7 +325,10 @@ with tab_renta:
             t1, t2, t3, t4, t5 = st.tabs(["Inventario", "Compras", "Contabilidad", "Fact. Pend.", "Historial Inv."])
             with t1: st.dataframe(df_s, use_container_width=True)
             with t2: st.dataframe(df_c, use_container_width=True)
-            with t3: st.dataframe(df_f, use_container_width=True)
+            with t3:
+                # Totales por cuenta contable, analítica y mes; el detalle por línea se pide a Odoo solo si se activa
+                df_f_det = services.cargar_pnl_historico(sel_ids) if st.toggle("Ver detalle por línea", key="pnl_detalle") else None
+                st.dataframe(df_f_det if df_f_det is not None else df_f, use_container_width=True)
             with t4: st.dataframe(df_fe, use_container_width=True)
             with t5:
                 df_ensambles, df_cust, df_post, hist_status = services.cargar_historial_inventario_proyecto(sel_ids, proys)
@@ -335,10 +350,11 @@ with tab_renta:
                         else:
                             return ['']*len(row)
                             
-                    styled_df_p = df_to_show_p.style.apply(highlight_110, axis=1)
+                    with perfil.medir("Tabla ensambles (highlight_110)", 'figura'): styled_df_p = df_to_show_p.style.apply(highlight_110, axis=1)
                     
-                    st.dataframe(styled_df_p, use_container_width=True)
-                    st.download_button("📥 Descargar Ensambles", data=ui.convert_df_to_excel(df_ensambles), file_name=f"Ensambles_{proys[0][:10]}.xlsx", key=f"dwn_prod_{proys[0]}")
+                    with perfil.medir("Tabla ensambles (highlight_110)", 'serializacion'): st.dataframe(styled_df_p, use_container_width=True)
+                    with perfil.medir("Excel ensambles", 'serializacion'): xls_ensambles = ui.convert_df_to_excel(df_ensambles)
+                    st.download_button("📥 Descargar Ensambles", data=xls_ensambles, file_name=f"Ensambles_{proys[0][:10]}.xlsx", key=f"dwn_prod_{proys[0]}")
                 else:
                     st.info("No hay historial de ensambles registrable.")
                 
@@ -353,7 +369,8 @@ with tab_renta:
                     })
                     
                     st.dataframe(df_to_show_c, use_container_width=True)
-                    st.download_button("📥 Descargar Entregas", data=ui.convert_df_to_excel(df_cust), file_name=f"Entregas_{proys[0][:10]}.xlsx", key=f"dwn_cust_{proys[0]}")
+                    with perfil.medir("Excel entregas", 'serializacion'): xls_entregas = ui.convert_df_to_excel(df_cust)
+                    st.download_button("📥 Descargar Entregas", data=xls_entregas, file_name=f"Entregas_{proys[0][:10]}.xlsx", key=f"dwn_cust_{proys[0]}")
                 else:
                     st.info("No hay historial de entregas al cliente registrable.")
                     
@@ -368,7 +385,8 @@ with tab_renta:
                     })
                     
                     st.dataframe(df_to_show_post, use_container_width=True)
-                    st.download_button("📥 Descargar Ajustes", data=ui.convert_df_to_excel(df_post), file_name=f"Ajustes_{proys[0][:10]}.xlsx", key=f"dwn_post_{proys[0]}")
+                    with perfil.medir("Excel ajustes", 'serializacion'): xls_ajustes = ui.convert_df_to_excel(df_post)
+                    st.download_button("📥 Descargar Ajustes", data=xls_ajustes, file_name=f"Ajustes_{proys[0][:10]}.xlsx", key=f"dwn_post_{proys[0]}")
                 else:
                     st.info("No hay ajustes posteriores registrables.")
                 
@@ -427,7 +445,7 @@ with tab_renta:
 
             # 3. Generar Excel
             buffer_proy = io.BytesIO()
-            with pd.ExcelWriter(buffer_proy, engine='openpyxl') as writer:
+            with perfil.medir("Excel ER proyecto", 'serializacion'), pd.ExcelWriter(buffer_proy, engine='openpyxl') as writer:
                 # Hoja Principal
                 df_pnl_rep.to_excel(writer, sheet_name='Estado_Resultados', index=False)
                 
@@ -458,7 +476,8 @@ with tab_renta:
                 
                 if not df_s.empty: df_s.to_excel(writer, sheet_name='Detalle_Inventario', index=False)
                 if not df_c.empty: df_c.to_excel(writer, sheet_name='Compras_Pendientes', index=False)
-                if not df_f.empty: df_f.to_excel(writer, sheet_name='Contabilidad_Full', index=False)
+                df_f_xls = df_f_det if df_f_det is not None else df_f
+                if not df_f_xls.empty: df_f_xls.to_excel(writer, sheet_name='Contabilidad_Full', index=False)
             
             st.download_button(
                 f"📥 Descargar ER con Comisión: {', '.join(proys[:1])}...", 
@@ -467,13 +486,14 @@ with tab_renta:
                 mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
             )
 # === PESTAÑA 3: PRODUCTOS (ACTUALIZADA: Métrica + Cat + Zona + Vendedor) ===
-with tab_prod:
+def seccion_prod():
     df_cat = services.cargar_inventario_general()
     if not df_prod.empty:
+        prod_por_anio = services.particiones_por_anio(version_prod, df_prod, 'date')
         # --- 1. FILTROS GENERALES ---
         c_f1, c_f2 = st.columns([1, 4])
         with c_f1: 
-            anio = st.selectbox("📅 Año", sorted(df_prod['date'].dt.year.unique(), reverse=True), key="prod_anio_sel")
+            anio = st.selectbox("📅 Año", sorted(prod_por_anio, reverse=True), key="prod_anio_sel")
         with c_f2: 
             # Selector de métrica (Afecta a TODOS los gráficos)
             tipo_ver = st.radio("📊 Ver Gráficos por:", 
@@ -495,32 +515,31 @@ with tab_prod:
             fmt_text = ''
         
         # Filtrar datos base por año
-        df_p = df_prod[df_prod['date'].dt.year == anio].merge(df_cat[['ID_Producto','Tipo']], on='ID_Producto', how='left').fillna({'Tipo':'Otro'})
+        df_p = services.filas_anio(prod_por_anio, anio, df_prod).merge(df_cat[['ID_Producto','Tipo']], on='ID_Producto', how='left').fillna({'Tipo':'Otro'})
         
         # --- 2. GRÁFICOS GLOBALES ---
         c_m1, c_m2 = st.columns([1, 2])
         
         # Mix por Tipo (Con altura ajustada y padding)
-        grp_tipo = df_p.groupby('Tipo')[col_calc].agg(agg_func).reset_index()
+        grp_tipo = df_p.groupby('Tipo', observed=True)[col_calc].agg(agg_func).reset_index()
         with c_m1: 
             fig_pie = px.pie(grp_tipo, values=col_calc, names='Tipo', 
                              title=f"Mix por Tipo ({tipo_ver})", 
                              height=300)
             fig_pie.update_layout(title_pad=dict(b=20), margin=dict(t=50, b=10, l=10, r=10))
-            st.plotly_chart(ui.config_plotly(fig_pie), use_container_width=True)
+            ui.grafico(fig_pie, "Mix por Tipo")
         
         # Top 10 Global
-        grp_top = df_p.groupby('Producto')[col_calc].agg(agg_func).sort_values().tail(10).reset_index()
+        with perfil.medir("Top 10 Global"): grp_top = df_p.groupby('Producto', observed=True)[col_calc].agg(agg_func).sort_values().tail(10).reset_index()
         with c_m2: 
-            st.plotly_chart(ui.config_plotly(px.bar(grp_top, x=col_calc, y='Producto', orientation='h', text_auto=fmt_text, title=f"Top 10 Global ({tipo_ver})")), use_container_width=True)
+            with perfil.medir("Top 10 Global", 'figura'): fig_top = px.bar(grp_top, x=col_calc, y='Producto', orientation='h', text_auto=fmt_text, title=f"Top 10 Global ({tipo_ver})")
+            ui.grafico(fig_top, "Top 10 Global")
 
         # --- PREPARACIÓN DE DATOS DETALLADOS ---
         if not df_main.empty:
             # ACTUALIZACIÓN: Ahora traemos también 'Vendedor' en el merge
             df_merged = pd.merge(df_p, df_main[['id', 'Categoria_Cliente', 'Zona_Comercial', 'Vendedor']], left_on='ID_Factura', right_on='id', how='left')
-            df_merged['Categoria_Cliente'] = df_merged['Categoria_Cliente'].fillna("Sin Categoría")
-            df_merged['Zona_Comercial'] = df_merged['Zona_Comercial'].fillna("Sin Zona")
-            df_merged['Vendedor'] = df_merged['Vendedor'].fillna("Sin Asignar")
+            df_merged = services.rellenar(df_merged, {'Categoria_Cliente': "Sin Categoría", 'Zona_Comercial': "Sin Zona", 'Vendedor': "Sin Asignar"})
 
             st.divider()
             
@@ -528,16 +547,17 @@ with tab_prod:
             c_cat1, c_cat2 = st.columns([1, 3])
             with c_cat1: 
                 st.subheader(f"🛍️ Por Categoría")
-                cats = sorted(df_merged['Categoria_Cliente'].unique())
+                # Opciones del año leídas del cubo de ventas, sin recorrer las líneas
+                cats = dims['categorias'].get(int(anio), ["Sin Categoría"])
                 cat_sel = st.selectbox("Filtrar Categoría:", cats, key="prod_cat_filter")
             
             with c_cat2:
                 df_cf = df_merged[df_merged['Categoria_Cliente'] == cat_sel]
                 if not df_cf.empty:
-                    top_cat = df_cf.groupby('Producto')[col_calc].agg(agg_func).sort_values().tail(10).reset_index()
-                    fig_cat = px.bar(top_cat, x=col_calc, y='Producto', orientation='h', text_auto=fmt_text, 
+                    with perfil.medir("Top por Categoría"): top_cat = df_cf.groupby('Producto', observed=True)[col_calc].agg(agg_func).sort_values().tail(10).reset_index()
+                    with perfil.medir("Top por Categoría", 'figura'): fig_cat = px.bar(top_cat, x=col_calc, y='Producto', orientation='h', text_auto=fmt_text, 
                                      title=f"Top Productos: {cat_sel}", color_discrete_sequence=['#8e44ad']) # Morado
-                    st.plotly_chart(ui.config_plotly(fig_cat), use_container_width=True)
+                    ui.grafico(fig_cat, "Top por Categoría")
                 else:
                     st.info("Sin datos.")
 
@@ -547,16 +567,16 @@ with tab_prod:
             c_zon1, c_zon2 = st.columns([1, 3])
             with c_zon1: 
                 st.subheader(f"🌍 Por Zona")
-                zonas = sorted(df_merged['Zona_Comercial'].unique())
+                zonas = dims['zonas'].get(int(anio), ["Sin Zona"])
                 zona_sel = st.selectbox("Filtrar Zona:", zonas, key="prod_zona_filter")
             
             with c_zon2:
                 df_zf = df_merged[df_merged['Zona_Comercial'] == zona_sel]
                 if not df_zf.empty:
-                    top_zona = df_zf.groupby('Producto')[col_calc].agg(agg_func).sort_values().tail(10).reset_index()
-                    fig_zona = px.bar(top_zona, x=col_calc, y='Producto', orientation='h', text_auto=fmt_text, 
+                    with perfil.medir("Top por Zona"): top_zona = df_zf.groupby('Producto', observed=True)[col_calc].agg(agg_func).sort_values().tail(10).reset_index()
+                    with perfil.medir("Top por Zona", 'figura'): fig_zona = px.bar(top_zona, x=col_calc, y='Producto', orientation='h', text_auto=fmt_text, 
                                      title=f"Top Productos: {zona_sel}", color_discrete_sequence=['#16a085']) # Teal/Verde
-                    st.plotly_chart(ui.config_plotly(fig_zona), use_container_width=True)
+                    ui.grafico(fig_zona, "Top por Zona")
                 else:
                     st.info("Sin datos.")
 
@@ -572,10 +592,10 @@ with tab_prod:
             with c_ven2:
                 df_vf = df_merged[df_merged['Vendedor'] == vend_sel]
                 if not df_vf.empty:
-                    top_vend = df_vf.groupby('Producto')[col_calc].agg(agg_func).sort_values().tail(10).reset_index()
-                    fig_vend = px.bar(top_vend, x=col_calc, y='Producto', orientation='h', text_auto=fmt_text, 
+                    with perfil.medir("Top por Vendedor"): top_vend = df_vf.groupby('Producto', observed=True)[col_calc].agg(agg_func).sort_values().tail(10).reset_index()
+                    with perfil.medir("Top por Vendedor", 'figura'): fig_vend = px.bar(top_vend, x=col_calc, y='Producto', orientation='h', text_auto=fmt_text, 
                                      title=f"Top Productos: {vend_sel}", color_discrete_sequence=['#d35400']) # Naranja Oscuro
-                    st.plotly_chart(ui.config_plotly(fig_vend), use_container_width=True)
+                    ui.grafico(fig_vend, "Top por Vendedor")
                 else:
                     st.info("Sin datos.")
             
@@ -584,7 +604,7 @@ with tab_prod:
             # (Deshabilitado por solicitud del usuario)
 
 # === PESTAÑA 4: BAJA ROTACIÓN ===
-with tab_inv:
+def seccion_inv():
     if st.button("🔄 Calcular Rotación"):
         df_h, status = services.cargar_inventario_baja_rotacion()
         if not df_h.empty:
@@ -598,7 +618,7 @@ with tab_inv:
         else: st.info(status)
 
 # === PESTAÑA 5: CARTERA ===
-with tab_cx:
+def seccion_cx():
     df_cx = services.cargar_cartera()
     if not df_cx.empty:
         deuda = df_cx['amount_residual'].sum()
@@ -610,25 +630,26 @@ with tab_cx:
         c_g, c_t = st.columns([2,1])
         with c_g:
             df_b = df_cx.groupby('Antiguedad')['amount_residual'].sum().reset_index()
-            st.plotly_chart(ui.config_plotly(px.bar(df_b, x='Antiguedad', y='amount_residual', text_auto='.2s', color='Antiguedad')), use_container_width=True)
+            ui.grafico(px.bar(df_b, x='Antiguedad', y='amount_residual', text_auto='.2s', color='Antiguedad'), "Antigüedad cartera")
         with c_t:
-            st.dataframe(df_cx.groupby('Cliente')['amount_residual'].sum().sort_values(ascending=False).head(10), use_container_width=True)
+            st.dataframe(df_cx.groupby('Cliente', observed=True)['amount_residual'].sum().sort_values(ascending=False).head(10), use_container_width=True)
 
 # === PESTAÑA 6: SEGMENTACIÓN ===
-with tab_cli:
+def seccion_cli():
     if not df_main.empty:
-        anio_c = st.selectbox("Año", sorted(df_main['invoice_date'].dt.year.unique(), reverse=True), key="sc")
-        df_c = df_main[df_main['invoice_date'].dt.year == anio_c]
+        anio_c = st.selectbox("Año", dims['anios'], key="sc")
+        df_c = cubo[cubo['Anio'] == anio_c]
         c1, c2, c3 = st.columns(3)
         with c1: 
-            st.plotly_chart(ui.config_plotly(create_improved_pie(df_c, 'Venta_Neta', 'Provincia', 'Ventas por Provincia')), use_container_width=True)
+            ui.grafico(create_improved_pie(df_c, 'Venta_Neta', 'Provincia', 'Ventas por Provincia'), "Pie Provincia")
         with c2: 
-            st.plotly_chart(ui.config_plotly(create_improved_pie(df_c, 'Venta_Neta', 'Zona_Comercial', 'Ventas por Zona')), use_container_width=True)
+            ui.grafico(create_improved_pie(df_c, 'Venta_Neta', 'Zona_Comercial', 'Ventas por Zona'), "Pie Zona")
         with c3: 
-            st.plotly_chart(ui.config_plotly(create_improved_pie(df_c, 'Venta_Neta', 'Categoria_Cliente', 'Ventas por Categoría')), use_container_width=True)
+            ui.grafico(create_improved_pie(df_c, 'Venta_Neta', 'Categoria_Cliente', 'Ventas por Categoría'), "Pie Categoría")
         st.divider()
-        df_old = df_main[df_main['invoice_date'].dt.year == (anio_c - 1)]
-        cli_now = set(df_c['Cliente'])
+        cl_c = cubo_cli[cubo_cli['Anio'] == anio_c]
+        df_old = cubo_cli[cubo_cli['Anio'] == (anio_c - 1)]
+        cli_now = set(cl_c['Cliente'])
         cli_old = set(df_old['Cliente'])
         nuevos = list(cli_now - cli_old)
         perdidos = list(cli_old - cli_now)
@@ -640,13 +661,13 @@ with tab_cli:
         c_top, c_lost = st.columns(2)
         with c_top:
             st.subheader("Top Clientes")
-            df_top = df_c.groupby('Cliente')['Venta_Neta'].sum().sort_values().tail(10).reset_index()
-            st.plotly_chart(ui.config_plotly(px.bar(df_top, x='Venta_Neta', y='Cliente', orientation='h', text_auto='.2s')), use_container_width=True)
+            df_top = services.rebanar(cl_c, 'Venta_Neta', 'Cliente').sort_values('Venta_Neta').tail(10)
+            ui.grafico(px.bar(df_top, x='Venta_Neta', y='Cliente', orientation='h', text_auto='.2s'), "Top clientes")
         with c_lost:
             st.subheader("Oportunidad (Perdidos)")
             if perdidos:
-                df_l = df_old[df_old['Cliente'].isin(perdidos)].groupby('Cliente')['Venta_Neta'].sum().sort_values().tail(10).reset_index()
-                st.plotly_chart(ui.config_plotly(px.bar(df_l, x='Venta_Neta', y='Cliente', orientation='h', text_auto='.2s', color_discrete_sequence=['#e74c3c'])), use_container_width=True)
+                df_l = services.rebanar(df_old, 'Venta_Neta', 'Cliente', Cliente=perdidos).sort_values('Venta_Neta').tail(10)
+                ui.grafico(px.bar(df_l, x='Venta_Neta', y='Cliente', orientation='h', text_auto='.2s', color_discrete_sequence=['#e74c3c']), "Clientes perdidos")
 
         st.divider()
         
@@ -654,32 +675,8 @@ with tab_cli:
         st.subheader("🚨 Clientes en Riesgo (Alerta Temprana)")
         st.caption("Clientes activos que han superado en 1.5x su ciclo habitual de compra.")
         
-        # 1. Calcular frecuencia por cliente
-        df_risk = df_main.sort_values(['Cliente', 'invoice_date'])
-        df_risk['Prev_Date'] = df_risk.groupby('Cliente')['invoice_date'].shift(1)
-        df_risk['Days_Diff'] = (df_risk['invoice_date'] - df_risk['Prev_Date']).dt.days
-        
-        # Promedio histórico por cliente
-        freq_cli = df_risk.groupby('Cliente')['Days_Diff'].mean().reset_index().rename(columns={'Days_Diff': 'Ciclo_Habitual'})
-        
-        # Última compra
-        last_buy = df_risk.groupby('Cliente')['invoice_date'].max().reset_index().rename(columns={'invoice_date': 'Ultima_Compra'})
-        
-        # Unir
-        df_alerta = pd.merge(freq_cli, last_buy, on='Cliente')
-        df_alerta['Dias_Sin_Comprar'] = (datetime.now() - df_alerta['Ultima_Compra']).dt.days
-        
-        # Lógica de Riesgo: (Días > Ciclo*1.5) Y (Días < 365) [No perdidos aún] Y (Ciclo > 0)
-        df_alerta['Alerta'] = (df_alerta['Dias_Sin_Comprar'] > (df_alerta['Ciclo_Habitual'] * 1.5)) & \
-                              (df_alerta['Dias_Sin_Comprar'] < 365) & \
-                              (df_alerta['Ciclo_Habitual'] > 0)
-                              
-        alertas = df_alerta[df_alerta['Alerta']].sort_values('Venta_Neta', ascending=False) if 'Venta_Neta' in df_alerta.columns else df_alerta[df_alerta['Alerta']].copy() 
-        # (Nota: Venta_Neta no está en df_alerta, hay que unirla si queremos ordenar por importancia)
-        
-        # Traer Venta Total Histórica para ordenar
-        vta_hist = df_main.groupby('Cliente')['Venta_Neta'].sum().reset_index()
-        alertas = pd.merge(alertas, vta_hist, on='Cliente', how='left').sort_values('Venta_Neta', ascending=False)
+        # Motor único de riesgo (services): estadísticas por cliente recalculadas una vez por versión de datos
+        alertas = services.clientes_en_riesgo(version_ventas, df_main)
         
         if not alertas.empty:
             c_r1, c_r2 = st.columns([1,3])
@@ -699,29 +696,32 @@ with tab_cli:
             st.success("✅ No se detectan clientes en riesgo de fuga inminente basado en sus ciclos de compra.")
 
 # === PESTAÑA 7: VENDEDORES ===
-with tab_vend:
+def seccion_vend():
     if not df_main.empty:
         c1, c2 = st.columns(2)
-        with c1: anio_v = st.selectbox("Año", sorted(df_main['invoice_date'].dt.year.unique(), reverse=True), key="sv")
-        with c2: vend = st.selectbox("Vendedor", sorted(df_main['Vendedor'].unique()))
-        df_v = df_main[(df_main['invoice_date'].dt.year == anio_v) & (df_main['Vendedor'] == vend)]
-        df_v_old = df_main[(df_main['invoice_date'].dt.year == (anio_v-1)) & (df_main['Vendedor'] == vend)]
-        perdidos_v = list(set(df_v_old['Cliente']) - set(df_v['Cliente']))
+        with c1: anio_v = st.selectbox("Año", dims['anios'], key="sv")
+        with c2: vend = st.selectbox("Vendedor", dims['vendedores'])
+        df_anio_v = services.filas_anio(por_anio, anio_v, df_main)
+        df_v = df_anio_v[df_anio_v['Vendedor'] == vend]
+        c_v = cubo[(cubo['Anio'] == anio_v) & (cubo['Vendedor'] == vend)]
+        cl_v = cubo_cli[(cubo_cli['Anio'] == anio_v) & (cubo_cli['Vendedor'] == vend)]
+        c_v_old = cubo_cli[(cubo_cli['Anio'] == (anio_v-1)) & (cubo_cli['Vendedor'] == vend)]
+        perdidos_v = list(set(c_v_old['Cliente']) - set(cl_v['Cliente']))
         k1, k2, k3 = st.columns(3)
-        with k1: ui.card_kpi("Venta", df_v['Venta_Neta'].sum(), "border-green")
-        with k2: ui.card_kpi("Clientes", df_v['Cliente'].nunique(), "border-blue", formato="numero")
+        with k1: ui.card_kpi("Venta", c_v['Venta_Neta'].sum(), "border-green")
+        with k2: ui.card_kpi("Clientes", cl_v['Cliente'].nunique(), "border-blue", formato="numero")
         with k3: ui.card_kpi("Riesgo", len(perdidos_v), "border-red", formato="numero")
         c_v1, c_v2 = st.columns(2)
         with c_v1:
             st.subheader("Mejores Clientes")
-            if not df_v.empty:
-                df_best = df_v.groupby('Cliente')['Venta_Neta'].sum().sort_values().tail(10).reset_index()
-                st.plotly_chart(ui.config_plotly(px.bar(df_best, x='Venta_Neta', y='Cliente', orientation='h', text_auto='.2s')), use_container_width=True)
+            if not cl_v.empty:
+                df_best = services.rebanar(cl_v, 'Venta_Neta', 'Cliente').sort_values('Venta_Neta').tail(10)
+                ui.grafico(px.bar(df_best, x='Venta_Neta', y='Cliente', orientation='h', text_auto='.2s'), "Mejores clientes")
         with c_v2:
             st.subheader("Cartera Perdida")
             if perdidos_v:
-                df_lst = df_v_old[df_v_old['Cliente'].isin(perdidos_v)].groupby('Cliente')['Venta_Neta'].sum().sort_values().tail(10).reset_index()
-                st.plotly_chart(ui.config_plotly(px.bar(df_lst, x='Venta_Neta', y='Cliente', orientation='h', text_auto='.2s', color_discrete_sequence=['#e74c3c'])), use_container_width=True)
+                df_lst = services.rebanar(c_v_old, 'Venta_Neta', 'Cliente', Cliente=perdidos_v).sort_values('Venta_Neta').tail(10)
+                ui.grafico(px.bar(df_lst, x='Venta_Neta', y='Cliente', orientation='h', text_auto='.2s', color_discrete_sequence=['#e74c3c']), "Clientes perdidos (vendedor)")
 
         st.divider()
         
@@ -747,45 +747,47 @@ with tab_vend:
                 
                 with c_top10:
                     st.subheader(f"🏆 Top 10 Productos ({metrica_vend})")
-                    top_prods = df_prod_vend.groupby('Producto')[val_col].agg(agg).sort_values(ascending=True).tail(10).reset_index() # Sort Ascending for Horizontal Bar to put max at top? No, plotly needs max at bottom for H bar usually? Let's stick to standard logic: tail(10) gets biggest.
+                    top_prods = df_prod_vend.groupby('Producto', observed=True)[val_col].agg(agg).sort_values(ascending=True).tail(10).reset_index() # Sort Ascending for Horizontal Bar to put max at top? No, plotly needs max at bottom for H bar usually? Let's stick to standard logic: tail(10) gets biggest.
                     # Usually for barh, y-axis order: bottom to top. 
                     
                     fig_vp = px.bar(top_prods, x=val_col, y='Producto', orientation='h', text_auto=fmt, 
                                     title=f"Top Productos")
                     fig_vp.update_traces(marker_color='#27ae60')
-                    st.plotly_chart(ui.config_plotly(fig_vp), use_container_width=True)
+                    ui.grafico(fig_vp, "Productos del vendedor")
                 
                 with c_brand:
                     st.subheader(f"🥧 Mix por Marca ({metrica_vend})")
                     # Traer datos de marca desde inventario
                     df_inv = services.cargar_inventario_general()
                     if not df_inv.empty and 'Marca' in df_inv.columns:
-                        df_merged_brand = pd.merge(df_prod_vend, df_inv[['ID_Producto', 'Marca']], on='ID_Producto', how='left')
-                        df_merged_brand['Marca'] = df_merged_brand['Marca'].fillna("Sin Marca")
-                        
-                        # Preparar datos para el pie chart usando la métrica seleccionada
-                        # Para count distinct (ID_Factura), groupby directo
-                        df_pie_data = df_merged_brand.groupby('Marca')[val_col].agg(agg).reset_index()
+                        with perfil.medir("Mix por Marca"):
+                            df_merged_brand = pd.merge(df_prod_vend, df_inv[['ID_Producto', 'Marca']], on='ID_Producto', how='left')
+                            df_merged_brand['Marca'] = df_merged_brand['Marca'].fillna("Sin Marca")
+                            
+                            # Preparar datos para el pie chart usando la métrica seleccionada
+                            # Para count distinct (ID_Factura), groupby directo
+                            df_pie_data = df_merged_brand.groupby('Marca', observed=True)[val_col].agg(agg).reset_index()
                         
                         # Usar el helper
-                        fig_brand = create_improved_pie(df_pie_data, val_col, 'Marca', f"Mix ({metrica_vend})")
-                        st.plotly_chart(ui.config_plotly(fig_brand), use_container_width=True)
+                        with perfil.medir("Mix por Marca", 'figura'): fig_brand = create_improved_pie(df_pie_data, val_col, 'Marca', f"Mix ({metrica_vend})")
+                        ui.grafico(fig_brand, "Mix por Marca")
                     else:
                         st.warning("No se pudo cargar información de Marcas.")
             else:
                 st.info("No hay detalle de productos disponible para este vendedor.")
 
 # === PESTAÑA 8: RADIOGRAFÍA ===
-with tab_det:
+def seccion_det():
     if not df_main.empty:
         c_search, c_year = st.columns([3, 1])
         with c_search:
-            cli = st.selectbox("Buscar Cliente:", sorted(df_main['Cliente'].unique()), index=None, placeholder="Escriba para buscar...")
+            cli = st.selectbox("Buscar Cliente:", dims['clientes'], index=None, placeholder="Escriba para buscar...")
         
         if cli:
-            # Obtener años disponibles para este cliente
-            df_full_history = df_main[df_main['Cliente'] == cli]
-            available_years = sorted(df_full_history['invoice_date'].dt.year.unique(), reverse=True)
+            # Facturas, líneas e historial del cliente desde el índice precalculado (por versión de datos)
+            indice = services.indice_clientes((version_ventas, version_prod), df_main, df_prod)
+            df_full_history, df_lineas_cli, hist_anual, hist_mensual = services.vista_cliente(indice, cli, df_main, df_prod)
+            available_years = sorted(hist_anual['Anio'].tolist(), reverse=True)
             
             with c_year:
                 # Selector de Año (con opción 'Todos')
@@ -819,18 +821,17 @@ with tab_det:
                     st.subheader("Historial")
                     if is_filtered:
                         # Vista Mensual (Año seleccionado)
-                        hist = df_cl.groupby(df_cl['invoice_date'].dt.month)['Venta_Neta'].sum().reset_index()
+                        hist = hist_mensual[hist_mensual['Anio'] == rad_year].copy()
                         # Mapear número de mes a nombre
-                        hist['Mes'] = hist['invoice_date'].map({1:'Ene',2:'Feb',3:'Mar',4:'Abr',5:'May',6:'Jun',
+                        hist['Mes'] = hist['Mes'].map({1:'Ene',2:'Feb',3:'Mar',4:'Abr',5:'May',6:'Jun',
                                                               7:'Jul',8:'Ago',9:'Sep',10:'Oct',11:'Nov',12:'Dic'})
                         fig_h = px.bar(hist, x='Mes', y='Venta_Neta', text_auto='.2s', title=f"Ventas Mensuales {rad_year}")
                     else:
                         # Vista Anual (Historico Completo)
-                        hist = df_cl.groupby(df_cl['invoice_date'].dt.year)['Venta_Neta'].sum().reset_index()
-                        fig_h = px.bar(hist, x='invoice_date', y='Venta_Neta', text_auto='.2s', title="Tendencia Anual")
+                        fig_h = px.bar(hist_anual, x='Anio', y='Venta_Neta', text_auto='.2s', title="Tendencia Anual")
                         fig_h.update_xaxes(type='category') # Asegurar que años se vean como categorías
                     
-                    st.plotly_chart(ui.config_plotly(fig_h), use_container_width=True)
+                    ui.grafico(fig_h, "Historial cliente")
 
                 with c_p:
                     c_head, c_sel = st.columns([1,1])
@@ -846,10 +847,10 @@ with tab_det:
 
                     if not df_prod.empty:
                         # Filtrar productos usando las facturas del cliente filtrado
-                        df_cp = df_prod[df_prod['ID_Factura'].isin(df_cl['id'])]
+                        df_cp = df_lineas_cli[df_lineas_cli['ID_Factura'].isin(df_cl['id'])] if is_filtered else df_lineas_cli
                         if not df_cp.empty:
-                            top = df_cp.groupby('Producto')[r_val].agg(r_agg).sort_values(ascending=True).tail(10).reset_index()
-                            st.plotly_chart(ui.config_plotly(px.bar(top, x=r_val, y='Producto', orientation='h', text_auto=r_fmt)), use_container_width=True)
+                            top = df_cp.groupby('Producto', observed=True)[r_val].agg(r_agg).sort_values(ascending=True).tail(10).reset_index()
+                            ui.grafico(px.bar(top, x=r_val, y='Producto', orientation='h', text_auto=r_fmt), "Top productos cliente")
                         else:
                             st.info("No hay productos para este rango.")
             else:
@@ -858,10 +859,10 @@ with tab_det:
 # ... (después de mostrar los gráficos del cliente) ...              
 # PREPARAR DESCARGA DEL CLIENTE
             buffer_cli = io.BytesIO()
-            with pd.ExcelWriter(buffer_cli, engine='openpyxl') as writer:
+            with perfil.medir("Excel historial cliente", 'serializacion'), pd.ExcelWriter(buffer_cli, engine='openpyxl') as writer:
                 df_cl.to_excel(writer, sheet_name='Historial_Ventas', index=False)
                 if not df_cp.empty:
-                    df_cp.groupby('Producto')['quantity'].sum().reset_index().to_excel(writer, sheet_name='Productos_Comprados', index=False)
+                    df_cp.groupby('Producto', observed=True)['quantity'].sum().reset_index().to_excel(writer, sheet_name='Productos_Comprados', index=False)
                         
             st.download_button(
                 f"📥 Descargar Historial de {cli}",
@@ -869,9 +870,14 @@ with tab_det:
                 file_name=f"Historial_{cli[:15]}.xlsx"
             )
 # === PESTAÑA 9: CENTRO DE DESCARGAS (ACTUALIZADO) ===
-with tab_down:
+def seccion_down():
     st.header("📥 Centro de Descargas")
     st.markdown("Descarga aquí los datos consolidados que alimentan los gráficos de la aplicación.")
+    # Cada archivo se genera al pedirlo (en segundo plano) y queda cacheado mientras no cambie la versión de los datos
+    hoy = datetime.now().date()
+    formato = st.radio("Formato del detalle crudo", list(ui.FORMATOS_EXPORT), horizontal=True, key="formato_detalle",
+                       help="CSV comprimido y Parquet son más livianos para llevar el detalle completo a otras herramientas")
+    ext = ui.FORMATOS_EXPORT[formato][1]
     
     col_d1, col_d2 = st.columns(2)
     
@@ -881,30 +887,35 @@ with tab_down:
         
         # 1. Ventas Generales (Detalle Facturas)
         if not df_main.empty:
-            buffer_main = ui.convert_df_to_excel(df_main[['invoice_date', 'name', 'Cliente', 'Vendedor', 'Venta_Neta', 'Provincia', 'Zona_Comercial', 'Categoria_Cliente']], "Ventas_General")
-            st.download_button("📥 Histórico de Ventas (Completo)", data=buffer_main, file_name="Ventas_Generales_Alrotek.xlsx")
+            cols_ventas = ['invoice_date', 'name', 'Cliente', 'Vendedor', 'Venta_Neta', 'Provincia', 'Zona_Comercial', 'Categoria_Cliente']
+            ui.boton_export("Histórico de Ventas (Completo)", f"ventas_general{ext}", version_ventas,
+                            lambda avance: ui.exportar(df_main[cols_ventas], formato, avance), f"Ventas_Generales_Alrotek{ext}")
 
         # 2. Datos de Cumplimiento de Meta (Gráfico Tab 1)
         if not df_main.empty and not df_metas.empty:
             anio_actual = datetime.now().year
-            v_act = df_main[df_main['invoice_date'].dt.year == anio_actual].groupby('Mes_Num')['Venta_Neta_USD'].sum().reset_index().rename(columns={'Venta_Neta_USD': 'Venta_Real'})
-            v_meta = df_metas[df_metas['Anio'] == anio_actual].groupby('Mes_Num')['Dolares'].sum().reset_index().rename(columns={'Dolares': 'Meta'})
+            v_act = services.rebanar(cubo, 'Venta_Neta_USD', 'Mes_Num', Anio=anio_actual).rename(columns={'Venta_Neta_USD': 'Venta_Real'})
+            v_meta = df_metas[df_metas['Anio'] == anio_actual].groupby('Mes_Num', observed=True)['Dolares'].sum().reset_index().rename(columns={'Dolares': 'Meta'})
             df_cumplimiento = pd.DataFrame({'Mes_Num': range(1, 13)}).merge(v_act, on='Mes_Num', how='left').merge(v_meta, on='Mes_Num', how='left').fillna(0)
             df_cumplimiento['Mes'] = df_cumplimiento['Mes_Num'].map({1:'Ene',2:'Feb',3:'Mar',4:'Abr',5:'May',6:'Jun',7:'Jul',8:'Ago',9:'Sep',10:'Oct',11:'Nov',12:'Dic'})
             df_cumplimiento['Cumplimiento_Pct'] = (df_cumplimiento['Venta_Real'] / df_cumplimiento['Meta'] * 100).fillna(0)
             
-            st.download_button("📥 Reporte Cumplimiento de Metas (USD)", data=ui.convert_df_to_excel(df_cumplimiento), file_name=f"Cumplimiento_Metas_USD_{anio_actual}.xlsx")
+            # Las metas no tienen versión (CSV local o remoto revalidado): la clave lleva un hash de su contenido
+            huella_metas = int(pd.util.hash_pandas_object(df_metas, index=False).sum())
+            ui.boton_export("Reporte Cumplimiento de Metas (USD)", "cumplimiento", (version_ventas, huella_metas, anio_actual),
+                            lambda avance: ui.convert_df_to_excel(df_cumplimiento, avance=avance), f"Cumplimiento_Metas_USD_{anio_actual}.xlsx")
 
         # 3. Datos Comparativos Anuales (Gráfico Tab 1)
         if not df_main.empty:
             anio_actual = datetime.now().year
             anio_ant = anio_actual - 1
-            v_act = df_main[df_main['invoice_date'].dt.year == anio_actual].groupby('Mes_Num')['Venta_Neta_USD'].sum().reset_index().rename(columns={'Venta_Neta_USD': f'Venta_{anio_actual}'})
-            v_ant = df_main[df_main['invoice_date'].dt.year == anio_ant].groupby('Mes_Num')['Venta_Neta_USD'].sum().reset_index().rename(columns={'Venta_Neta_USD': f'Venta_{anio_ant}'})
+            v_act = services.rebanar(cubo, 'Venta_Neta_USD', 'Mes_Num', Anio=anio_actual).rename(columns={'Venta_Neta_USD': f'Venta_{anio_actual}'})
+            v_ant = services.rebanar(cubo, 'Venta_Neta_USD', 'Mes_Num', Anio=anio_ant).rename(columns={'Venta_Neta_USD': f'Venta_{anio_ant}'})
             df_comp = pd.DataFrame({'Mes_Num': range(1, 13)}).merge(v_act, on='Mes_Num', how='left').merge(v_ant, on='Mes_Num', how='left').fillna(0)
             df_comp['Diferencia'] = df_comp[f'Venta_{anio_actual}'] - df_comp[f'Venta_{anio_ant}']
             
-            st.download_button(f"📥 Comparativo USD {anio_actual} vs {anio_ant}", data=ui.convert_df_to_excel(df_comp), file_name="Comparativo_Anual_USD.xlsx")
+            ui.boton_export(f"Comparativo USD {anio_actual} vs {anio_ant}", "comparativo", (version_ventas, anio_actual),
+                            lambda avance: ui.convert_df_to_excel(df_comp, avance=avance), "Comparativo_Anual_USD.xlsx")
 
     # --- SECCIÓN 2: PRODUCTOS E INVENTARIO ---
     with col_d2:
@@ -912,28 +923,27 @@ with tab_down:
         
         # 4. Mix por Tipo y Categoría (Gráficos Tab 3)
         if not df_prod.empty:
-            # Agregado por Tipo (Global)
-            df_p_clean = df_prod.merge(df_cat[['ID_Producto','Tipo']], on='ID_Producto', how='left').fillna({'Tipo':'Otro'})
-            grp_tipo = df_p_clean.groupby('Tipo')['Venta_Neta'].sum().reset_index()
-            
-            # Agregado por Vendedor y Producto (Top Vendedores)
-            df_top_vend = pd.merge(df_p_clean, df_main[['id', 'Vendedor']], left_on='ID_Factura', right_on='id', how='left')
-            grp_vend_prod = df_top_vend.groupby(['Vendedor', 'Producto'])['Venta_Neta'].sum().reset_index()
-
-            # Usamos un ExcelWriter para bajar varias hojas en un solo archivo
-            buffer_prod = io.BytesIO()
-            with pd.ExcelWriter(buffer_prod, engine='openpyxl') as writer:
-                df_prod.to_excel(writer, sheet_name='Detalle_Movimientos', index=False)
-                grp_tipo.to_excel(writer, sheet_name='Mix_por_Tipo', index=False)
-                grp_vend_prod.to_excel(writer, sheet_name='Top_Producto_Vendedor', index=False)
-            
-            st.download_button("📥 Reporte Maestro de Productos (Multi-Hoja)", data=buffer_prod.getvalue(), file_name="Maestro_Productos.xlsx")
-        
-        # 5. Inventario Baja Rotación
-        if st.button("🔄 Generar Baja Rotación"):
+            df_cat = services.cargar_inventario_general()
+            def maestro_productos(avance):
+                # Agregado por Tipo (Global)
+                df_p_clean = df_prod.merge(df_cat[['ID_Producto','Tipo']], on='ID_Producto', how='left').fillna({'Tipo':'Otro'})
+                grp_tipo = df_p_clean.groupby('Tipo', observed=True)['Venta_Neta'].sum().reset_index()
+                # Agregado por Vendedor y Producto (Top Vendedores)
+                df_top_vend = pd.merge(df_p_clean, df_main[['id', 'Vendedor']], left_on='ID_Factura', right_on='id', how='left')
+                grp_vend_prod = df_top_vend.groupby(['Vendedor', 'Producto'], observed=True)['Venta_Neta'].sum().reset_index()
+                # Varias hojas en un solo archivo
+                return ui.libro_excel([('Detalle_Movimientos', df_prod), ('Mix_por_Tipo', grp_tipo), ('Top_Producto_Vendedor', grp_vend_prod)], avance)
+            ui.boton_export("Reporte Maestro de Productos (Multi-Hoja)", "maestro_productos", (version_prod, version_ventas, len(df_cat)), maestro_productos, "Maestro_Productos.xlsx")
+            if formato != "Excel":
+                ui.boton_export(f"Detalle de Movimientos ({formato})", f"detalle_movimientos{ext}", version_prod,
+                                lambda avance: ui.exportar(df_prod, formato, avance), f"Detalle_Movimientos{ext}")
+        
+        # 5. Inventario Baja Rotación (misma vigencia por hora que el TTL del loader)
+        def baja_rotacion(avance):
             df_inv_dl, _ = services.cargar_inventario_baja_rotacion()
-            if not df_inv_dl.empty:
-                st.download_button("📥 Descargar Baja Rotación", data=ui.convert_df_to_excel(df_inv_dl), file_name="Baja_Rotacion.xlsx")
+            if df_inv_dl.empty: raise ValueError("sin inventario de baja rotación")
+            return ui.convert_df_to_excel(df_inv_dl, avance=avance)
+        ui.boton_export("Baja Rotación", "baja_rotacion", datetime.now().strftime('%Y-%m-%d %H'), baja_rotacion, "Baja_Rotacion.xlsx")
 
     st.divider()
     col_d3, col_d4 = st.columns(2)
@@ -943,50 +953,46 @@ with tab_down:
         st.subheader("💰 Cartera y Riesgo")
         
         # 6. Cartera y Antigüedad (Gráfico Tab 5)
-        df_cx_dl = services.cargar_cartera()
+        df_cx_dl, version_cx = services.cargar_cartera.con_version()
         if not df_cx_dl.empty:
             # Resumen por Antigüedad
             res_ant = df_cx_dl.groupby('Antiguedad')['amount_residual'].sum().reset_index()
-            
-            buffer_cx = io.BytesIO()
-            with pd.ExcelWriter(buffer_cx, engine='openpyxl') as writer:
-                df_cx_dl.to_excel(writer, sheet_name='Detalle_Facturas', index=False)
-                res_ant.to_excel(writer, sheet_name='Resumen_Antiguedad', index=False)
-                
-            st.download_button("📥 Reporte Cartera y Antigüedad", data=buffer_cx.getvalue(), file_name="Reporte_Cartera.xlsx")
+            ui.boton_export("Reporte Cartera y Antigüedad", "cartera", version_cx,
+                            lambda avance: ui.libro_excel([('Detalle_Facturas', df_cx_dl), ('Resumen_Antiguedad', res_ant)], avance), "Reporte_Cartera.xlsx")
 
         # 7. Clientes en Riesgo (Alerta Tab 6)
         if not df_main.empty:
-            # Recalcular lógica de riesgo
-            df_risk = df_main.sort_values(['Cliente', 'invoice_date'])
-            df_risk['Prev_Date'] = df_risk.groupby('Cliente')['invoice_date'].shift(1)
-            df_risk['Days_Diff'] = (df_risk['invoice_date'] - df_risk['Prev_Date']).dt.days
-            freq_cli = df_risk.groupby('Cliente')['Days_Diff'].mean().reset_index().rename(columns={'Days_Diff': 'Ciclo_Habitual'})
-            last_buy = df_risk.groupby('Cliente')['invoice_date'].max().reset_index().rename(columns={'invoice_date': 'Ultima_Compra'})
-            df_alerta = pd.merge(freq_cli, last_buy, on='Cliente')
-            df_alerta['Dias_Sin_Comprar'] = (datetime.now() - df_alerta['Ultima_Compra']).dt.days
-            df_alerta['Alerta'] = (df_alerta['Dias_Sin_Comprar'] > (df_alerta['Ciclo_Habitual'] * 1.5)) & (df_alerta['Dias_Sin_Comprar'] < 365)
-            riesgo_dl = df_alerta[df_alerta['Alerta']].copy()
+            riesgo_dl = services.clientes_en_riesgo(version_ventas, df_main)
             
             if not riesgo_dl.empty:
-                st.download_button("📥 Clientes en Riesgo (Alerta Fuga)", data=ui.convert_df_to_excel(riesgo_dl), file_name="Clientes_En_Riesgo.xlsx")
+                ui.boton_export("Clientes en Riesgo (Alerta Fuga)", "riesgo", (version_ventas, hoy),
+                                lambda avance: ui.convert_df_to_excel(riesgo_dl, avance=avance), "Clientes_En_Riesgo.xlsx")
 
     # --- SECCIÓN 4: VENDEDORES ---
     with col_d4:
         st.subheader("👤 Performance")
         if not df_main.empty:
-            perf = df_main.groupby(['Vendedor', df_main['invoice_date'].dt.year])['Venta_Neta'].sum().reset_index()
-            st.download_button("📥 Ventas por Vendedor (Anual)", data=ui.convert_df_to_excel(perf), file_name="Performance_Vendedores.xlsx")
-
-
-
-
-
-
-
-
-
-
+            perf = services.rebanar(cubo, 'Venta_Neta', ['Vendedor', 'Anio']).rename(columns={'Anio': 'invoice_date'})
+            ui.boton_export("Ventas por Vendedor (Anual)", "performance", version_ventas,
+                            lambda avance: ui.convert_df_to_excel(perf, avance=avance), "Performance_Vendedores.xlsx")
 
 
+SECCIONES = dict(zip(NOMBRES_SECCIONES, [seccion_kpis, seccion_renta, seccion_prod, seccion_inv, seccion_cx, seccion_cli, seccion_vend, seccion_det, seccion_down]))
+with perfil.seccion(seccion_activa):
+    SECCIONES[seccion_activa]()
+perfil.cerrar()
+perfil.panel()
 
+# Panel oculto de diagnóstico (?diag=1): RPCs, latencia, bytes y aciertos de caché por loader
+if st.query_params.get("diag") == "1":
+    st.divider()
+    with st.expander("🩺 Diagnóstico", expanded=True):
+        st.dataframe(metricas.resumen().style.format({'ms_total': '{:,.0f}', 'ms_prom': '{:,.1f}', 'ms_max': '{:,.0f}', 'bytes_req': '{:,.0f}', 'bytes_resp': '{:,.0f}', 'filas': '{:,.0f}'}), use_container_width=True, hide_index=True)
+        eventos = metricas.tabla_eventos()
+        st.dataframe(eventos.tail(200).iloc[::-1].assign(ts=lambda d: pd.to_datetime(d['ts'], unit='s')), use_container_width=True, hide_index=True, height=300)
+        c_d1, c_d2 = st.columns(2)
+        with c_d1: st.download_button("📥 Métricas (JSON)", data=metricas.volcar_json(), file_name="metricas_dashboard.json", mime="application/json")
+        with c_d2:
+            if st.button("🧹 Limpiar métricas"):
+                metricas.limpiar()
+                st.rerun()
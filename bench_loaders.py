@@ -0,0 +1,149 @@
+# bench_loaders.py
+# Mide cada loader de services.py contra el Odoo de imitación (odoo_fake.py) a varias escalas.
+# Por loader reporta: segundos en frío, pico de memoria Python (tracemalloc), RPCs, KB recibidos y filas.
+# - El servidor corre en su propio proceso (su memoria no se mezcla con la del loader)
+# - Cada escala corre en subprocesos limpios con un secrets.toml y una caché en disco temporales
+# - Tiempo y memoria se miden en corridas separadas: tracemalloc distorsiona los tiempos
+#
+# Uso:
+#   python bench_loaders.py                                  # 10k, 100k y 1M líneas contables
+#   python bench_loaders.py --escalas 10000 100000 --salida bench.csv
+import argparse
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import xmlrpc.client
+
+REPO = os.path.dirname(os.path.abspath(__file__))
+
+# (loader, argumentos a partir del contexto de la corrida)
+LOADERS = [
+    ('tasas_usd', lambda c: ()),
+    ('get_current_usd_rate', lambda c: ()),
+    ('cargar_datos_generales', lambda c: ()),
+    ('cargar_ventas_clientes', lambda c: ()),
+    ('cargar_cartera', lambda c: ()),
+    ('cargar_detalle_productos', lambda c: ()),
+    ('cargar_inventario_general', lambda c: ()),
+    ('cargar_inventario_baja_rotacion', lambda c: ()),
+    ('cargar_estructura_analitica', lambda c: ()),
+    ('cargar_pnl_historico', lambda c: ()),
+    ('cargar_pnl_agrupado', lambda c: ()),
+    ('cargar_detalle_horas_mes', lambda c: (c['ids_an'],)),
+    ('cargar_inventario_ubicacion_proyecto_v4', lambda c: (c['ids_an'], c['names_an'])),
+    ('cargar_historial_inventario_proyecto', lambda c: (c['ids_an'], c['names_an'])),
+    ('cargar_compras_pendientes_v7_json_scanner', lambda c: (c['ids_an'],)),
+    ('cargar_facturacion_estimada_v2', lambda c: (c['ids_an'],)),
+]
+
+
+# --- CORRIDA DE UNA ESCALA (subproceso) ---
+def _correr(url, memoria):
+    import tracemalloc
+    import logging
+    tmp = tempfile.mkdtemp(prefix='bench_loaders_')
+    os.makedirs(os.path.join(tmp, '.streamlit'))
+    with open(os.path.join(tmp, '.streamlit', 'secrets.toml'), 'w') as f:
+        f.write(f'[odoo]\nurl = "{url}"\ndb = "fake"\nusername = "admin"\npassword = "admin"\ncompany_id = 1\n')
+    os.chdir(tmp)
+    sys.path.insert(0, REPO)
+    logging.disable(logging.WARNING)
+    import services
+    import metricas
+
+    ctx = {}
+    filas = []
+    if memoria: tracemalloc.start()
+    for nombre, argumentos in LOADERS:
+        metricas.limpiar()
+        if memoria: tracemalloc.reset_peak()
+        inicio = time.perf_counter()
+        error = None
+        try:
+            res = getattr(services, nombre)(*argumentos(ctx))
+        except Exception as e:
+            res, error = None, repr(e)
+        segundos = time.perf_counter() - inicio
+        pico = tracemalloc.get_traced_memory()[1] / 1e6 if memoria else None
+        eventos = metricas.eventos()
+        loader = next((e for e in reversed(eventos) if e['tipo'] == 'loader' and e['nombre'] == nombre), {})
+        filas.append({'loader': nombre, 'segundos': segundos, 'pico_mb': pico, 'rpc': sum(1 for e in eventos if e['tipo'] == 'rpc'),
+                      'kb_recibidos': sum(e.get('bytes_resp') or 0 for e in eventos if e['tipo'] == 'rpc') / 1024,
+                      'filas': loader.get('filas'), 'error': error or loader.get('error')})
+        if nombre == 'cargar_estructura_analitica' and res is not None and not res.empty:
+            primeras = res.head(2)
+            ctx['ids_an'] = primeras['id_cuenta_analitica'].tolist()
+            ctx['names_an'] = primeras['Cuenta_Nombre'].tolist()
+    shutil.rmtree(tmp, ignore_errors=True)
+    print(json.dumps(filas))
+
+
+# --- ORQUESTACIÓN ---
+def _puerto_libre():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _levantar_servidor(lineas):
+    puerto = _puerto_libre()
+    proc = subprocess.Popen([sys.executable, os.path.join(REPO, 'odoo_fake.py'), '--lineas', str(lineas), '--puerto', str(puerto)],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{puerto}'
+    # Generar 1M de líneas toma un rato: esperar a que el servidor responda
+    while proc.poll() is None:
+        try:
+            xmlrpc.client.ServerProxy(f'{url}/xmlrpc/2/common').version()
+            return proc, url
+        except OSError:
+            time.sleep(0.5)
+    raise RuntimeError(f'El servidor falso terminó al generar {lineas} líneas')
+
+
+def medir_escala(lineas):
+    import pandas as pd
+    proc, url = _levantar_servidor(lineas)
+    try:
+        corridas = {}
+        for memoria in (False, True):
+            salida = subprocess.run([sys.executable, os.path.abspath(__file__), '--_correr', url] + (['--_memoria'] if memoria else []),
+                                    capture_output=True, text=True, check=True).stdout
+            corridas[memoria] = pd.DataFrame(json.loads(salida.strip().splitlines()[-1]))
+    finally:
+        proc.terminate()
+        proc.wait()
+    df = corridas[False].drop(columns='pico_mb').merge(corridas[True][['loader', 'pico_mb']], on='loader', how='left')
+    df.insert(0, 'escala', lineas)
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de los loaders de services.py contra un Odoo de imitación')
+    parser.add_argument('--escalas', type=int, nargs='+', default=[10000, 100000, 1000000], help='Cantidad de account.move.line por escala')
+    parser.add_argument('--salida', help='Guardar resultados en .csv o .json')
+    parser.add_argument('--_correr', help=argparse.SUPPRESS)
+    parser.add_argument('--_memoria', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args._correr:
+        return _correr(args._correr, args._memoria)
+
+    import pandas as pd
+    resultados = []
+    for lineas in args.escalas:
+        print(f'--- {lineas:,} líneas ---', flush=True)
+        df = medir_escala(lineas)
+        print(df.drop(columns='escala').to_string(index=False, float_format=lambda x: f'{x:,.2f}'), flush=True)
+        resultados.append(df)
+    total = pd.concat(resultados, ignore_index=True)
+    if args.salida:
+        if args.salida.endswith('.json'): total.to_json(args.salida, orient='records', indent=1, force_ascii=False)
+        else: total.to_csv(args.salida, index=False)
+
+
+if __name__ == '__main__':
+    main()
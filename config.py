@@ -10,3 +10,36 @@ ID_PROVISION_PROY = 504
 ID_AJUSTES_INV = 395         
 
 TODOS_LOS_IDS = IDS_INGRESOS + [ID_WIP, ID_PROVISION_PROY, ID_COSTO_INSTALACION, ID_SUMINISTROS_PROY, ID_AJUSTES_INV, ID_COSTO_RETAIL]
+
+# Conexión Odoo
+ODOO_POOL_CONEXIONES = 4     # Conexiones keep-alive reutilizables entre hilos
+ODOO_GZIP_UMBRAL = None      # Bytes a partir de los cuales se comprime la petición (None = nunca; las respuestas gzip siempre se aceptan)
+ODOO_TAM_PAGINA = 2000       # Registros por página en lecturas grandes (read/search_read paginados)
+ODOO_HILOS_LECTURA = 4       # Páginas descargadas en paralelo (no conviene superar ODOO_POOL_CONEXIONES)
+
+# Sincronización incremental
+SYNC_RECARGA_COMPLETA_HORAS = 24   # Cada cuánto se descarta la copia incremental y se recarga todo desde Odoo
+SYNC_SOLAPE_MIN = 10               # Minutos antes de la marca que se vuelven a pedir (transacciones confirmadas tarde)
+
+# Caché persistente en disco
+CACHE_DIR = '.cache_datos'         # Carpeta donde cada loader guarda su último resultado (Parquet + metadatos)
+CACHE_MAX_OBSOLETO_S = 6 * 3600    # Edad máxima de datos servidos mientras se refrescan en segundo plano (luego la recarga bloquea)
+CACHE_MAX_ENTRADAS = 8             # Combinaciones de argumentos que un loader con refresco en segundo plano guarda en memoria
+CACHE_MAX_VARIANTES = 8            # Copias en disco por loader con argumentos (una por combinación, se conservan las más recientes)
+UBICACIONES_TTL_S = 900            # Vigencia del mapeo proyecto -> ubicaciones de stock (y su árbol child_of)
+
+# Tipo de cambio (serie histórica USD compartida por todas las conversiones)
+TASAS_TTL_S = 900                  # Cada cuánto se sincronizan las tasas nuevas de res.currency.rate
+TC_USD_RESPALDO = 515.0            # CRC por USD cuando Odoo no devuelve ninguna tasa
+
+# Metas de venta (metas.csv)
+METAS_URL = "https://raw.githubusercontent.com/jasonsrm12592/dashboard-artk/main/metas.csv"   # Copia publicada (se revalida con ETag/Last-Modified)
+METAS_ARCHIVO = 'metas.csv'        # Copia local usada al arrancar mientras no haya una descarga guardada
+METAS_REVALIDAR_S = 300            # Cada cuánto se consulta si el archivo remoto cambió
+METAS_TIMEOUT_S = 10               # Tiempo máximo de la consulta remota (corre en segundo plano)
+
+# Instrumentación (metricas.py, panel oculto con ?diag=1)
+METRICAS_MAX_EVENTOS = 5000      # Eventos (RPCs, loaders, excepciones) que se conservan en memoria
+
+# Perfilador del render (perfil.py, checkbox en Configuración o ?perfil=1)
+PERFIL_HISTORIAL = 30             # Reruns que se conservan en el historial de la sesión
@@ -0,0 +1,123 @@
+# metricas.py
+import time
+import json
+import threading
+import functools
+import contextlib
+import contextvars
+from collections import deque
+from datetime import datetime
+import pandas as pd
+import config
+
+# Registro en proceso de lo que hacen los loaders y las llamadas a Odoo:
+# - cada RPC: modelo.método, duración, bytes enviados/recibidos, filas devueltas y error si lo hubo
+# - cada cargar_*: duración, RPCs y bytes que disparó, filas, acierto de caché y excepciones tragadas
+# Un loader que termina sin ninguna RPC se sirvió de caché (memoria, disco o copia obsoleta).
+_EVENTOS = deque(maxlen=config.METRICAS_MAX_EVENTOS)
+_LOCK = threading.Lock()
+_ACTIVOS = contextvars.ContextVar('metricas_loaders', default=())
+
+COLUMNAS = ['ts', 'tipo', 'nombre', 'loader', 'ms', 'rpc', 'bytes_req', 'bytes_resp', 'filas', 'cache', 'error', 'anidado', 'hilo']
+
+def registrar(**evento):
+    evento.setdefault('ts', time.time())
+    with _LOCK: _EVENTOS.append(evento)
+
+def eventos():
+    with _LOCK: return list(_EVENTOS)
+
+def limpiar():
+    with _LOCK: _EVENTOS.clear()
+
+def _filas(valor):
+    if isinstance(valor, (pd.DataFrame, pd.Series)): return len(valor)
+    if isinstance(valor, list): return len(valor)
+    if isinstance(valor, tuple):
+        partes = [len(v) for v in valor if isinstance(v, (pd.DataFrame, pd.Series))]
+        return sum(partes) if partes else None
+    return None
+
+# --- HOOK DEL CLIENTE ODOO ---
+def observar_rpc(servicio, metodo, params, segundos, bytes_req, bytes_resp, resultado, error):
+    # execute_kw: (db, uid, password, modelo, método, args[, kw]) -> "modelo.método"
+    nombre = f"{params[3]}.{params[4]}" if servicio == 'object' and len(params) >= 5 else f"{servicio}.{metodo}"
+    activos = _ACTIVOS.get()
+    with _LOCK:
+        for a in activos:
+            a['rpc'] += 1
+            a['bytes_req'] += bytes_req
+            a['bytes_resp'] += bytes_resp
+    registrar(tipo='rpc', nombre=nombre, loader=activos[-1]['nombre'] if activos else None, ms=segundos * 1000, rpc=1,
+              bytes_req=bytes_req, bytes_resp=bytes_resp, filas=_filas(resultado), error=repr(error) if error else None)
+
+# --- LOADERS ---
+def medir(func):
+    # Va por fuera de st.cache_data / cache_persistente para ver también los aciertos de caché
+    nombre = getattr(func, '__name__', repr(func))
+
+    @functools.wraps(func)
+    def envoltura(*args, **kwargs):
+        estado = {'nombre': nombre, 'rpc': 0, 'bytes_req': 0, 'bytes_resp': 0, 'errores': []}
+        anidado = bool(_ACTIVOS.get())
+        token = _ACTIVOS.set(_ACTIVOS.get() + (estado,))
+        inicio = time.perf_counter()
+        resultado, error = None, None
+        try:
+            resultado = func(*args, **kwargs)
+            return resultado
+        except Exception as e:
+            error = repr(e)
+            raise
+        finally:
+            _ACTIVOS.reset(token)
+            errores = ([error] if error else []) + estado['errores']
+            registrar(tipo='loader', nombre=nombre, loader=nombre, ms=(time.perf_counter() - inicio) * 1000, rpc=estado['rpc'],
+                      bytes_req=estado['bytes_req'], bytes_resp=estado['bytes_resp'], filas=_filas(resultado),
+                      cache='hit' if estado['rpc'] == 0 and not errores else 'miss', error='; '.join(errores) or None,
+                      anidado=anidado, hilo=threading.get_ident())
+    if hasattr(func, 'clear'): envoltura.clear = func.clear
+    if hasattr(func, 'con_version'): envoltura.con_version = medir(func.con_version)
+    return envoltura
+
+@contextlib.contextmanager
+def errores_tragados():
+    # Junta las excepciones tragadas dentro del bloque (también en hilos de refresco, sin loader medido activo);
+    # al salir se siguen anotando en el loader que lo envuelve
+    padres = _ACTIVOS.get()
+    estado = {'nombre': padres[-1]['nombre'] if padres else None, 'rpc': 0, 'bytes_req': 0, 'bytes_resp': 0, 'errores': []}
+    token = _ACTIVOS.set(padres + (estado,))
+    try:
+        yield estado['errores']
+    finally:
+        _ACTIVOS.reset(token)
+        if padres: padres[-1]['errores'].extend(estado['errores'])
+
+def tragada(e, valor=None):
+    # Para los except que devuelven un vacío: deja constancia del error en el loader activo y devuelve `valor`
+    activos = _ACTIVOS.get()
+    if activos: activos[-1]['errores'].append(repr(e))
+    registrar(tipo='excepcion', nombre=type(e).__name__, loader=activos[-1]['nombre'] if activos else None, error=repr(e))
+    return valor
+
+# --- CONSULTA ---
+def tabla_eventos():
+    return pd.DataFrame(eventos(), columns=COLUMNAS)
+
+def resumen():
+    df = tabla_eventos()
+    if df.empty: return pd.DataFrame(columns=['tipo', 'nombre', 'llamadas', 'ms_total', 'ms_prom', 'ms_max', 'rpc', 'bytes_req', 'bytes_resp', 'filas', 'hits', 'errores'])
+    df = df.assign(hit=df['cache'].eq('hit'), con_error=df['error'].notna())
+    return (df.groupby(['tipo', 'nombre'], as_index=False)
+              .agg(llamadas=('ts', 'size'), ms_total=('ms', 'sum'), ms_prom=('ms', 'mean'), ms_max=('ms', 'max'), rpc=('rpc', 'sum'),
+                   bytes_req=('bytes_req', 'sum'), bytes_resp=('bytes_resp', 'sum'), filas=('filas', 'sum'), hits=('hit', 'sum'), errores=('con_error', 'sum'))
+              .sort_values('ms_total', ascending=False, ignore_index=True))
+
+def volcar_json():
+    datos = {'generado': datetime.now().isoformat(timespec='seconds'), 'resumen': resumen().to_dict('records'), 'eventos': eventos()}
+    return json.dumps(datos, default=str, ensure_ascii=False, indent=1)
+
+def ms_loaders(desde, hilo=None):
+    # Tiempo en loaders de primer nivel (sin contar los anidados dos veces) registrados desde `desde` en el hilo dado
+    hilo = hilo or threading.get_ident()
+    return sum(e['ms'] for e in eventos() if e['tipo'] == 'loader' and e['ts'] >= desde and e.get('hilo') == hilo and not e.get('anidado'))
@@ -0,0 +1,161 @@
+# odoo_client.py
+import threading
+import time
+import contextvars
+import queue
+import xmlrpc.client
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+# Cliente XML-RPC compartido por todo el proceso:
+# - autentica una sola vez y reutiliza el uid en todas las llamadas
+# - mantiene un pool de conexiones HTTP keep-alive, seguro entre hilos
+# - acepta respuestas gzip y, opcionalmente, comprime las peticiones grandes
+# - si Odoo rechaza la sesión (Access Denied), re-autentica y reintenta una vez
+# - lee listas grandes por páginas en paralelo (pool de hilos acotado) y las reensambla en orden
+# - si se asigna `observador`, le reporta cada llamada (duración, bytes enviados/recibidos, resultado, error)
+
+
+class _ContadorBytes:
+    # Cuenta los bytes leídos del socket (comprimidos, si el servidor respondió con gzip)
+    bytes_resp = 0
+
+    def parse_response(self, response):
+        leer = response.read
+
+        def read(*args):
+            datos = leer(*args)
+            self.bytes_resp += len(datos)
+            return datos
+        response.read = read
+        return super().parse_response(response)
+
+
+class _Transporte(_ContadorBytes, xmlrpc.client.Transport):
+    accept_gzip_encoding = True
+
+
+class _TransporteSeguro(_ContadorBytes, xmlrpc.client.SafeTransport):
+    accept_gzip_encoding = True
+
+
+def _es_sesion_invalida(fault):
+    texto = str(fault.faultString)
+    return fault.faultCode == 3 or 'AccessDenied' in texto or 'Access Denied' in texto or 'Session expired' in texto
+
+
+class ClienteOdoo:
+    def __init__(self, url, db, username, password, pool=4, gzip_umbral=None, tam_pagina=2000, hilos=4):
+        partes = urlsplit(url)
+        self.db = db
+        self.username = username
+        self._password = password
+        self._https = partes.scheme == 'https'
+        self._host = partes.netloc
+        self._base = partes.path.rstrip('/')
+        self._gzip_umbral = gzip_umbral
+        self._pool_max = max(1, int(pool))
+        self._pool = queue.LifoQueue()
+        self._creados = 0
+        self._lock_pool = threading.Lock()
+        self._lock_auth = threading.Lock()
+        self._uid = None
+        self.tam_pagina = tam_pagina
+        self.hilos = hilos
+        self.observador = None
+
+    # --- POOL DE CONEXIONES ---
+    def _nuevo_transporte(self):
+        t = _TransporteSeguro() if self._https else _Transporte()
+        t.encode_threshold = self._gzip_umbral
+        return t
+
+    def _tomar(self):
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock_pool:
+            if self._creados < self._pool_max:
+                self._creados += 1
+                return self._nuevo_transporte()
+        # Pool lleno: esperar a que otro hilo devuelva su conexión
+        return self._pool.get()
+
+    def _devolver(self, transporte):
+        self._pool.put(transporte)
+
+    def _llamar(self, servicio, metodo, params):
+        cuerpo = xmlrpc.client.dumps(params, metodo).encode('utf-8', 'xmlcharrefreplace')
+        t = self._tomar()
+        t.bytes_resp = 0
+        inicio = time.perf_counter()
+        resultado, error = None, None
+        try:
+            # Transport.request ya reintenta una vez si la conexión keep-alive se enfrió
+            resp = t.request(self._host, f'{self._base}/xmlrpc/2/{servicio}', cuerpo)
+            resultado = resp[0] if len(resp) == 1 else resp
+            return resultado
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            bytes_resp = t.bytes_resp
+            self._devolver(t)
+            if self.observador:
+                self.observador(servicio, metodo, params, time.perf_counter() - inicio, len(cuerpo), bytes_resp, resultado, error)
+
+    # --- SESIÓN ---
+    def _autenticar(self):
+        uid = self._llamar('common', 'authenticate', (self.db, self.username, self._password, {}))
+        if not uid:
+            raise PermissionError("Odoo rechazó las credenciales configuradas")
+        return uid
+
+    @property
+    def uid(self):
+        if self._uid is None:
+            with self._lock_auth:
+                if self._uid is None:
+                    self._uid = self._autenticar()
+        return self._uid
+
+    def _invalidar(self, uid_usado):
+        with self._lock_auth:
+            if self._uid == uid_usado:
+                self._uid = None
+
+    def execute_kw(self, model, method, args, kw=None):
+        uid = self.uid
+        extra = (kw,) if kw is not None else ()
+        try:
+            return self._llamar('object', 'execute_kw', (self.db, uid, self._password, model, method, args) + extra)
+        except xmlrpc.client.Fault as e:
+            if not _es_sesion_invalida(e):
+                raise
+        # Sesión expirada o credenciales rotadas: volver a autenticar y reintentar una vez
+        self._invalidar(uid)
+        return self._llamar('object', 'execute_kw', (self.db, self.uid, self._password, model, method, args) + extra)
+
+    # --- LECTURAS POR PÁGINAS ---
+    def _en_paralelo(self, funcion, trabajos, hilos):
+        if len(trabajos) <= 1:
+            return [funcion(t) for t in trabajos]
+        # executor.map conserva el orden de entrada, así las páginas se reensamblan tal cual;
+        # cada página corre en una copia del contexto del llamador (el observador sabe a qué loader pertenece)
+        ctx = contextvars.copy_context()
+        with ThreadPoolExecutor(max_workers=min(hilos or self.hilos, len(trabajos))) as ex:
+            return list(ex.map(lambda t: ctx.copy().run(funcion, t), trabajos))
+
+    def read_paginado(self, model, ids, fields, tam_pagina=None, hilos=None):
+        ids = list(ids)
+        tam = tam_pagina or self.tam_pagina
+        paginas = [ids[i:i + tam] for i in range(0, len(ids), tam)]
+        partes = self._en_paralelo(lambda p: self.execute_kw(model, 'read', [p], {'fields': fields}), paginas, hilos)
+        return [r for parte in partes for r in parte]
+
+    def search_read_paginado(self, model, domain, fields, tam_pagina=None, hilos=None, order='id'):
+        # Se buscan los ids una sola vez y se leen por páginas de ids: paginar por offset en paralelo
+        # saltaba o duplicaba filas si alguien creaba/borraba registros entre página y página
+        ids = self.execute_kw(model, 'search', [domain], {'order': order})
+        return self.read_paginado(model, ids, fields, tam_pagina, hilos)
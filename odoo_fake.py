@@ -0,0 +1,540 @@
+# odoo_fake.py
+# Servidor Odoo de imitación (XML-RPC, solo librería estándar) para medir los loaders de services.py
+# sin tocar la base de producción. Genera datos sintéticos a la escala pedida (# de account.move.line)
+# e implementa common.authenticate y object.execute_kw: search, search_count, read, search_read, read_group y fields_get.
+#
+# Uso:
+#   python odoo_fake.py --lineas 100000 --puerto 8069
+import argparse
+import random
+import re
+import threading
+from datetime import date, datetime, timedelta
+from socketserver import ThreadingMixIn
+from xmlrpc.client import Fault
+from xmlrpc.server import SimpleXMLRPCRequestHandler, SimpleXMLRPCServer
+
+DB = 'fake'
+USUARIO = 'admin'
+CLAVE = 'admin'
+UID = 2
+COMPANY_ID = 1
+
+# Campos many2one por modelo -> modelo destino (read los devuelve como [id, nombre] o False)
+M2O = {
+    'account.move': {'partner_id': 'res.partner', 'invoice_user_id': 'res.users', 'company_id': 'res.company'},
+    'account.move.line': {'move_id': 'account.move', 'product_id': 'product.product', 'account_id': 'account.account', 'company_id': 'res.company'},
+    'account.account': {},
+    'account.analytic.plan': {},
+    'account.analytic.account': {'plan_id': 'account.analytic.plan'},
+    'account.analytic.line': {'account_id': 'account.analytic.account', 'general_account_id': 'account.account', 'company_id': 'res.company'},
+    'res.partner': {'state_id': 'res.country.state'},
+    'res.country.state': {},
+    'res.users': {},
+    'res.company': {},
+    'res.currency': {},
+    'res.currency.rate': {'currency_id': 'res.currency', 'company_id': 'res.company'},
+    'product.product': {'product_tmpl_id': 'product.template', 'brand_alrotek_id': 'x.brand'},
+    'product.template': {},
+    'x.brand': {},
+    'mrp.bom': {'product_tmpl_id': 'product.template'},
+    'stock.location': {'location_id': 'stock.location', 'company_id': 'res.company', 'x_studio_field_qCgKk': 'project.project'},
+    'stock.quant': {'product_id': 'product.product', 'location_id': 'stock.location', 'company_id': 'res.company'},
+    'stock.move': {'product_id': 'product.product', 'location_id': 'stock.location', 'location_dest_id': 'stock.location',
+                   'picking_id': 'stock.picking', 'company_id': 'res.company'},
+    'stock.picking': {},
+    'sale.order': {'analytic_account_id': 'account.analytic.account'},
+    'project.project': {'analytic_account_id': 'account.analytic.account'},
+    'purchase.order': {},
+    'purchase.order.line': {'order_id': 'purchase.order', 'partner_id': 'res.partner', 'currency_id': 'res.currency', 'company_id': 'res.company'},
+    'x_facturas.proyectos': {},
+}
+
+# Campos relacionales "hacia abajo" usados por los loaders en dominios con punto (p.ej. move_id.move_type)
+PADRE = {'stock.location': 'location_id'}
+
+MESES = ['January', 'February', 'March', 'April', 'May', 'June', 'July', 'August', 'September', 'October', 'November', 'December']
+
+
+# --- GENERACIÓN DE DATOS ---
+
+def _fecha(d):
+    return d.strftime('%Y-%m-%d')
+
+
+def _fecha_hora(d):
+    return d.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def generar(lineas=10000, semilla=7):
+    rnd = random.Random(semilla)
+    hoy = date.today()
+    inicio = date(2021, 1, 1)
+    dias_hist = (hoy - inicio).days
+    db = {m: {} for m in M2O}
+
+    def alta(modelo, **vals):
+        nuevo = len(db[modelo]) + 1
+        vals['id'] = nuevo
+        vals.setdefault('write_date', _fecha_hora(datetime.now() - timedelta(days=rnd.randint(0, 900))))
+        db[modelo][nuevo] = vals
+        return nuevo
+
+    alta('res.company', name='Alrotek Fake')
+    usd = alta('res.currency', name='USD')
+    alta('res.currency', name='CRC')
+    for i in range(dias_hist + 1):
+        d = inicio + timedelta(days=i)
+        alta('res.currency.rate', name=_fecha(d), rate=1.0 / (500 + 120 * abs(((i % 730) - 365) / 365.0)), currency_id=usd, company_id=COMPANY_ID)
+
+    provincias = [alta('res.country.state', name=n) for n in ['San José', 'Alajuela', 'Cartago', 'Heredia', 'Guanacaste', 'Puntarenas', 'Limón']]
+    vendedores = [alta('res.users', name=f'Vendedor {i:02d}') for i in range(1, 13)]
+    n_clientes = max(50, lineas // 200)
+    clientes = [alta('res.partner', name=f'Cliente {i:05d}', state_id=rnd.choice(provincias),
+                     x_studio_zona=rnd.choice(['GAM', 'Norte', 'Sur', 'Caribe', 'Pacífico']),
+                     x_studio_categoria_cliente=rnd.choice(['Retail', 'Integrador', 'Gobierno', 'Corporativo']))
+                for i in range(1, n_clientes + 1)]
+    proveedores = [alta('res.partner', name=f'Proveedor {i:03d}', state_id=False, x_studio_zona=False, x_studio_categoria_cliente=False) for i in range(1, 21)]
+
+    marcas = [alta('x.brand', name=n) for n in ['Axis', 'Hikvision', 'Ubiquiti', 'Cisco', 'Genérica']]
+    n_prod = max(100, lineas // 100)
+    productos = []
+    for i in range(1, n_prod + 1):
+        tmpl = alta('product.template', name=f'Producto {i:05d}')
+        productos.append(alta('product.product', name=f'[{100 + i % 20}{i:05d}] Producto {i:05d}', default_code=f'REF{i:05d}',
+                              qty_available=float(rnd.randint(0, 50)), standard_price=round(rnd.uniform(5, 900), 2),
+                              detailed_type=rnd.choice(['product', 'product', 'product', 'consu', 'service']),
+                              brand_alrotek_id=rnd.choice(marcas + [False]), product_tmpl_id=tmpl, active=rnd.random() > 0.05))
+    for tmpl in rnd.sample(range(1, n_prod + 1), max(1, n_prod // 50)):
+        alta('mrp.bom', type='phantom', product_tmpl_id=tmpl)
+
+    # Plan contable (ids fijos de config.py)
+    for aid, code in [(58, '4101'), (384, '4102'), (76, '5101'), (399, '5102'), (400, '5103'), (503, '1405'), (504, '2105'), (395, '5104')]:
+        db['account.account'][aid] = {'id': aid, 'code': code, 'name': f'Cuenta {code}', 'write_date': _fecha_hora(datetime.now())}
+    for aid in range(600, 610):
+        db['account.account'][aid] = {'id': aid, 'code': f'6{aid}', 'name': f'Gasto {aid}', 'write_date': _fecha_hora(datetime.now())}
+
+    planes = [alta('account.analytic.plan', name=n) for n in ['Proyectos', 'Retail', 'Servicios', 'Mantenimiento']]
+    n_cuentas = max(20, lineas // 2000)
+    cuentas_an = [alta('account.analytic.account', name=f'PROY-{i:04d} Instalación', plan_id=rnd.choice(planes), active=True) for i in range(1, n_cuentas + 1)]
+
+    # Ubicaciones: BP/Stock + clientes + producción + una bodega por proyecto (y su PROJ/POST)
+    bp = alta('stock.location', name='BP', complete_name='BP', usage='view', location_id=False, company_id=COMPANY_ID, x_studio_field_qCgKk=False)
+    bp_stock = alta('stock.location', name='Stock', complete_name='BP/Stock', usage='internal', location_id=bp, company_id=COMPANY_ID, x_studio_field_qCgKk=False)
+    estantes = [alta('stock.location', name=f'E{i}', complete_name=f'BP/Stock/E{i}', usage='internal', location_id=bp_stock, company_id=COMPANY_ID, x_studio_field_qCgKk=False) for i in range(1, 6)]
+    partners = alta('stock.location', name='Partner Locations', complete_name='Partner Locations', usage='view', location_id=False, company_id=False, x_studio_field_qCgKk=False)
+    loc_cliente = alta('stock.location', name='Customers', complete_name='Partner Locations/Customers', usage='customer', location_id=partners, company_id=False, x_studio_field_qCgKk=False)
+    virtual = alta('stock.location', name='Virtual Locations', complete_name='Virtual Locations', usage='view', location_id=False, company_id=False, x_studio_field_qCgKk=False)
+    loc_prod = alta('stock.location', name='Production', complete_name='Virtual Locations/Production', usage='production', location_id=virtual, company_id=COMPANY_ID, x_studio_field_qCgKk=False)
+    proj_root = alta('stock.location', name='PROJ', complete_name='PROJ', usage='view', location_id=False, company_id=COMPANY_ID, x_studio_field_qCgKk=False)
+    post_root = alta('stock.location', name='POST', complete_name='PROJ/POST', usage='view', location_id=proj_root, company_id=COMPANY_ID, x_studio_field_qCgKk=False)
+
+    proyectos, bodegas_proy = [], {}
+    for cta in cuentas_an:
+        nombre = db['account.analytic.account'][cta]['name']
+        pid = alta('project.project', name=nombre, analytic_account_id=cta)
+        proyectos.append(pid)
+        b = alta('stock.location', name=nombre, complete_name=f'PROJ/{nombre}', usage='internal', location_id=proj_root, company_id=COMPANY_ID, x_studio_field_qCgKk=pid)
+        alta('stock.location', name='Sitio', complete_name=f'PROJ/{nombre}/Sitio', usage='internal', location_id=b, company_id=COMPANY_ID, x_studio_field_qCgKk=False)
+        post = alta('stock.location', name=nombre, complete_name=f'PROJ/POST/{nombre}', usage='internal', location_id=post_root, company_id=COMPANY_ID, x_studio_field_qCgKk=False)
+        bodegas_proy[cta] = (b, post)
+
+    internas = estantes + [b for b, _ in bodegas_proy.values()]
+    for pid in productos:
+        for loc in rnd.sample(internas, 2):
+            alta('stock.quant', product_id=pid, location_id=loc, quantity=float(rnd.randint(-2, 40)), company_id=COMPANY_ID)
+
+    # Movimientos de inventario (la mitad del volumen de líneas contables)
+    pickings = [alta('stock.picking', name=f'WH/OUT/{i:05d}') for i in range(1, max(10, lineas // 500) + 1)]
+    for cta in cuentas_an:
+        alta('sale.order', name=f'SO{cta:05d}', analytic_account_id=cta, picking_ids=rnd.sample(pickings, min(3, len(pickings))))
+    rutas = [(bp_stock, loc_cliente), (loc_cliente, bp_stock), (bp_stock, loc_prod), (loc_prod, bp_stock)]
+    for i in range(lineas // 2):
+        if rnd.random() < 0.4:
+            b, post = bodegas_proy[rnd.choice(cuentas_an)]
+            origen, destino = rnd.choice([(bp_stock, b), (b, loc_prod), (loc_prod, b), (b, loc_cliente), (post, b), (b, post)])
+        else:
+            origen, destino = rnd.choice(rutas)
+        qty = float(rnd.randint(1, 20))
+        alta('stock.move', product_id=rnd.choice(productos), product_uom_qty=qty, quantity_done=qty,
+             location_id=origen, location_dest_id=destino, date=_fecha_hora(datetime.now() - timedelta(days=rnd.randint(0, dias_hist), minutes=rnd.randint(0, 1440))),
+             state=rnd.choice(['done'] * 9 + ['cancel']), picking_id=rnd.choice(pickings + [False] * 4), company_id=COMPANY_ID)
+
+    # Facturas de cliente y sus líneas de producto
+    n_facturas = max(20, lineas // 5)
+    facturas = []
+    for i in range(1, n_facturas + 1):
+        d = inicio + timedelta(days=rnd.randint(0, dias_hist))
+        tipo = 'out_refund' if rnd.random() < 0.05 else 'out_invoice'
+        monto = round(rnd.uniform(10000, 5000000), 2) * (-1 if tipo == 'out_refund' else 1)
+        residual = abs(monto) * rnd.choice([0, 0, 0, 0.5, 1])
+        facturas.append(alta('account.move', name=f"{'WT-' if rnd.random() < 0.01 else 'FAC'}{i:07d}", move_type=tipo,
+                             state=rnd.choice(['posted'] * 18 + ['cancel', 'draft']), invoice_date=_fecha(d),
+                             invoice_date_due=_fecha(d + timedelta(days=rnd.choice([0, 15, 30, 60]))),
+                             amount_untaxed_signed=monto, amount_total=abs(monto) * 1.13, amount_residual=residual,
+                             payment_state='paid' if residual == 0 else ('partial' if residual < abs(monto) else 'not_paid'),
+                             partner_id=rnd.choice(clientes), invoice_user_id=rnd.choice(vendedores), company_id=COMPANY_ID))
+    cuentas_costo = [76, 399, 400, 503, 504, 395] + list(range(600, 610))
+    for i in range(lineas):
+        mv = db['account.move'][rnd.choice(facturas)]
+        if rnd.random() < 0.7:
+            cuenta = rnd.choice([58, 384])
+            display = 'product'
+        else:
+            cuenta = rnd.choice(cuentas_costo)
+            display = 'cogs'
+        dist = False
+        if rnd.random() < 0.6:
+            dist = {str(rnd.choice(cuentas_an)): 100.0}
+            if rnd.random() < 0.1:
+                dist = {str(rnd.choice(cuentas_an)): 60.0, str(rnd.choice(cuentas_an)): 40.0}
+        monto = round(rnd.uniform(1000, 400000), 2)
+        credito = cuenta in (58, 384)
+        alta('account.move.line', move_id=mv['id'], parent_state=mv['state'], date=mv['invoice_date'], product_id=rnd.choice(productos),
+             credit=monto if credito else 0.0, debit=0.0 if credito else monto, quantity=float(rnd.randint(1, 10)), display_type=display,
+             account_id=cuenta, analytic_distribution=dist, company_id=COMPANY_ID)
+
+    for cta in cuentas_an:
+        for _ in range(rnd.randint(0, 12)):
+            alta('account.analytic.line', account_id=cta, date=_fecha(hoy - timedelta(days=rnd.randint(0, hoy.day - 1))), unit_amount=float(rnd.randint(1, 9)),
+                 amount=-round(rnd.uniform(3000, 15000), 2), x_studio_tipo_horas_1=rnd.choice(['Normal', 'Extra', 'Doble']))
+
+    ordenes = [alta('purchase.order', name=f'P{i:05d}') for i in range(1, max(10, lineas // 100) + 1)]
+    for oc in ordenes:
+        recibido_total = True
+        for _ in range(rnd.randint(1, 4)):
+            qty = float(rnd.randint(1, 30))
+            # Política de facturación: sobre lo pedido o sobre lo recibido (qty_to_invoice la calcula Odoo y queda guardada)
+            recibido = float(rnd.choice([0, rnd.randint(0, int(qty)), int(qty)]))
+            por_recibido = rnd.random() < 0.5
+            facturado = float(rnd.randint(0, int(recibido if por_recibido else qty)))
+            recibido_total &= recibido >= qty
+            alta('purchase.order.line', order_id=oc, partner_id=rnd.choice(proveedores), name=f'Compra {oc}', product_qty=qty,
+                 qty_received=recibido, qty_invoiced=facturado, qty_to_invoice=(recibido if por_recibido else qty) - facturado,
+                 price_unit=round(rnd.uniform(5, 800), 2),
+                 analytic_distribution={str(rnd.choice(cuentas_an)): 100.0} if rnd.random() < 0.7 else False,
+                 currency_id=rnd.choice([1, 2]), state=rnd.choice(['purchase', 'done', 'cancel']), company_id=COMPANY_ID,
+                 date_order=_fecha_hora(datetime.now() - timedelta(days=rnd.randint(0, 900))))
+        db['purchase.order'][oc]['receipt_status'] = 'full' if recibido_total else 'partial'
+    for cta in cuentas_an:
+        nombre = db['account.analytic.account'][cta]['name']
+        for h in range(rnd.randint(0, 3)):
+            alta('x_facturas.proyectos', x_name=f'Hito {h + 1}', x_Monto=round(rnd.uniform(1000, 30000), 2), x_Fecha=_fecha(hoy + timedelta(days=30 * h)),
+                 x_studio_field_sFPxe=nombre, x_studio_facturado=rnd.random() < 0.3)
+
+    # Apuntes analíticos de las líneas publicadas: uno por cuenta de la distribución, con el monto prorrateado
+    # (como Odoo al publicar; las claves "a,b" de un plan por cuenta quedan acá como un apunte por cuenta)
+    for ml in list(db['account.move.line'].values()):
+        if ml['parent_state'] != 'posted' or not ml['analytic_distribution']:
+            continue
+        for clave, pct in ml['analytic_distribution'].items():
+            for cta in clave.split(','):
+                alta('account.analytic.line', account_id=int(cta), general_account_id=ml['account_id'], move_line_id=ml['id'], date=ml['date'],
+                     amount=round((ml['credit'] - ml['debit']) * pct / 100.0, 2), company_id=COMPANY_ID)
+    return db
+
+
+# --- EVALUACIÓN DE DOMINIOS ---
+
+def _arbol(dominio):
+    elementos = iter(dominio)
+
+    def nodo():
+        t = next(elementos)
+        if t in ('&', '|'):
+            return (t, nodo(), nodo())
+        if t == '!':
+            return ('!', nodo())
+        return ('hoja', tuple(t))
+    nodos = []
+    while True:
+        try:
+            nodos.append(nodo())
+        except StopIteration:
+            break
+    arbol = nodos[-1] if nodos else None
+    for n in reversed(nodos[:-1]):
+        arbol = ('&', n, arbol)
+    return arbol
+
+
+def _like(patron, valor, sensible):
+    rx = '^' + '.*'.join(re.escape(p) for p in patron.split('%')).replace('_', '.') + '$'
+    return re.match(rx, valor, 0 if sensible else re.IGNORECASE) is not None
+
+
+class Base:
+    def __init__(self, datos):
+        self.db = datos
+        self._hijos = None
+        # Los datos no cambian: las lecturas paginadas repiten el mismo dominio, se filtra una sola vez
+        self._memo = {}
+        self._lock_memo = threading.Lock()
+
+    def _descendientes(self, modelo, ids):
+        campo = PADRE.get(modelo)
+        if not campo:
+            return set(ids)
+        if self._hijos is None:
+            self._hijos = {}
+            for r in self.db[modelo].values():
+                self._hijos.setdefault(r.get(campo), []).append(r['id'])
+        res, pila = set(), list(ids)
+        while pila:
+            i = pila.pop()
+            if i not in res:
+                res.add(i)
+                pila.extend(self._hijos.get(i, []))
+        return res
+
+    def _valor(self, modelo, rec, ruta):
+        campo, _, resto = ruta.partition('.')
+        v = rec.get(campo, False)
+        if resto:
+            destino = M2O.get(modelo, {}).get(campo)
+            if not destino or not v:
+                return False
+            return self._valor(destino, self.db[destino][v], resto)
+        return v
+
+    def _hoja(self, modelo, rec, campo, op, valor):
+        if campo == 'analytic_distribution' and op in ('in', '='):
+            dist = rec.get('analytic_distribution') or {}
+            if valor is False:
+                return not dist
+            buscados = {str(x) for x in (valor if isinstance(valor, list) else [valor])}
+            return any(k in buscados for k in dist)
+        if op == 'child_of':
+            memo = getattr(self, '_cache_child', None)
+            if memo is None:
+                memo = self._cache_child = {}
+            clave = (modelo, tuple(valor) if isinstance(valor, list) else (valor,))
+            if clave not in memo:
+                memo[clave] = self._descendientes(modelo, list(clave[1]))
+            objetivo = memo[clave]
+            v = self._valor(modelo, rec, campo)
+            return (v if campo != 'id' else rec['id']) in objetivo
+        v = self._valor(modelo, rec, campo)
+        try:
+            if op == '=':
+                return v == valor or (valor is False and not v)
+            if op == '!=':
+                return not (v == valor or (valor is False and not v))
+            if op == 'in':
+                return v in valor or (False in valor and not v)
+            if op == 'not in':
+                return v not in valor
+            if v is False or v is None:
+                return False
+            if op == '>':
+                return v > valor
+            if op == '>=':
+                return v >= valor
+            if op == '<':
+                return v < valor
+            if op == '<=':
+                return v <= valor
+            if op in ('like', 'ilike'):
+                return _like(f'%{valor}%', str(v), op == 'like')
+            if op in ('=like', '=ilike'):
+                return _like(valor, str(v), op == '=like')
+        except TypeError:
+            return False
+        raise Fault(1, f'Operador no soportado: {op}')
+
+    def _cumple(self, modelo, rec, arbol):
+        if arbol is None:
+            return True
+        if arbol[0] == 'hoja':
+            campo, op, valor = arbol[1]
+            return self._hoja(modelo, rec, campo, op, valor)
+        if arbol[0] == '!':
+            return not self._cumple(modelo, rec, arbol[1])
+        if arbol[0] == '&':
+            return self._cumple(modelo, rec, arbol[1]) and self._cumple(modelo, rec, arbol[2])
+        return self._cumple(modelo, rec, arbol[1]) or self._cumple(modelo, rec, arbol[2])
+
+    # --- API ORM ---
+    def _tabla(self, modelo):
+        if modelo not in self.db:
+            raise Fault(2, f"Object {modelo} doesn't exist")
+        return self.db[modelo]
+
+    def _filtrar(self, modelo, dominio, offset=0, limit=None, order=None):
+        clave = (modelo, repr(dominio), order)
+        with self._lock_memo:
+            res = self._memo.get(clave)
+        if res is None:
+            res = self._filtrar_todo(modelo, dominio, order)
+            with self._lock_memo:
+                if len(self._memo) > 64:
+                    self._memo.clear()
+                self._memo[clave] = res
+        res = res[offset:]
+        return res[:limit] if limit else res
+
+    def _filtrar_todo(self, modelo, dominio, order):
+        tabla = self._tabla(modelo)
+        arbol = _arbol(dominio or [])
+        self._cache_child = {}
+        if 'active' not in str(dominio):
+            regs = [r for r in tabla.values() if r.get('active', True) is not False]
+        else:
+            regs = list(tabla.values())
+        res = [r for r in regs if self._cumple(modelo, r, arbol)]
+        if order:
+            for parte in reversed([p.strip() for p in order.split(',')]):
+                campo, _, sentido = parte.partition(' ')
+                res.sort(key=lambda r: (r.get(campo) is False, r.get(campo) or 0), reverse=sentido.lower() == 'desc')
+        return res
+
+    def _formatear(self, modelo, rec, campos):
+        salida = {'id': rec['id']}
+        for c in (campos or [k for k in rec if k != 'id']):
+            v = rec.get(c, False)
+            destino = M2O.get(modelo, {}).get(c)
+            if destino and v:
+                r = self.db[destino].get(v, {})
+                v = [v, r.get('complete_name') or r.get('name') or str(v)]
+            salida[c] = v
+        return salida
+
+    def search(self, modelo, dominio, offset=0, limit=None, order=None):
+        return [r['id'] for r in self._filtrar(modelo, dominio, offset, limit, order)]
+
+    def search_count(self, modelo, dominio):
+        return len(self._filtrar(modelo, dominio))
+
+    def read(self, modelo, ids, fields=None):
+        tabla = self._tabla(modelo)
+        return [self._formatear(modelo, tabla[i], fields) for i in ids if i in tabla]
+
+    def search_read(self, modelo, dominio=None, fields=None, offset=0, limit=None, order=None):
+        return [self._formatear(modelo, r, fields) for r in self._filtrar(modelo, dominio, offset, limit, order)]
+
+    def fields_get(self, modelo, allfields=None, attributes=None):
+        tabla = self._tabla(modelo)
+        campos = {c for r in list(tabla.values())[:200] for c in r} | set(M2O.get(modelo, {}))
+        salida = {}
+        for c in sorted(campos):
+            destino = M2O.get(modelo, {}).get(c)
+            salida[c] = {'type': 'many2one', 'relation': destino} if destino else {'type': 'char'}
+        return salida
+
+    def read_group(self, modelo, dominio, fields, groupby, offset=0, limit=None, orderby=False, lazy=True):
+        groupby = [groupby] if isinstance(groupby, str) else list(groupby)
+        if lazy:
+            groupby = groupby[:1]
+        # Igual que Odoo 17: agrupar por analytic_distribution separa las claves en cuentas (enteros)
+        # y solo admite __count; una suma repetiría el monto completo de la línea en cada cuenta
+        if 'analytic_distribution' in groupby:
+            for f in fields:
+                if f.partition(':')[0] not in groupby and f != '__count':
+                    raise Fault(1, f'ValueError: analytic_distribution grouping does not accept {f} as aggregate.')
+        grupos = {}
+        for r in self._filtrar(modelo, dominio):
+            claves = [[]]
+            for g in groupby:
+                campo, _, gran = g.partition(':')
+                v = r.get(campo, False)
+                if gran and v:
+                    d = datetime.strptime(str(v)[:10], '%Y-%m-%d')
+                    v = d.strftime('%Y-%m-01') if gran == 'month' else (d.strftime('%Y-01-01') if gran == 'year' else d.strftime('%Y-%m-%d'))
+                if campo == 'analytic_distribution':
+                    cuentas = sorted({int(c) for k in (v or {}) for c in k.split(',')}) or [False]
+                    claves = [k + [c] for k in claves for c in cuentas]
+                else:
+                    claves = [k + [v] for k in claves]
+            for clave in claves:
+                grupos.setdefault(tuple(clave), []).append(r)
+        salida = []
+        for clave, regs in grupos.items():
+            fila = {'__count': len(regs), '__domain': list(dominio or [])}
+            for g, v in zip(groupby, clave):
+                campo, _, gran = g.partition(':')
+                destino = M2O.get(modelo, {}).get(campo)
+                if gran and v:
+                    d = datetime.strptime(v, '%Y-%m-%d')
+                    hasta = date(d.year + (d.month == 12), d.month % 12 + 1, 1) if gran == 'month' else date(d.year + 1, 1, 1)
+                    fila[g] = f'{MESES[d.month - 1]} {d.year}' if gran == 'month' else str(d.year)
+                    fila.setdefault('__range', {})[g] = {'from': v, 'to': _fecha(hasta)}
+                    fila['__domain'] += [[campo, '>=', v], [campo, '<', _fecha(hasta)]]
+                elif destino and v:
+                    r = self.db[destino].get(v, {})
+                    fila[g] = [v, r.get('complete_name') or r.get('name') or str(v)]
+                    fila['__domain'].append([campo, '=', v])
+                else:
+                    fila[g] = v
+            for f in fields:
+                campo, _, agg = f.partition(':')
+                if campo in groupby or campo in ('id', '__count'):
+                    continue
+                vals = [r.get(campo) for r in regs if r.get(campo) not in (False, None)]
+                if agg in ('', 'sum'):
+                    fila[campo] = sum(vals) if vals else 0
+                elif agg == 'max':
+                    fila[campo] = max(vals) if vals else False
+                elif agg == 'min':
+                    fila[campo] = min(vals) if vals else False
+                elif agg == 'count':
+                    fila[campo] = len(vals)
+            salida.append(fila)
+        return salida[offset:(offset + limit) if limit else None]
+
+
+class _Manejador(SimpleXMLRPCRequestHandler):
+    rpc_paths = ('/xmlrpc/2/common', '/xmlrpc/2/object')
+    protocol_version = 'HTTP/1.1'
+
+
+class _Servidor(ThreadingMixIn, SimpleXMLRPCServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class ServidorOdooFalso:
+    def __init__(self, lineas=10000, puerto=0, semilla=7):
+        self.base = Base(generar(lineas, semilla))
+        self.llamadas = 0
+        self._lock = threading.Lock()
+        self.servidor = _Servidor(('127.0.0.1', puerto), requestHandler=_Manejador, logRequests=False, allow_none=True)
+        self.servidor.register_function(self.authenticate, 'authenticate')
+        self.servidor.register_function(self.execute_kw, 'execute_kw')
+        self.servidor.register_function(lambda: {'server_version': '16.0'}, 'version')
+        self._hilo = None
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.servidor.server_address[1]}'
+
+    def authenticate(self, db, usuario, clave, contexto):
+        return UID if (db, usuario, clave) == (DB, USUARIO, CLAVE) else False
+
+    def execute_kw(self, db, uid, clave, modelo, metodo, args, kw=None):
+        if (db, uid, clave) != (DB, UID, CLAVE):
+            raise Fault(3, 'Access Denied')
+        with self._lock:
+            self.llamadas += 1
+        funcion = getattr(self.base, metodo, None) if not metodo.startswith('_') else None
+        if funcion is None:
+            raise Fault(2, f'Método no soportado: {metodo}')
+        return funcion(modelo, *args, **(kw or {}))
+
+    def iniciar(self):
+        self._hilo = threading.Thread(target=self.servidor.serve_forever, daemon=True)
+        self._hilo.start()
+        return self
+
+    def detener(self):
+        self.servidor.shutdown()
+        self.servidor.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Servidor Odoo de imitación para pruebas de rendimiento')
+    parser.add_argument('--lineas', type=int, default=10000, help='Cantidad de account.move.line a generar (10000 / 100000 / 1000000)')
+    parser.add_argument('--puerto', type=int, default=8069)
+    args = parser.parse_args()
+    srv = ServidorOdooFalso(args.lineas, args.puerto)
+    print(f'Odoo falso en {srv.url} (db={DB}, usuario={USUARIO}, clave={CLAVE}, company_id={COMPANY_ID})')
+    srv.servidor.serve_forever()
@@ -0,0 +1,117 @@
+# perfil.py
+import time
+import marshal
+import cProfile
+import contextlib
+import contextvars
+import streamlit as st
+import pandas as pd
+import config
+import metricas
+
+# Perfilador opcional del render (checkbox "Perfilar render" en Configuración o ?perfil=1).
+# Cada rerun mide la sección activa y los bloques con nombre, repartiendo su tiempo en fases:
+#   datos (loaders, vía metricas) · transformacion (pandas) · figura (plotly/Styler) · serializacion (envío al navegador, Excel)
+# Lo que no cae en ningún bloque queda como "otros". Se guarda un historial acotado en session_state
+# y, a pedido, un volcado cProfile (.prof) de un rerun completo (snakeviz, flameprof, python -m pstats).
+FASES = ['datos', 'transformacion', 'figura', 'serializacion', 'otros']
+
+_RERUN = contextvars.ContextVar('perfil_rerun', default=None)
+
+def activo():
+    return bool(st.session_state.get("perfil_activo")) or st.query_params.get("perfil") == "1"
+
+def iniciar():
+    # Al inicio del script: abre el registro del rerun y, si se pidió, arranca cProfile
+    viejo = st.session_state.pop("_perfil_cprofile", None)
+    if viejo: viejo.disable()
+    if not activo():
+        _RERUN.set(None)
+        return
+    rerun = {'ts': time.time(), 'inicio': time.perf_counter(), 'seccion': None, 'bloques': []}
+    if st.session_state.pop("perfil_capturar", False):
+        rerun['cprofile'] = cProfile.Profile()
+        st.session_state["_perfil_cprofile"] = rerun['cprofile']
+        rerun['cprofile'].enable()
+    _RERUN.set(rerun)
+
+@contextlib.contextmanager
+def medir(bloque, fase='transformacion'):
+    rerun = _RERUN.get()
+    if rerun is None:
+        yield
+        return
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        rerun['bloques'].append((rerun['seccion'] or 'Encabezado', bloque, fase, (time.perf_counter() - inicio) * 1000))
+
+@contextlib.contextmanager
+def seccion(nombre):
+    # Tiempo total de la sección; lo que gastaron sus loaders se anota como fase "datos"
+    rerun = _RERUN.get()
+    if rerun is None:
+        yield
+        return
+    rerun['seccion'] = nombre
+    inicio, ts = time.perf_counter(), time.time()
+    try:
+        yield
+    finally:
+        rerun['bloques'].append((nombre, 'Loaders', 'datos', metricas.ms_loaders(ts)))
+        rerun['total_seccion'] = (time.perf_counter() - inicio) * 1000
+
+def cerrar():
+    # Al final del script: cierra el rerun, lo agrega al historial y guarda el .prof si se capturó
+    rerun = _RERUN.get()
+    if rerun is None: return None
+    _RERUN.set(None)
+    if rerun.get('cprofile'):
+        rerun['cprofile'].disable()
+        st.session_state.pop("_perfil_cprofile", None)
+        st.session_state["perfil_prof"] = _volcar(rerun['cprofile'])
+    total = (time.perf_counter() - rerun['inicio']) * 1000
+    df = pd.DataFrame(rerun['bloques'], columns=['Seccion', 'Bloque', 'Fase', 'ms'])
+    if rerun['seccion']:
+        # Resto no atribuido de la sección (widgets, texto, cálculos sin bloque)
+        resto = rerun.get('total_seccion', 0) - df.loc[df['Seccion'] == rerun['seccion'], 'ms'].sum()
+        df.loc[len(df)] = [rerun['seccion'], '(resto)', 'otros', max(resto, 0.0)]
+    # Encabezado: configuración, carga inicial, cubos y navegación (todo lo que corre antes de la sección)
+    resto = total - rerun.get('total_seccion', 0) - df.loc[df['Seccion'] == 'Encabezado', 'ms'].sum()
+    df.loc[len(df)] = ['Encabezado', '(resto)', 'otros', max(resto, 0.0)]
+    historial = st.session_state.setdefault("perfil_historial", [])
+    historial.append({'ts': rerun['ts'], 'seccion': rerun['seccion'], 'total_ms': total, 'bloques': df})
+    del historial[:-config.PERFIL_HISTORIAL]
+    return df
+
+def _volcar(perfilador):
+    # Mismo formato que Profile.dump_stats: lo leen snakeviz, flameprof, gprof2dot y python -m pstats
+    perfilador.create_stats()
+    return marshal.dumps(perfilador.stats)
+
+def historial():
+    filas = [{'Hora': pd.Timestamp(h['ts'], unit='s'), 'Seccion': h['seccion'], 'Total_ms': h['total_ms'],
+              **h['bloques'].groupby('Fase')['ms'].sum().reindex(FASES, fill_value=0.0).to_dict()} for h in st.session_state.get("perfil_historial", [])]
+    return pd.DataFrame(filas, columns=['Hora', 'Seccion', 'Total_ms'] + FASES)
+
+def panel():
+    # Tabla del último rerun (bloque × fase), historial y descarga del cProfile
+    hist = st.session_state.get("perfil_historial", [])
+    if not hist: return
+    ultimo = hist[-1]
+    with st.expander(f"⏱️ Perfil del render · último rerun {ultimo['total_ms']:,.0f} ms", expanded=True):
+        tabla = ultimo['bloques'].pivot_table(index=['Seccion', 'Bloque'], columns='Fase', values='ms', aggfunc='sum', fill_value=0.0)
+        tabla = tabla.reindex(columns=[f for f in FASES if f in tabla.columns])
+        tabla['Total'] = tabla.sum(axis=1)
+        st.dataframe(tabla.sort_values('Total', ascending=False).style.format('{:,.1f}'), use_container_width=True)
+        st.caption(f"Historial (últimos {len(hist)} reruns, ms)")
+        st.dataframe(historial().iloc[::-1].style.format({f: '{:,.0f}' for f in ['Total_ms'] + FASES}), use_container_width=True, hide_index=True, height=200)
+        c1, c2 = st.columns(2)
+        with c1:
+            if st.button("🎯 Capturar cProfile del próximo rerun"):
+                st.session_state["perfil_capturar"] = True
+                st.rerun()
+        with c2:
+            if st.session_state.get("perfil_prof"):
+                st.download_button("📥 Descargar perfil (.prof)", data=st.session_state["perfil_prof"], file_name="rerun.prof", mime="application/octet-stream")
@@ -1,11 +1,25 @@
 # services.py
 import streamlit as st
 import pandas as pd
-import xmlrpc.client
 from datetime import datetime, timedelta
 import ast
+import io
 import os
+import json
+import re
+import hashlib
+import inspect
+import functools
+import glob
+import threading
+import time
+import xmlrpc.client
+import urllib.error
+import urllib.request
+import numpy as np
 import config
+import odoo_client
+import metricas
 
 # --- CREDENCIALES ---
 try:
@@ -18,154 +32,632 @@ except Exception:
     st.error("❌ Error: Credenciales no encontradas en .streamlit/secrets.toml")
     st.stop()
 
-# --- FUNCIONES DE CARGA DE DATOS ---
+# --- CONEXIÓN ODOO (una sola sesión por proceso, compartida por todos los loaders) ---
+odoo = odoo_client.ClienteOdoo(URL, DB, USERNAME, PASSWORD, pool=config.ODOO_POOL_CONEXIONES, gzip_umbral=config.ODOO_GZIP_UMBRAL,
+                                 tam_pagina=config.ODOO_TAM_PAGINA, hilos=config.ODOO_HILOS_LECTURA)
+odoo.observador = metricas.observar_rpc   # RPCs, latencia y bytes por loader (panel ?diag=1)
 
-@st.cache_data(ttl=3600)
-def get_current_usd_rate():
+# --- CACHÉ PERSISTENTE EN DISCO (Parquet) ---
+# Cada loader deja su último DataFrame en CACHE_DIR/<nombre>.parquet con un .json de metadatos
+# (fecha de descarga, firma del dominio/argumentos, filas). Al arrancar el proceso se sirve esa copia
+# de inmediato y la descarga real corre en segundo plano; cuando termina, las siguientes llamadas
+# ya leen de st.cache_data. Si la descarga falla (el loader tragó una excepción y devolvió su vacío de respaldo),
+# se sigue sirviendo la copia anterior, se anota el fallo en metricas y se reintenta al minuto. La firma incluye el código del loader, así un cambio de dominio la invalida,
+# y su version=: el código de los helpers (compactar, _procesar_pnl, sincronizar_incremental...) no entra en
+# la firma, así que al cambiar un loader o algo de lo que depende hay que subir su version.
+_ARRANQUE_VISTO = set()
+_SNAPSHOT_ACTIVO = {}
+_DISCO_LOCK = threading.Lock()
+
+class _CargaFallida(Exception):
+    # La descarga tragó errores: su resultado (res) no debe reemplazar una copia buena
+    def __init__(self, nombre, res, errores):
+        super().__init__(f"{nombre}: {'; '.join(errores)}")
+        self.res = res
+
+def _anotar_fallo(nombre, e):
+    metricas.registrar(tipo='excepcion', nombre='CargaFallida', loader=nombre, error=str(e))
+
+def _firma(nombre, fuente, args=(), kwargs=None):
+    return hashlib.sha1(repr((nombre, fuente, DB, COMPANY_ID, args, sorted((kwargs or {}).items()))).encode()).hexdigest()[:16]
+
+def _rutas_disco(nombre):
+    base = os.path.join(config.CACHE_DIR, nombre)
+    return base + '.parquet', base + '.json'
+
+def _nombre_disco(nombre, args=(), kwargs=None):
+    # Un archivo por combinación de argumentos: cargar_pnl_historico(ids) no pisa la copia completa de cargar_pnl_historico()
+    if not args and not kwargs: return nombre
+    return nombre + '-' + hashlib.sha1(repr((args, sorted((kwargs or {}).items()))).encode()).hexdigest()[:12]
+
+def guardar_en_disco(nombre, firma, df, extra=None):
     try:
-        common = xmlrpc.client.ServerProxy(f'{URL}/xmlrpc/2/common')
-        uid = common.authenticate(DB, USERNAME, PASSWORD, {})
-        if not uid: return 515.0
-        models = xmlrpc.client.ServerProxy(f'{URL}/xmlrpc/2/object')
-        usd_curr = models.execute_kw(DB, uid, PASSWORD, 'res.currency', 'search_read', [[['name', '=', 'USD']]], {'fields': ['id']})
-        if usd_curr:
-            usd_id = usd_curr[0]['id']
-            domain_rates = [['currency_id', '=', usd_id], ['company_id', '=', COMPANY_ID]]
-            rates = models.execute_kw(DB, uid, PASSWORD, 'res.currency.rate', 'search_read', [domain_rates], {'fields': ['rate'], 'order': 'name desc', 'limit': 1})
-            if rates and rates[0]['rate'] > 0:
-                tc = 1.0 / rates[0]['rate']
-                return round(tc, 2)
-    except:
+        os.makedirs(config.CACHE_DIR, exist_ok=True)
+        ruta_df, ruta_meta = _rutas_disco(nombre)
+        df = df.reset_index(drop=True)
+        # Parquet no admite las listas [id, nombre] ni los dicts de Odoo mezclados con False: van como JSON
+        cols_json = [c for c in df.columns if df[c].dtype == object and not df[c].map(lambda v: isinstance(v, str)).all()]
+        if cols_json:
+            df = df.copy()
+            for c in cols_json: df[c] = df[c].map(lambda v: json.dumps(v, default=str))
+        meta = {'nombre': nombre, 'firma': firma, 'obtenido_en': datetime.now().isoformat(), 'filas': len(df), 'columnas_json': cols_json}
+        meta.update(extra or {})
+        with _DISCO_LOCK:
+            df.to_parquet(ruta_df + '.tmp', index=False)
+            with open(ruta_meta + '.tmp', 'w', encoding='utf-8') as f: json.dump(meta, f)
+            os.replace(ruta_df + '.tmp', ruta_df)
+            os.replace(ruta_meta + '.tmp', ruta_meta)
+    except Exception:
         pass
-    return 515.0
 
+def _podar_variantes(nombre):
+    # Cada combinación de argumentos deja su archivo: se conservan solo las más recientes
+    try:
+        rutas = sorted(glob.glob(os.path.join(config.CACHE_DIR, glob.escape(nombre) + '-*.parquet')), key=os.path.getmtime, reverse=True)
+    except OSError:
+        return
+    for ruta in rutas[config.CACHE_MAX_VARIANTES:]: borrar_de_disco(os.path.basename(ruta)[:-len('.parquet')])
+
+def borrar_de_disco(nombre, variantes=False):
+    rutas = list(_rutas_disco(nombre))
+    if variantes: rutas += glob.glob(os.path.join(config.CACHE_DIR, glob.escape(nombre) + '-*.*'))
+    for ruta in rutas:
+        try: os.remove(ruta)
+        except OSError: pass
+
+def leer_de_disco(nombre, firma):
+    try:
+        ruta_df, ruta_meta = _rutas_disco(nombre)
+        with _DISCO_LOCK:
+            if not (os.path.exists(ruta_df) and os.path.exists(ruta_meta)): return None, None
+            with open(ruta_meta, encoding='utf-8') as f: meta = json.load(f)
+            if meta.get('firma') != firma: return None, None
+            df = pd.read_parquet(ruta_df)
+        for c in meta.get('columnas_json', []): df[c] = df[c].map(json.loads)
+        return df, meta
+    except Exception:
+        return None, None
+
+# --- REFRESCO EN SEGUNDO PLANO (stale-while-revalidate) ---
+# Con max_obsoleto, el loader no usa st.cache_data: guarda su resultado en memoria y, vencido el TTL,
+# lo sigue sirviendo mientras un hilo lo reconstruye; al terminar se reemplaza de una sola vez.
+# Pasado max_obsoleto la recarga vuelve a ser bloqueante, salvo para la copia leída de disco al arrancar:
+# esa se sirve aunque sea vieja (p.ej. tras una noche apagado) mientras se revalida en segundo plano.
+# Por loader se conservan a lo sumo CACHE_MAX_ENTRADAS combinaciones de argumentos (las de uso más reciente);
+# las que superan max_obsoleto se descartan, total se recargarían de forma bloqueante.
+_MEMORIA = {}
+_MEMORIA_LOCK = threading.Lock()
+_CARGA_LOCKS = {}   # clave -> {'lock', 'usos'}: hilos que lo tienen o lo esperan; solo se poda con usos == 0
+
+def _podar_memoria(nombre, max_obsoleto):
+    # Se llama con _MEMORIA_LOCK tomado
+    ahora = time.time()
+    propias = sorted(((c, e) for c, e in _MEMORIA.items() if c[0] == nombre), key=lambda x: x[1]['uso'], reverse=True)
+    for i, (clave, e) in enumerate(propias):
+        if e['refrescando']: continue
+        if i >= config.CACHE_MAX_ENTRADAS or (ahora - e['ts'] > max_obsoleto and not e['de_disco']):
+            del _MEMORIA[clave]
+    for clave in [c for c, l in _CARGA_LOCKS.items() if c[0] == nombre and c not in _MEMORIA and not l['usos']]:
+        del _CARGA_LOCKS[clave]
+
+def estado_cache(nombre):
+    with _MEMORIA_LOCK:
+        entradas = [e for (n, _), e in _MEMORIA.items() if n == nombre]
+    if not entradas: return None
+    e = max(entradas, key=lambda x: x['ts'])
+    return {'obtenido_en': datetime.fromtimestamp(e['ts']), 'edad_s': time.time() - e['ts'], 'refrescando': e['refrescando']}
+
+# Momento de la última descarga de cada loader persistente (o del snapshot de disco que se está sirviendo).
+# Se usa como versión de los datos en memos y exports; lo anotan todos los loaders con cache_persistente.
+# Para memos que guardan posiciones o agregados de un frame, usar loader.con_version(): devuelve (df, versión)
+# leídos juntos, así un refresco en segundo plano no deja el memo de un frame viejo bajo la versión nueva.
+_VERSIONES = {}
+
+def version_datos(nombre):
+    return _VERSIONES.get(nombre, 0.0)
+
+def _envoltura_swr(nombre, fuente, ttl, max_obsoleto, cargar_y_guardar):
+    def guardar(clave, df, ts, de_disco=False):
+        with _MEMORIA_LOCK:
+            # La copia de disco se revalida en la primera llamada; una descarga recién hecha, no
+            _MEMORIA[clave] = {'df': df, 'ts': ts, 'refrescando': False, 'intento': 0 if de_disco else time.time(), 'uso': time.time(), 'de_disco': de_disco}
+            _podar_memoria(nombre, max_obsoleto)
+            _VERSIONES[nombre] = ts
+
+    def cargar(clave, args, kwargs):
+        inicio = time.time()
+        with _MEMORIA_LOCK:
+            candado = _CARGA_LOCKS.setdefault(clave, {'lock': threading.Lock(), 'usos': 0})
+            candado['usos'] += 1
+        try:
+            with candado['lock']:
+                # Si otro hilo descargó mientras se esperaba el candado (o la copia sigue vigente), se usa esa
+                with _MEMORIA_LOCK:
+                    entrada = _MEMORIA.get(clave)
+                if entrada is not None and (entrada['ts'] >= inicio or time.time() - entrada['ts'] <= ttl):
+                    return entrada['df'], entrada['ts']
+                try:
+                    res, version = cargar_y_guardar(*args, **kwargs)
+                except _CargaFallida as e:
+                    _anotar_fallo(nombre, e)
+                    if entrada is not None: return entrada['df'], entrada['ts']
+                    return e.res, time.time()
+                if isinstance(res, pd.DataFrame) and not res.empty:
+                    guardar(clave, res, version)
+                return res, version
+        finally:
+            with _MEMORIA_LOCK: candado['usos'] -= 1
+
+    def refrescar(clave, args, kwargs):
+        try:
+            cargar(clave, args, kwargs)
+        finally:
+            with _MEMORIA_LOCK:
+                if clave in _MEMORIA: _MEMORIA[clave]['refrescando'] = False
+
+    @functools.wraps(cargar_y_guardar)
+    def con_version(*args, **kwargs):
+        clave = (nombre, _firma(nombre, fuente, args, kwargs))
+        with _MEMORIA_LOCK:
+            entrada = _MEMORIA.get(clave)
+            if entrada is not None: entrada['uso'] = time.time()
+        if entrada is None:
+            snap, meta = leer_de_disco(_nombre_disco(nombre, args, kwargs), clave[1])
+            if snap is not None:
+                guardar(clave, snap, datetime.fromisoformat(meta['obtenido_en']).timestamp(), de_disco=True)
+                with _MEMORIA_LOCK: entrada = _MEMORIA.get(clave)
+        ahora = time.time()
+        if entrada is None or (ahora - entrada['ts'] > max_obsoleto and not entrada['de_disco']):
+            res, version = cargar(clave, args, kwargs)
+            return (res.copy() if isinstance(res, pd.DataFrame) else res), version
+        if ahora - entrada['ts'] > ttl:
+            with _MEMORIA_LOCK:
+                # Un solo hilo de refresco a la vez, y tras un fallo se espera un minuto antes de reintentar
+                lanzar = not entrada['refrescando'] and ahora - entrada['intento'] > 60
+                if lanzar: entrada.update(refrescando=True, intento=ahora)
+            if lanzar: threading.Thread(target=refrescar, args=(clave, args, kwargs), daemon=True).start()
+        return entrada['df'].copy(), entrada['ts']
+
+    @functools.wraps(cargar_y_guardar)
+    def envoltura(*args, **kwargs):
+        return con_version(*args, **kwargs)[0]
+
+    def limpiar():
+        with _MEMORIA_LOCK:
+            for clave in [c for c in _MEMORIA if c[0] == nombre]: del _MEMORIA[clave]
+        borrar_de_disco(nombre, variantes=True)
+    envoltura.clear = limpiar
+    envoltura.con_version = con_version
+    return envoltura
+
+def cache_persistente(nombre, ttl, max_obsoleto=None, version=1):
+    def decorador(func):
+        try: fuente = inspect.getsource(func)
+        except (OSError, TypeError): fuente = func.__qualname__
+        fuente = (fuente, version)
+
+        @functools.wraps(func)
+        def cargar_y_guardar(*args, **kwargs):
+            with metricas.errores_tragados() as errores:
+                res = func(*args, **kwargs)
+            if errores: raise _CargaFallida(nombre, res, errores)
+            version = _VERSIONES[nombre] = time.time()
+            if isinstance(res, pd.DataFrame) and not res.empty:
+                guardar_en_disco(_nombre_disco(nombre, args, kwargs), _firma(nombre, fuente, args, kwargs), res,
+                                 {'obtenido_en': datetime.fromtimestamp(version).isoformat()})
+                if args or kwargs: _podar_variantes(nombre)
+            return res, version
+        if max_obsoleto:
+            return _envoltura_swr(nombre, fuente, ttl, max_obsoleto, cargar_y_guardar)
+        cacheado = st.cache_data(ttl=ttl)(cargar_y_guardar)
+
+        def refrescar(firma, args, kwargs):
+            try:
+                cacheado(*args, **kwargs)
+                _SNAPSHOT_ACTIVO.pop(firma, None)
+            except Exception as e:
+                # Se conserva la copia de disco; con_version reintenta pasado un minuto
+                _anotar_fallo(nombre, e)
+                _SNAPSHOT_ACTIVO[firma]['refrescando'] = False
+
+        @functools.wraps(func)
+        def con_version(*args, **kwargs):
+            firma = _firma(nombre, fuente, args, kwargs)
+            with _DISCO_LOCK:
+                primera_vez = firma not in _ARRANQUE_VISTO
+                _ARRANQUE_VISTO.add(firma)
+            if primera_vez:
+                snap, meta = leer_de_disco(_nombre_disco(nombre, args, kwargs), firma)
+                if snap is not None:
+                    version = _VERSIONES[nombre] = datetime.fromisoformat(meta['obtenido_en']).timestamp()
+                    _SNAPSHOT_ACTIVO[firma] = {'df': snap, 'version': version, 'refrescando': False, 'intento': 0}
+            activo = _SNAPSHOT_ACTIVO.get(firma)
+            if activo is not None:
+                with _DISCO_LOCK:
+                    lanzar = not activo['refrescando'] and time.time() - activo['intento'] > 60
+                    if lanzar: activo.update(refrescando=True, intento=time.time())
+                if lanzar: threading.Thread(target=refrescar, args=(firma, args, kwargs), daemon=True).start()
+                return activo['df'].copy(), activo['version']
+            try:
+                return cacheado(*args, **kwargs)
+            except _CargaFallida as e:
+                # Sin copia anterior: se devuelve el vacío de respaldo sin cachearlo, la próxima llamada reintenta
+                return e.res, time.time()
+
+        @functools.wraps(func)
+        def envoltura(*args, **kwargs):
+            return con_version(*args, **kwargs)[0]
+        envoltura.clear = cacheado.clear
+        envoltura.con_version = con_version
+        return envoltura
+    return decorador
+
+# --- DECODIFICACIÓN DE REGISTROS ODOO (many2one) ---
+# Odoo devuelve los many2one como [id, nombre] y usa False como nulo.
+# Los pares se separan con .str[0] / .str[1] sobre las filas que traen lista y se generan ambas columnas
+# tipadas (id entero, nombre texto); False / None / "" quedan con los valores nulos.
+# Si viene un escalar (campos Studio tipo selección/char) se conserva como nombre y, si es entero, como id;
+# esas filas, poco comunes, pasan por _par_m2o una por una.
+def _par_m2o(v, id_nulo, nombre_nulo):
+    if isinstance(v, (list, tuple)):
+        if len(v) > 1: return v[0], v[1]
+        return (v[0], nombre_nulo) if v else (id_nulo, nombre_nulo)
+    if v is None or v is False or (isinstance(v, float) and v != v) or v == "": return id_nulo, nombre_nulo
+    return (v if isinstance(v, (int, np.integer)) and not isinstance(v, bool) else id_nulo), str(v)
+
+def decodificar_m2o(df, campo, col_id=None, col_nombre=None, id_nulo=0, nombre_nulo=None):
+    if campo not in df.columns:
+        if col_id: df[col_id] = id_nulo
+        if col_nombre: df[col_nombre] = nombre_nulo
+        return df
+    col = df[campo]
+    ids = pd.Series(id_nulo, index=df.index, dtype='int64')
+    nombres = pd.Series([nombre_nulo] * len(df), index=df.index, dtype=object)
+    es_lista = col.map(type).isin([list, tuple]) if col.dtype == object else pd.Series(False, index=df.index)
+    if es_lista.any():
+        listas = col[es_lista]
+        ids[es_lista] = listas.str[0].fillna(id_nulo).astype('int64')
+        segundo = listas.str[1]
+        nombres[es_lista] = segundo.where(segundo.notna(), nombre_nulo)
+    escalares = ~es_lista & col.notna() & ~col.eq(False) & ~col.eq("")
+    if escalares.any():
+        pares = col[escalares].map(lambda v: _par_m2o(v, id_nulo, nombre_nulo))
+        ids[escalares] = pares.str[0].astype('int64')
+        nombres[escalares] = pares.str[1]
+    if col_id: df[col_id] = ids.to_numpy()
+    if col_nombre: df[col_nombre] = nombres
+    return df
+
+# --- DISTRIBUCIÓN ANALÍTICA (tabla larga línea / cuenta / %) ---
+# analytic_distribution llega como dict {"id_cuenta": pct} (o texto JSON); las claves "a,b" reparten el mismo % a varias cuentas.
+# Se explota una sola vez por carga; los filtros por plan/proyecto se hacen luego con merge/isin.
+def _leer_distribucion(d):
+    if isinstance(d, dict): return d
+    if not d or not isinstance(d, str): return None
+    try: d = json.loads(d)
+    except ValueError:
+        try: d = ast.literal_eval(d)
+        except (ValueError, SyntaxError): return None
+    # Un texto como "42" se decodifica a un entero: solo sirven los dicts
+    return d if isinstance(d, dict) else None
+
+def explotar_distribucion(df, col='analytic_distribution', col_id='id'):
+    lineas, cuentas, pcts = [], [], []
+    if not df.empty and col in df.columns:
+        for id_l, d in zip(df[col_id].tolist(), df[col].tolist()):
+            d = _leer_distribucion(d)
+            if not d: continue
+            for k, v in d.items():
+                for c in str(k).split(','):
+                    c = c.strip()
+                    if c.isdigit():
+                        lineas.append(id_l); cuentas.append(int(c)); pcts.append(float(v or 0))
+    return pd.DataFrame({'id_linea': np.array(lineas, dtype='int64'), 'id_cuenta_analitica': np.array(cuentas, dtype='int64'), 'pct': np.array(pcts, dtype='float64')})
+
+def repartir_por_plan(df, df_dist, df_an, col_monto, col_id='id'):
+    # Reparte el monto de cada línea entre sus planes (peso = % de la cuenta / % total de la línea)
+    planes = df_an[['id_cuenta_analitica', 'Plan_Nombre']] if not df_an.empty else pd.DataFrame(columns=['id_cuenta_analitica', 'Plan_Nombre'])
+    d = df_dist[df_dist['id_linea'].isin(df[col_id])].merge(planes.astype({'id_cuenta_analitica': 'int64'}), on='id_cuenta_analitica', how='left')
+    d['Plan'] = d['Plan_Nombre'].fillna("Otro")
+    total = d.groupby('id_linea')['pct'].transform('sum')
+    d['peso'] = np.where(total > 0, d['pct'] / total.where(total > 0, 1), 1 / d.groupby('id_linea')['pct'].transform('size'))
+    d = d.groupby(['id_linea', 'Plan'], as_index=False)['peso'].sum()
+    out = df.merge(d, left_on=col_id, right_on='id_linea', how='left')
+    out['Plan'] = out['Plan'].fillna("Retail")
+    out[col_monto] = out[col_monto] * out['peso'].fillna(1.0)
+    return out.drop(columns=['id_linea', 'peso'])
+
+# --- COMPACTACIÓN DE DATAFRAMES ---
+# Al final de cada loader: poda de columnas sin uso, dimensiones de texto como category, enteros al tipo
+# más chico y floats a float32 solo si no se pierde nada. Se registra el tamaño antes/después por dataset.
+_MEMORIA_DATASETS = {}
+
+def compactar(df, nombre, categorias=(), podar=()):
+    if df.empty: return df
+    antes = int(df.memory_usage(deep=True).sum())
+    df = df.drop(columns=[c for c in podar if c in df.columns])
+    for c in categorias:
+        if c in df.columns and not isinstance(df[c].dtype, pd.CategoricalDtype): df[c] = df[c].astype('category')
+    for c in df.select_dtypes('integer').columns: df[c] = pd.to_numeric(df[c], downcast='integer')
+    for c in df.select_dtypes('float').columns:
+        f32 = df[c].astype('float32')
+        if ((f32.astype('float64') == df[c]) | df[c].isna()).all(): df[c] = f32
+    _MEMORIA_DATASETS[nombre] = {'Dataset': nombre, 'Filas': len(df), 'Antes_MB': antes / 1e6, 'Despues_MB': int(df.memory_usage(deep=True).sum()) / 1e6}
+    return df
+
+def reporte_memoria():
+    df = pd.DataFrame(list(_MEMORIA_DATASETS.values()), columns=['Dataset', 'Filas', 'Antes_MB', 'Despues_MB'])
+    df['Ahorro_Pct'] = (1 - df['Despues_MB'] / df['Antes_MB'].where(df['Antes_MB'] > 0)).fillna(0) * 100
+    return df
+
+def rellenar(df, valores):
+    # fillna que también sirve para columnas category (agrega la categoría si falta)
+    for c, v in valores.items():
+        if isinstance(df[c].dtype, pd.CategoricalDtype) and v not in df[c].cat.categories: df[c] = df[c].cat.add_categories([v])
+        df[c] = df[c].fillna(v)
+    return df
+
+# --- FUNCIONES DE CARGA DE DATOS ---
+
+# --- SINCRONIZACIÓN INCREMENTAL (write_date) ---
+# Se guarda la copia cruda de cada dataset con su marca de agua (write_date, id). Al vencer el TTL solo
+# se piden a Odoo los registros creados/modificados desde la marca y se hace upsert sobre la copia.
+# La consulta repite una ventana de SYNC_SOLAPE_MIN antes de la marca: Odoo pone write_date al iniciar la
+# transacción, no al confirmarla, así que una transacción lenta aparece después con un write_date ya pasado.
+# Lo que vuelve sin cambios (mismo id y write_date) se ignora.
+# Los que ya no cumplen el dominio vigente (anulados, vueltos a borrador) se eliminan de la copia.
+# La recarga completa ocurre bajo demanda (forzar_recarga_completa) o cada SYNC_RECARGA_COMPLETA_HORAS.
+_SYNC = {}
+_SYNC_LOCK = threading.Lock()
+_SYNC_LOCKS = {}   # Un candado por dataset: cada uno sincroniza sin esperar a los demás
+
+def _candado_sync(nombre):
+    with _SYNC_LOCK:
+        return _SYNC_LOCKS.setdefault(nombre, threading.Lock())
+
+def _desde_solape(marca):
+    # write_date de la marca menos la ventana de solape, en el formato de Odoo
+    return (pd.Timestamp(marca) - timedelta(minutes=config.SYNC_SOLAPE_MIN)).strftime('%Y-%m-%d %H:%M:%S')
+
+def _claves_wd(df):
+    return pd.MultiIndex.from_arrays([df['id'].astype('int64'), df['write_date'].astype(str)])
+
+def sincronizar_incremental(nombre, modelo, dominio_base, dominio_vigente, filtro_vigente, campos):
+    campos = list(dict.fromkeys(campos + ['write_date']))
+    firma = _firma('sync_' + nombre, repr((modelo, dominio_base, dominio_vigente, campos)))
+    with _candado_sync(nombre):
+        estado = _SYNC.get(nombre)
+        if estado is None:
+            # Tras un reinicio se retoma la copia cruda guardada en disco y se sigue de forma incremental
+            df_disco, meta = leer_de_disco('sync_' + nombre, firma)
+            if df_disco is not None:
+                marca = meta['marca']
+                estado = {'df': df_disco, 'marca': marca[0] if isinstance(marca, list) else marca, 'completo_en': datetime.fromisoformat(meta['completo_en'])}
+        vencido = estado is None or datetime.now() - estado['completo_en'] > timedelta(hours=config.SYNC_RECARGA_COMPLETA_HORAS)
+        if vencido:
+            ids = odoo.execute_kw(modelo, 'search', [dominio_base + dominio_vigente])
+            df = pd.DataFrame(odoo.read_paginado(modelo, ids, campos))
+            recibidos = df
+            estado = {'completo_en': datetime.now()}
+        else:
+            dominio_delta = dominio_base + [['write_date', '>=', _desde_solape(estado['marca'])]]
+            delta = pd.DataFrame(odoo.execute_kw(modelo, 'search_read', [dominio_delta], {'fields': campos}))
+            recibidos = delta
+            df = estado['df']
+            if not delta.empty and not df.empty:
+                # Solo lo que cambió: versiones nuevas y lo que hay que quitar de la copia por dejar de ser vigente
+                delta = delta[~_claves_wd(delta).isin(_claves_wd(df)) & (filtro_vigente(delta) | delta['id'].isin(df['id']))]
+            if not delta.empty:
+                vigentes = delta[filtro_vigente(delta)]
+                df = df[~df['id'].isin(delta['id'])] if not df.empty else df
+                df = pd.concat([df, vigentes], ignore_index=True) if not df.empty else vigentes.reset_index(drop=True)
+        # La marca avanza con todo lo recibido, incluso lo descartado por no vigente: si no, se volvería a pedir en cada sync
+        marca = estado.get('marca', '1970-01-01 00:00:00')
+        if not recibidos.empty:
+            marca = max(marca, str(recibidos['write_date'].astype(str).max()))
+        cambio = vencido or df is not estado.get('df') or marca != estado.get('marca')
+        estado.update(df=df, marca=marca)
+        _SYNC[nombre] = estado
+        if cambio:
+            guardar_en_disco('sync_' + nombre, firma, df, {'marca': marca, 'completo_en': estado['completo_en'].isoformat()})
+        return df.copy()
+
+def forzar_recarga_completa():
+    with _SYNC_LOCK:
+        nombres = list(_SYNC_LOCKS)
+    for nombre in nombres:
+        with _candado_sync(nombre):
+            borrar_de_disco('sync_' + nombre)
+            _SYNC.pop(nombre, None)
+    with _MEMO_UBIC_LOCK:
+        _MEMO_UBIC.clear()
+    with _SALIDAS_LOCK:
+        _SALIDAS.clear()
+        borrar_de_disco('ultima_salida')
+    with _CHURN_LOCK:
+        _CHURN.clear()
+    tasas_usd.clear()
+    cargar_datos_generales.clear()
+
+# --- TIPO DE CAMBIO USD (serie histórica compartida por todas las conversiones) ---
+# Una sola tabla de tasas de res.currency.rate, sincronizada en forma incremental y persistida en disco.
+# Odoo guarda rate = USD por 1 CRC (ronda 0.0019), así que TC = 1 / rate.
+# to_usd / to_crc convierten columnas enteras con la tasa vigente en o antes de cada fecha (searchsorted);
+# fechas anteriores a la primera tasa usan la primera, y sin tasas se usa TC_USD_RESPALDO.
+_USD_ID = {}
+
+def _id_usd():
+    if 'id' not in _USD_ID:
+        res = odoo.execute_kw('res.currency', 'search_read', [[['name', '=', 'USD']]], {'fields': ['id']})
+        _USD_ID['id'] = res[0]['id'] if res else None
+    return _USD_ID['id']
+
+def _tasa_vigente(df):
+    return pd.to_datetime(df['name']) >= pd.Timestamp('2021-01-01')
+
+_TASAS_VACIAS = pd.DataFrame({'Fecha': pd.Series(dtype='datetime64[ns]'), 'rate': pd.Series(dtype=float)})
+
+@metricas.medir
+@st.cache_resource(ttl=config.TASAS_TTL_S)
+def tasas_usd():
+    try:
+        usd_id = _id_usd()
+        if not usd_id: return _TASAS_VACIAS
+        dominio_base = [['currency_id', '=', usd_id], ['company_id', '=', COMPANY_ID]]
+        df = sincronizar_incremental('tasas_usd', 'res.currency.rate', dominio_base, [['name', '>=', '2021-01-01']], _tasa_vigente, ['name', 'rate'])
+        if df.empty: return _TASAS_VACIAS
+        df = df[df['rate'] > 0]
+        df = pd.DataFrame({'Fecha': pd.to_datetime(df['name']).to_numpy('datetime64[ns]'), 'rate': df['rate'].to_numpy(float)})
+        return df.sort_values('Fecha', kind='stable', ignore_index=True)
+    except Exception as e: return metricas.tragada(e, _TASAS_VACIAS)
 
-@st.cache_data(ttl=900) 
+def tasa_usd(fechas=None):
+    # rate vigente en cada fecha (None = hoy); escalar si se pide una sola fecha
+    tasas = tasas_usd()
+    escalar = fechas is None or np.ndim(fechas) == 0
+    fechas = np.asarray(pd.to_datetime(np.atleast_1d(pd.Timestamp.now() if fechas is None else fechas)), dtype='datetime64[ns]')
+    if tasas.empty:
+        rates = np.full(len(fechas), 1.0 / config.TC_USD_RESPALDO)
+    else:
+        pos = np.searchsorted(tasas['Fecha'].to_numpy(), fechas, side='right') - 1
+        rates = tasas['rate'].to_numpy()[np.clip(pos, 0, None)]
+    return rates[0] if escalar else rates
+
+def to_usd(montos_crc, fechas=None):
+    return np.asarray(montos_crc, dtype=float) * tasa_usd(fechas)
+
+def to_crc(montos_usd, fechas=None):
+    return np.asarray(montos_usd, dtype=float) / tasa_usd(fechas)
+
+@metricas.medir
+def get_current_usd_rate():
+    return round(1.0 / tasa_usd(), 2)
+
+def _factura_vigente(df):
+    fechas = df['invoice_date'].where(df['invoice_date'].astype(bool), None)
+    return (df['state'] == 'posted') & (pd.to_datetime(fechas) >= pd.Timestamp('2021-01-01'))
+
+@metricas.medir
+@cache_persistente('datos_generales', ttl=900, max_obsoleto=config.CACHE_MAX_OBSOLETO_S, version=1)
 def cargar_datos_generales():
     try:
-        common = xmlrpc.client.ServerProxy(f'{URL}/xmlrpc/2/common')
-        uid = common.authenticate(DB, USERNAME, PASSWORD, {})
-        if not uid: return None
-        models = xmlrpc.client.ServerProxy(f'{URL}/xmlrpc/2/object')
-        dominio = [['move_type', 'in', ['out_invoice', 'out_refund']], ['state', '=', 'posted'], ['invoice_date', '>=', '2021-01-01'], ['company_id', '=', COMPANY_ID]]
-        campos = ['name', 'invoice_date', 'invoice_date_due', 'amount_untaxed_signed', 'partner_id', 'invoice_user_id']
-        ids = models.execute_kw(DB, uid, PASSWORD, 'account.move', 'search', [dominio])
-        registros = models.execute_kw(DB, uid, PASSWORD, 'account.move', 'read', [ids], {'fields': campos})
-        df = pd.DataFrame(registros)
+        dominio_base = [['move_type', 'in', ['out_invoice', 'out_refund']], ['company_id', '=', COMPANY_ID]]
+        dominio_vigente = [['state', '=', 'posted'], ['invoice_date', '>=', '2021-01-01']]
+        campos = ['name', 'invoice_date', 'invoice_date_due', 'amount_untaxed_signed', 'partner_id', 'invoice_user_id', 'state']
+        df = sincronizar_incremental('facturas', 'account.move', dominio_base, dominio_vigente, _factura_vigente, campos)
+        df = df.drop(columns=['write_date', 'state'], errors='ignore')
         if not df.empty:
             df['invoice_date'] = pd.to_datetime(df['invoice_date'])
             df['invoice_date_due'] = pd.to_datetime(df['invoice_date_due'])
             df['Dias_Credito'] = (df['invoice_date_due'] - df['invoice_date']).dt.days
             df['Mes'] = df['invoice_date'].dt.to_period('M').dt.to_timestamp()
             df['Mes_Num'] = df['invoice_date'].dt.month
-            df['Cliente'] = df['partner_id'].apply(lambda x: x[1] if x else "Sin Cliente")
-            df['ID_Cliente'] = df['partner_id'].apply(lambda x: x[0] if x else 0)
-            df['Vendedor'] = df['invoice_user_id'].apply(lambda x: x[1] if x else "Sin Asignar")
+            decodificar_m2o(df, 'partner_id', 'ID_Cliente', 'Cliente', nombre_nulo="Sin Cliente")
+            decodificar_m2o(df, 'invoice_user_id', col_nombre='Vendedor', nombre_nulo="Sin Asignar")
             df = df.drop(columns=['partner_id', 'invoice_user_id'], errors='ignore')
             df['Venta_Neta'] = df['amount_untaxed_signed']
             df = df[~df['name'].str.contains("WT-", case=False, na=False)]
             
-            # --- NUEVO: DOLARIZACIÓN EXACTA ---
-            usd_curr = models.execute_kw(DB, uid, PASSWORD, 'res.currency', 'search_read', [[['name', '=', 'USD']]], {'fields': ['id']})
-            if usd_curr:
-                usd_id = usd_curr[0]['id']
-                domain_rates = [['currency_id', '=', usd_id], ['name', '>=', '2021-01-01'], ['company_id', '=', COMPANY_ID]]
-                rates = models.execute_kw(DB, uid, PASSWORD, 'res.currency.rate', 'search_read', [domain_rates], {'fields': ['name', 'rate']})
-                if rates:
-                    df_rates = pd.DataFrame(rates)
-                    df_rates['name'] = pd.to_datetime(df_rates['name'])
-                    df_rates = df_rates.rename(columns={'name': 'date_rate'})
-                    df_rates = df_rates.sort_values('date_rate')
-                    # Hacemos merge_asof para buscar la tasa vigente en o antes de la fecha de la factura
-                    df = df.sort_values('invoice_date')
-                    df = pd.merge_asof(df, df_rates[['date_rate', 'rate']], left_on='invoice_date', right_on='date_rate', direction='backward')
-                    # La tasa base suele ser 1/rate o el rate mismo dependiendo de cómo esté configurado Odoo respecto a CRC.
-                    # En CR normalmente rate (company_rate) para USD es = tc_usd. (Por ej: 1 USD = 515 CRC -> rate es 0.00194, o al revés).
-                    # De acuerdo a debug_rates.py el rate ronda los 0.0019 - 0.0021. Eso significa que es 1 / TC.
-                    # Por tanto, USD = CRC * rate
-                    df['usd_rate'] = df['rate'].fillna(0.0019)  # Fallback
-                    df['Venta_Neta_USD'] = df['Venta_Neta'] * df['usd_rate']
-                else:
-                    df['Venta_Neta_USD'] = df['Venta_Neta'] / 515.0
-            else:
-                df['Venta_Neta_USD'] = df['Venta_Neta'] / 515.0
+            # --- DOLARIZACIÓN EXACTA (tasa vigente a la fecha de cada factura) ---
+            df = df.sort_values('invoice_date', ignore_index=True)
+            df['Venta_Neta_USD'] = to_usd(df['Venta_Neta'], df['invoice_date'])
+            df = compactar(df, 'datos_generales', ['Cliente', 'Vendedor'], podar=['invoice_date_due'])
                 
         return df
-    except: return pd.DataFrame()
+    except Exception as e: return metricas.tragada(e, pd.DataFrame())
 
-@st.cache_data(ttl=900)
+@st.cache_data(ttl=3600, max_entries=2)
+def _ventas_con_clientes(version, _df_main):
+    df = _df_main
+    cols = ['Provincia', 'Zona_Comercial', 'Categoria_Cliente']
+    df_info = cargar_datos_clientes_extendido(df['ID_Cliente'].unique().tolist())
+    if not df_info.empty:
+        df = pd.merge(df, df_info, on='ID_Cliente', how='left')
+        df[cols] = df[cols].fillna('Sin Dato')
+    else:
+        # FIX: Inicializar columnas vacías si falla la carga extendida
+        for c in cols: df[c] = 'Sin Dato'
+    return compactar(df, 'ventas_clientes', ['Cliente', 'Vendedor'] + cols)
+
+@metricas.medir
+def cargar_ventas_clientes():
+    # Facturas + datos del cliente (provincia, zona, categoría), unidas y compactadas una vez por versión de datos.
+    # Devuelve (df, versión): la versión es la de las facturas con que se armó este frame
+    df, version = cargar_datos_generales.con_version()
+    if df.empty: return df, version
+    return _ventas_con_clientes(version, df), version
+
+@metricas.medir
+@cache_persistente('cartera', ttl=900, version=1)
 def cargar_cartera():
     try:
-        common = xmlrpc.client.ServerProxy(f'{URL}/xmlrpc/2/common')
-        uid = common.authenticate(DB, USERNAME, PASSWORD, {})
-        models = xmlrpc.client.ServerProxy(f'{URL}/xmlrpc/2/object')
         dominio = [['move_type', '=', 'out_invoice'], ['state', '=', 'posted'], ['payment_state', 'in', ['not_paid', 'partial']], ['amount_residual', '>', 0], ['company_id', '=', COMPANY_ID]]
-        ids = models.execute_kw(DB, uid, PASSWORD, 'account.move', 'search', [dominio])
-        registros = models.execute_kw(DB, uid, PASSWORD, 'account.move', 'read', [ids], {'fields': ['name', 'invoice_date', 'invoice_date_due', 'amount_total', 'amount_residual', 'partner_id', 'invoice_user_id']})
+        ids = odoo.execute_kw('account.move', 'search', [dominio])
+        registros = odoo.execute_kw('account.move', 'read', [ids], {'fields': ['name', 'invoice_date', 'invoice_date_due', 'amount_total', 'amount_residual', 'partner_id', 'invoice_user_id']})
         df = pd.DataFrame(registros)
         if not df.empty:
             df['invoice_date'] = pd.to_datetime(df['invoice_date'])
             df['invoice_date_due'] = pd.to_datetime(df['invoice_date_due'])
-            df['Cliente'] = df['partner_id'].apply(lambda x: x[1] if x else "Sin Cliente")
-            df['Vendedor'] = df['invoice_user_id'].apply(lambda x: x[1] if x else "Sin Asignar")
+            decodificar_m2o(df, 'partner_id', col_nombre='Cliente', nombre_nulo="Sin Cliente")
+            decodificar_m2o(df, 'invoice_user_id', col_nombre='Vendedor', nombre_nulo="Sin Asignar")
             df = df.drop(columns=['partner_id', 'invoice_user_id'], errors='ignore')
             df['Dias_Vencido'] = (pd.Timestamp.now() - df['invoice_date_due']).dt.days
             def bucket(d): return "Por Vencer" if d < 0 else ("0-30" if d<=30 else ("31-60" if d<=60 else ("61-90" if d<=90 else "+90")))
             df['Antiguedad'] = df['Dias_Vencido'].apply(bucket)
             df['Antiguedad'] = pd.Categorical(df['Antiguedad'], ["Por Vencer", "0-30", "31-60", "61-90", "+90"], ordered=True)
+            df = compactar(df, 'cartera', ['Cliente', 'Vendedor'])
         return df
-    except: return pd.DataFrame()
+    except Exception as e: return metricas.tragada(e, pd.DataFrame())
 
-@st.cache_data(ttl=3600)
+@metricas.medir
+@cache_persistente('datos_clientes_extendido', ttl=3600, version=1)
 def cargar_datos_clientes_extendido(ids_clientes):
     try:
         if not ids_clientes: return pd.DataFrame()
-        common = xmlrpc.client.ServerProxy(f'{URL}/xmlrpc/2/common')
-        uid = common.authenticate(DB, USERNAME, PASSWORD, {})
-        models = xmlrpc.client.ServerProxy(f'{URL}/xmlrpc/2/object')
-        registros = models.execute_kw(DB, uid, PASSWORD, 'res.partner', 'read', [list(ids_clientes)], {'fields': ['state_id', 'x_studio_zona', 'x_studio_categoria_cliente']})
+        registros = odoo.execute_kw('res.partner', 'read', [list(ids_clientes)], {'fields': ['state_id', 'x_studio_zona', 'x_studio_categoria_cliente']})
         df = pd.DataFrame(registros)
         if not df.empty:
-            df['Provincia'] = df['state_id'].apply(lambda x: x[1] if x else "Sin Provincia")
-            def procesar_campo_studio(valor): return str(valor[1]) if isinstance(valor, list) else (str(valor) if valor else "No Definido")
-            df['Zona_Comercial'] = df['x_studio_zona'].apply(procesar_campo_studio) if 'x_studio_zona' in df.columns else "N/A"
-            df['Categoria_Cliente'] = df['x_studio_categoria_cliente'].apply(procesar_campo_studio) if 'x_studio_categoria_cliente' in df.columns else "N/A"
+            decodificar_m2o(df, 'state_id', col_nombre='Provincia', nombre_nulo="Sin Provincia")
+            decodificar_m2o(df, 'x_studio_zona', col_nombre='Zona_Comercial', nombre_nulo="No Definido" if 'x_studio_zona' in df.columns else "N/A")
+            decodificar_m2o(df, 'x_studio_categoria_cliente', col_nombre='Categoria_Cliente', nombre_nulo="No Definido" if 'x_studio_categoria_cliente' in df.columns else "N/A")
             df = df.drop(columns=['state_id', 'x_studio_zona', 'x_studio_categoria_cliente'], errors='ignore')
             df.rename(columns={'id': 'ID_Cliente'}, inplace=True)
             return df[['ID_Cliente', 'Provincia', 'Zona_Comercial', 'Categoria_Cliente']]
         return pd.DataFrame()
-    except: return pd.DataFrame()
+    except Exception as e: return metricas.tragada(e, pd.DataFrame())
 
-@st.cache_data(ttl=3600) 
+@metricas.medir
+@cache_persistente('detalle_productos', ttl=3600, max_obsoleto=config.CACHE_MAX_OBSOLETO_S, version=1)
 def cargar_detalle_productos():
     try:
-        common = xmlrpc.client.ServerProxy(f'{URL}/xmlrpc/2/common')
-        uid = common.authenticate(DB, USERNAME, PASSWORD, {})
-        models = xmlrpc.client.ServerProxy(f'{URL}/xmlrpc/2/object')
         anio_inicio = datetime.now().year - 3
         dominio = [['parent_state', '=', 'posted'], ['date', '>=', f'{anio_inicio}-01-01'], ['company_id', '=', COMPANY_ID], ['display_type', '=', 'product'], ['move_id.move_type', 'in', ['out_invoice', 'out_refund']]]
-        ids = models.execute_kw(DB, uid, PASSWORD, 'account.move.line', 'search', [dominio])
-        registros = models.execute_kw(DB, uid, PASSWORD, 'account.move.line', 'read', [ids], {'fields': ['date', 'product_id', 'credit', 'debit', 'quantity', 'move_id', 'analytic_distribution']})
+        ids = odoo.execute_kw('account.move.line', 'search', [dominio])
+        registros = odoo.read_paginado('account.move.line', ids, ['date', 'product_id', 'credit', 'debit', 'quantity', 'move_id', 'analytic_distribution'])
         df = pd.DataFrame(registros)
         if not df.empty:
             df['date'] = pd.to_datetime(df['date'])
-            df['ID_Factura'] = df['move_id'].apply(lambda x: x[0] if x else 0)
-            df['ID_Producto'] = df['product_id'].apply(lambda x: x[0] if x else 0)
-            df['Producto'] = df['product_id'].apply(lambda x: x[1] if x else "Otros")
+            decodificar_m2o(df, 'move_id', 'ID_Factura')
+            decodificar_m2o(df, 'product_id', 'ID_Producto', 'Producto', nombre_nulo="Otros")
             df = df.drop(columns=['product_id', 'move_id'], errors='ignore')
             df['Venta_Neta'] = df['credit'] - df['debit']
+            df = compactar(df, 'detalle_productos', ['Producto'])
         return df
-    except: return pd.DataFrame()
+    except Exception as e: return metricas.tragada(e, pd.DataFrame())
 
-@st.cache_data(ttl=3600)
+@metricas.medir
+@st.cache_data(ttl=3600, max_entries=2)
+def cargar_distribucion_productos(version, _df_prod):
+    # version = la de detalle_productos con que se cargó _df_prod: se re-explota solo cuando cambian las líneas
+    return explotar_distribucion(_df_prod)
+
+@metricas.medir
+@cache_persistente('inventario_general', ttl=3600, version=1)
 def cargar_inventario_general():
     try:
-        common = xmlrpc.client.ServerProxy(f'{URL}/xmlrpc/2/common')
-        uid = common.authenticate(DB, USERNAME, PASSWORD, {})
-        models = xmlrpc.client.ServerProxy(f'{URL}/xmlrpc/2/object')
         dominio = ['|', ['active', '=', True], ['active', '=', False]]
-        ids = models.execute_kw(DB, uid, PASSWORD, 'product.product', 'search', [dominio])
-        registros = models.execute_kw(DB, uid, PASSWORD, 'product.product', 'read', [ids], {'fields': ['name', 'qty_available', 'standard_price', 'detailed_type', 'default_code', 'brand_alrotek_id']})
+        ids = odoo.execute_kw('product.product', 'search', [dominio])
+        registros = odoo.execute_kw('product.product', 'read', [ids], {'fields': ['name', 'qty_available', 'standard_price', 'detailed_type', 'default_code', 'brand_alrotek_id']})
         df = pd.DataFrame(registros)
         if not df.empty:
             df['Valor_Inventario'] = df['qty_available'] * df['standard_price']
@@ -174,108 +666,205 @@ def cargar_inventario_general():
             df['Tipo'] = df['detailed_type'].map(tipo_map).fillna('Otro')
             
             # Procesar Marca (brand_alrotek_id)
-            def extract_brand(val):
-                if isinstance(val, list) and len(val) > 1:
-                    return val[1]
-                return "Sin Marca"
-            
-            df['Marca'] = df['brand_alrotek_id'].apply(extract_brand) if 'brand_alrotek_id' in df.columns else "Sin Marca"
+            decodificar_m2o(df, 'brand_alrotek_id', col_nombre='Marca', nombre_nulo="Sin Marca")
             
         return df
-    except: return pd.DataFrame()
+    except Exception as e: return metricas.tragada(e, pd.DataFrame())
+
+# --- ÍNDICE DE ÚLTIMA SALIDA POR PRODUCTO (baja rotación) ---
+# Fecha de la última salida (a cliente o producción) por producto, calculada en Odoo con read_group (date:max).
+# Después solo se agrupan los movimientos con write_date desde la marca menos SYNC_SOLAPE_MIN (misma ventana
+# de solape que la sincronización incremental) y se toma el máximo; repetir movimientos no cambia el resultado.
+# Se reconstruye completo cada SYNC_RECARGA_COMPLETA_HORAS y se guarda en disco como las copias incrementales.
+_SALIDAS = {}
+_SALIDAS_LOCK = threading.Lock()
+_DOMINIO_SALIDAS = [['state', '=', 'done'], ['location_dest_id.usage', 'in', ['customer', 'production']]]
+
+def _agrupar_salidas(dominio):
+    try:
+        grupos = odoo.execute_kw('stock.move', 'read_group', [dominio, ['date:max', 'write_date:max'], ['product_id']], {'lazy': False})
+        df = pd.DataFrame([{'product_id': g.get('product_id'), 'date': g.get('date'), 'write_date': g.get('write_date')} for g in grupos])
+    except xmlrpc.client.Fault:
+        # Sin read_group disponible: mismos datos agrupados en pandas
+        df = pd.DataFrame(odoo.search_read_paginado('stock.move', dominio, ['product_id', 'date', 'write_date']))
+    if df.empty: return pd.DataFrame(columns=['pid', 'fecha']), None
+    decodificar_m2o(df, 'product_id', 'pid')
+    df['fecha'] = pd.to_datetime(df['date'])
+    marca = str(df['write_date'].dropna().astype(str).max()) if df['write_date'].notna().any() else None
+    return df.groupby('pid', as_index=False)['fecha'].max(), marca
+
+def indice_ultima_salida():
+    dominio = _DOMINIO_SALIDAS + [['company_id', '=', COMPANY_ID]]
+    firma = _firma('ultima_salida', repr(dominio))
+    with _SALIDAS_LOCK:
+        estado = _SALIDAS.get('estado')
+        if estado is None:
+            df_disco, meta = leer_de_disco('ultima_salida', firma)
+            if df_disco is not None:
+                estado = {'df': df_disco, 'marca': meta['marca'], 'completo_en': datetime.fromisoformat(meta['completo_en'])}
+        if estado is None or datetime.now() - estado['completo_en'] > timedelta(hours=config.SYNC_RECARGA_COMPLETA_HORAS):
+            desde = (datetime.now() - timedelta(days=366)).strftime('%Y-%m-%d')
+            df, marca = _agrupar_salidas(dominio + [['date', '>=', desde]])
+            estado = {'df': df, 'marca': marca, 'completo_en': datetime.now()}
+            cambio = True
+        else:
+            delta, marca = _agrupar_salidas(dominio + [['write_date', '>=', _desde_solape(estado['marca'])]]) if estado['marca'] else (pd.DataFrame(), None)
+            cambio = False
+            if not delta.empty:
+                df = pd.concat([estado['df'], delta], ignore_index=True).groupby('pid', as_index=False)['fecha'].max()
+                marca = max(estado['marca'], marca or estado['marca'])
+                cambio = not df.equals(estado['df']) or marca != estado['marca']
+                estado['df'], estado['marca'] = df, marca
+        _SALIDAS['estado'] = estado
+        if cambio:
+            guardar_en_disco('ultima_salida', firma, estado['df'], {'marca': estado['marca'], 'completo_en': estado['completo_en'].isoformat()})
+        return estado['df'].set_index('pid')['fecha']
+
+@metricas.medir
+@st.cache_data(ttl=3600)
+def cargar_kits_fantasma():
+    try: return [x for x in decodificar_m2o(pd.DataFrame(odoo.execute_kw('mrp.bom', 'search_read', [[['type', '=', 'phantom']]], {'fields': ['product_tmpl_id']})), 'product_tmpl_id', 'tmpl_id')['tmpl_id'].tolist() if x]
+    except Exception as e: return metricas.tragada(e, [])
+
+@metricas.medir
+@st.cache_data(ttl=3600)
+def cargar_info_almacenables():
+    # Costo y plantilla de todos los productos almacenables (activos y archivados)
+    info = pd.DataFrame(odoo.search_read_paginado('product.product', [['detailed_type', '=', 'product'], ['active', 'in', [True, False]]], ['standard_price', 'product_tmpl_id']))
+    if info.empty: return pd.DataFrame(columns=['id', 'Costo', 'tmpl_id'])
+    info['Costo'] = info['standard_price']
+    decodificar_m2o(info, 'product_tmpl_id', 'tmpl_id')
+    return info[['id', 'Costo', 'tmpl_id']]
 
+@metricas.medir
 @st.cache_data(ttl=3600)
 def cargar_inventario_baja_rotacion():
     try:
-        common = xmlrpc.client.ServerProxy(f'{URL}/xmlrpc/2/common')
-        uid = common.authenticate(DB, USERNAME, PASSWORD, {})
-        models = xmlrpc.client.ServerProxy(f'{URL}/xmlrpc/2/object')
-        try: ids_tmpl_kits = [b['product_tmpl_id'][0] for b in models.execute_kw(DB, uid, PASSWORD, 'mrp.bom', 'read', [models.execute_kw(DB, uid, PASSWORD, 'mrp.bom', 'search', [[['type', '=', 'phantom']]])], {'fields': ['product_tmpl_id']}) if b['product_tmpl_id']]
-        except: ids_tmpl_kits = []
-        ids_locs = models.execute_kw(DB, uid, PASSWORD, 'stock.location', 'search', [[['complete_name', 'ilike', 'BP/Stock'], ['usage', '=', 'internal'], ['company_id', '=', COMPANY_ID]]])
+        ids_tmpl_kits = cargar_kits_fantasma()
+        ids_locs = odoo.execute_kw('stock.location', 'search', [[['complete_name', 'ilike', 'BP/Stock'], ['usage', '=', 'internal'], ['company_id', '=', COMPANY_ID]]])
         if not ids_locs: return pd.DataFrame(), "❌ No BP/Stock"
-        data_q = models.execute_kw(DB, uid, PASSWORD, 'stock.quant', 'read', [models.execute_kw(DB, uid, PASSWORD, 'stock.quant', 'search', [[['location_id', 'child_of', ids_locs], ['quantity', '>', 0], ['company_id', '=', COMPANY_ID]]])], {'fields': ['product_id', 'quantity', 'location_id']})
+        data_q = odoo.execute_kw('stock.quant', 'search_read', [[['location_id', 'child_of', ids_locs], ['quantity', '>', 0], ['company_id', '=', COMPANY_ID]]], {'fields': ['product_id', 'quantity', 'location_id']})
         df = pd.DataFrame(data_q)
         if df.empty: return pd.DataFrame(), "Bodega vacía"
-        df['pid'] = df['product_id'].apply(lambda x: x[0] if isinstance(x,list) else x)
-        df['Producto'] = df['product_id'].apply(lambda x: x[1] if isinstance(x,list) else "-")
-        df['Ubicacion'] = df['location_id'].apply(lambda x: x[1] if isinstance(x,list) else "-")
+        decodificar_m2o(df, 'product_id', 'pid', 'Producto', nombre_nulo="-")
+        decodificar_m2o(df, 'location_id', col_nombre='Ubicacion', nombre_nulo="-")
         df = df.drop(columns=['product_id', 'location_id'], errors='ignore')
-        info = pd.DataFrame(models.execute_kw(DB, uid, PASSWORD, 'product.product', 'read', [df['pid'].unique().tolist()], {'fields': ['standard_price', 'product_tmpl_id', 'detailed_type']}))
-        info['Costo'] = info['standard_price']
-        info['tmpl_id'] = info['product_tmpl_id'].apply(lambda x: x[0] if x else 0)
-        df = pd.merge(df, info, left_on='pid', right_on='id', how='left')
+        # Solo almacenables (el merge interno descarta servicios/consumibles) y sin kits fantasma
+        df = pd.merge(df, cargar_info_almacenables(), left_on='pid', right_on='id', how='inner')
         if ids_tmpl_kits: df = df[~df['tmpl_id'].isin(ids_tmpl_kits)]
-        df = df[df['detailed_type'] == 'product']
         df['Valor'] = df['quantity'] * df['Costo']
-        moves = models.execute_kw(DB, uid, PASSWORD, 'stock.move', 'read', [models.execute_kw(DB, uid, PASSWORD, 'stock.move', 'search', [[['product_id', 'in', df['pid'].unique().tolist()], ['state', '=', 'done'], ['date', '>=', (datetime.now()-timedelta(days=365)).strftime('%Y-%m-%d')], ['location_dest_id.usage', 'in', ['customer', 'production']]]])], {'fields': ['product_id', 'date']})
-        mapa = pd.DataFrame(moves)
-        mapa_dict = {}
-        if not mapa.empty:
-            mapa['pid'] = mapa['product_id'].apply(lambda x: x[0])
-            mapa['date'] = pd.to_datetime(mapa['date'])
-            mapa_dict = mapa.groupby('pid')['date'].max().to_dict()
-        df['Dias_Sin_Salida'] = df['pid'].apply(lambda x: (pd.Timestamp.now()-mapa_dict[x]).days if x in mapa_dict else 366)
+        ultima = df['pid'].map(indice_ultima_salida())
+        df['Dias_Sin_Salida'] = (pd.Timestamp.now() - ultima).dt.days.fillna(366).clip(upper=366).astype(int)
         res = df.groupby('Producto').agg({'quantity':'sum', 'Valor':'sum', 'Dias_Sin_Salida':'min', 'Ubicacion': lambda x: ", ".join(sorted(set(str(v) for v in x)))}).reset_index().sort_values('Dias_Sin_Salida', ascending=False)
         return res, "OK"
-    except Exception as e: return pd.DataFrame(), f"Err: {e}"
+    except Exception as e: return metricas.tragada(e, (pd.DataFrame(), f"Err: {e}"))
 
-@st.cache_data(ttl=3600)
+@metricas.medir
+@cache_persistente('estructura_analitica', ttl=3600, version=1)
 def cargar_estructura_analitica():
     try:
-        common = xmlrpc.client.ServerProxy(f'{URL}/xmlrpc/2/common')
-        uid = common.authenticate(DB, USERNAME, PASSWORD, {})
-        models = xmlrpc.client.ServerProxy(f'{URL}/xmlrpc/2/object')
-        plans = pd.DataFrame(models.execute_kw(DB, uid, PASSWORD, 'account.analytic.plan', 'read', [models.execute_kw(DB, uid, PASSWORD, 'account.analytic.plan', 'search', [[['id', '!=', 0]]])], {'fields': ['name']})).rename(columns={'id': 'plan_id', 'name': 'Plan_Nombre'})
-        accs = pd.DataFrame(models.execute_kw(DB, uid, PASSWORD, 'account.analytic.account', 'read', [models.execute_kw(DB, uid, PASSWORD, 'account.analytic.account', 'search', [[['active', 'in', [True, False]]]])], {'fields': ['name', 'plan_id']}))
+        plans = pd.DataFrame(odoo.execute_kw('account.analytic.plan', 'read', [odoo.execute_kw('account.analytic.plan', 'search', [[['id', '!=', 0]]])], {'fields': ['name']})).rename(columns={'id': 'plan_id', 'name': 'Plan_Nombre'})
+        accs = pd.DataFrame(odoo.execute_kw('account.analytic.account', 'read', [odoo.execute_kw('account.analytic.account', 'search', [[['active', 'in', [True, False]]]])], {'fields': ['name', 'plan_id']}))
         if not accs.empty:
-            accs['plan_id'] = accs['plan_id'].apply(lambda x: x[0] if isinstance(x,list) else (x if x else 0))
+            decodificar_m2o(accs, 'plan_id', 'plan_id')
             df = pd.merge(accs, plans, on='plan_id', how='left').rename(columns={'id': 'id_cuenta_analitica', 'name': 'Cuenta_Nombre'})
             df['Plan_Nombre'] = df['Plan_Nombre'].fillna("Sin Plan")
             return df[['id_cuenta_analitica', 'Cuenta_Nombre', 'Plan_Nombre']]
         return pd.DataFrame()
-    except: return pd.DataFrame()
+    except Exception as e: return metricas.tragada(e, pd.DataFrame())
 
-@st.cache_data(ttl=3600)
-def cargar_pnl_historico():
+def _cuentas_pnl():
+    return list(set(config.TODOS_LOS_IDS + odoo.execute_kw('account.account', 'search', [[['code', '=like', '6%']]])))
+
+def _dominio_pnl():
+    return [['account_id', 'in', _cuentas_pnl()], ['company_id', '=', COMPANY_ID], ['parent_state', '=', 'posted'], ['analytic_distribution', '!=', False]]
+
+def _clasificar_pnl(ids_cuenta):
+    def clasificar(id_acc):
+        if id_acc in config.IDS_INGRESOS: return "Venta"
+        if id_acc == config.ID_WIP: return "WIP"
+        if id_acc == config.ID_PROVISION_PROY: return "Provisión"
+        if id_acc == config.ID_COSTO_INSTALACION: return "Instalación"
+        if id_acc == config.ID_SUMINISTROS_PROY: return "Suministros"
+        if id_acc == config.ID_AJUSTES_INV: return "Ajustes Inv"
+        if id_acc == config.ID_COSTO_RETAIL: return "Costo Retail"
+        return "Otros Gastos"
+    return ids_cuenta.apply(clasificar)
+
+def _procesar_pnl(df):
+    decodificar_m2o(df, 'account_id', 'ID_Cuenta')
+    # Una fila por línea y cuenta analítica, con los montos prorrateados según su %
+    dist = explotar_distribucion(df)
+    df = df.drop(columns=['account_id', 'analytic_distribution'], errors='ignore').merge(dist, left_on='id', right_on='id_linea', how='inner')
+    df['debit'] = df['debit'] * df['pct'] / 100.0
+    df['credit'] = df['credit'] * df['pct'] / 100.0
+    df = df.drop(columns=['id_linea', 'pct'])
+    df['Monto_Neto'] = df['credit'] - df['debit']
+    df['Clasificacion'] = _clasificar_pnl(df['ID_Cuenta'])
+    return df
+
+@metricas.medir
+@cache_persistente('pnl_historico', ttl=3600, max_obsoleto=config.CACHE_MAX_OBSOLETO_S, version=1)
+def cargar_pnl_historico(ids_an=None):
+    # Detalle por línea; con ids_an solo trae las líneas de esas cuentas analíticas
     try:
-        common = xmlrpc.client.ServerProxy(f'{URL}/xmlrpc/2/common')
-        uid = common.authenticate(DB, USERNAME, PASSWORD, {})
-        models = xmlrpc.client.ServerProxy(f'{URL}/xmlrpc/2/object')
-        ids = list(set(config.TODOS_LOS_IDS + models.execute_kw(DB, uid, PASSWORD, 'account.account', 'search', [[['code', '=like', '6%']]])))
-        data = models.execute_kw(DB, uid, PASSWORD, 'account.move.line', 'read', [models.execute_kw(DB, uid, PASSWORD, 'account.move.line', 'search', [[['account_id', 'in', ids], ['company_id', '=', COMPANY_ID], ['parent_state', '=', 'posted'], ['analytic_distribution', '!=', False]]])], {'fields': ['date', 'account_id', 'debit', 'credit', 'analytic_distribution']})
+        dominio = _dominio_pnl()
+        if ids_an: dominio.append(['analytic_distribution', 'in', [int(x) for x in ids_an if x]])
+        data = odoo.read_paginado('account.move.line', odoo.execute_kw('account.move.line', 'search', [dominio]), ['date', 'account_id', 'debit', 'credit', 'analytic_distribution'])
         df = pd.DataFrame(data)
         if not df.empty:
-            df['ID_Cuenta'] = df['account_id'].apply(lambda x: x[0])
-            def get_aid(d):
-                try: return int(list((d if isinstance(d,dict) else ast.literal_eval(str(d))).keys())[0])
-                except: return None
-            df['id_cuenta_analitica'] = df['analytic_distribution'].apply(get_aid)
-            df = df.drop(columns=['account_id', 'analytic_distribution'], errors='ignore')
-            df['Monto_Neto'] = df['credit'] - df['debit']
-            def clasificar(id_acc):
-                if id_acc in config.IDS_INGRESOS: return "Venta"
-                if id_acc == config.ID_WIP: return "WIP"
-                if id_acc == config.ID_PROVISION_PROY: return "Provisión"
-                if id_acc == config.ID_COSTO_INSTALACION: return "Instalación"
-                if id_acc == config.ID_SUMINISTROS_PROY: return "Suministros"
-                if id_acc == config.ID_AJUSTES_INV: return "Ajustes Inv"
-                if id_acc == config.ID_COSTO_RETAIL: return "Costo Retail"
-                return "Otros Gastos"
-            df['Clasificacion'] = df['ID_Cuenta'].apply(clasificar)
+            df = _procesar_pnl(df)
+            if ids_an: df = df[df['id_cuenta_analitica'].isin([int(x) for x in ids_an if x])]
         return df
-    except: return pd.DataFrame()
+    except Exception as e: return metricas.tragada(e, pd.DataFrame())
 
+def _columnas_plan():
+    # account_id es el plan principal; desde Odoo 17 cada plan adicional tiene su columna x_plan<N>_id
+    campos = odoo.execute_kw('account.analytic.line', 'fields_get', [], {'attributes': ['type', 'relation']})
+    return [c for c, f in campos.items() if f.get('relation') == 'account.analytic.account' and (c == 'account_id' or re.fullmatch(r'x_plan\d+_id', c))]
+
+def _inicio_mes(grupo):
+    # Primer día del mes de un grupo date:month: __range (Odoo 17) o el "date >= ..." de su __domain (Odoo 16);
+    # la etiqueta ("enero 2024") depende del idioma del usuario y no sirve
+    rango = (grupo.get('__range') or {}).get('date:month')
+    if rango: return rango['from']
+    return next((c[2] for c in grupo.get('__domain', []) if isinstance(c, (list, tuple)) and c[:2] in (['date', '>='], ('date', '>='))), False)
+
+@metricas.medir
+@cache_persistente('pnl_agrupado', ttl=3600, max_obsoleto=config.CACHE_MAX_OBSOLETO_S, version=2)
+def cargar_pnl_agrupado():
+    # Totales por cuenta contable × cuenta analítica × mes calculados en Odoo: miles de grupos en vez de cientos
+    # de miles de líneas (date = primer día del mes). Se agrupan los apuntes analíticos (account.analytic.line), que
+    # ya traen el monto prorrateado por su %; agrupar account.move.line por analytic_distribution no sirve (Odoo solo
+    # admite __count y cada grupo sumaría la línea completa). Mismas columnas que cargar_pnl_historico.
+    try:
+        # Odoo repite este dominio en el __domain de cada grupo: se expresa corto (sin la lista de cuentas 6xxx)
+        dominio = ['|', ['general_account_id', 'in', config.TODOS_LOS_IDS], ['general_account_id.code', '=like', '6%'], ['company_id', '=', COMPANY_ID]]
+        filas = []
+        for col in _columnas_plan():
+            grupos = odoo.execute_kw('account.analytic.line', 'read_group', [dominio + [[col, '!=', False]], ['amount:sum'], [col, 'general_account_id', 'date:month']], {'lazy': False})
+            filas += [{'date': _inicio_mes(g), 'ID_Cuenta': _par_m2o(g.get('general_account_id'), 0, None)[0], 'id_cuenta_analitica': _par_m2o(g.get(col), 0, None)[0],
+                       'Monto_Neto': g.get('amount') or 0.0, 'Lineas': g.get('__count', 0)} for g in grupos]
+        df = pd.DataFrame(filas)
+        if not df.empty:
+            df.insert(0, 'id', np.arange(len(df), dtype='int64'))
+            df['debit'] = (-df['Monto_Neto']).clip(lower=0)
+            df['credit'] = df['Monto_Neto'].clip(lower=0)
+            df['Clasificacion'] = _clasificar_pnl(df['ID_Cuenta'])
+        return df
+    except Exception as e:
+        # Servidor que no permite agrupar los apuntes analíticos: volver al detalle por línea
+        metricas.tragada(e)
+        return cargar_pnl_historico()
+
+@metricas.medir
 @st.cache_data(ttl=900)
 def cargar_detalle_horas_mes(ids):
     try:
         if not ids: return pd.DataFrame()
-        common = xmlrpc.client.ServerProxy(f'{URL}/xmlrpc/2/common')
-        uid = common.authenticate(DB, USERNAME, PASSWORD, {})
-        models = xmlrpc.client.ServerProxy(f'{URL}/xmlrpc/2/object')
         hoy = datetime.now()
-        ids_l = models.execute_kw(DB, uid, PASSWORD, 'account.analytic.line', 'search', [[['account_id', 'in', [int(x) for x in ids if x]], ['date', '>=', hoy.replace(day=1).strftime('%Y-%m-%d')], ['date', '<=', hoy.strftime('%Y-%m-%d')], ['x_studio_tipo_horas_1', '!=', False]]])
-        data = models.execute_kw(DB, uid, PASSWORD, 'account.analytic.line', 'read', [ids_l], {'fields': ['amount', 'unit_amount', 'x_studio_tipo_horas_1']})
+        ids_l = odoo.execute_kw('account.analytic.line', 'search', [[['account_id', 'in', [int(x) for x in ids if x]], ['date', '>=', hoy.replace(day=1).strftime('%Y-%m-%d')], ['date', '<=', hoy.strftime('%Y-%m-%d')], ['x_studio_tipo_horas_1', '!=', False]]])
+        data = odoo.execute_kw('account.analytic.line', 'read', [ids_l], {'fields': ['amount', 'unit_amount', 'x_studio_tipo_horas_1']})
         df = pd.DataFrame(data)
         if not df.empty:
             df['Multiplicador'] = df['x_studio_tipo_horas_1'].astype(str).apply(lambda x: 3.0 if "doble" in x.lower() else (1.5 if "extra" in x.lower() else 1.0))
@@ -283,114 +872,120 @@ def cargar_detalle_horas_mes(ids):
             df['Horas'] = df['unit_amount']
             df['Tipo_Hora'] = df['x_studio_tipo_horas_1']
         return df
-    except: return pd.DataFrame()
+    except Exception as e: return metricas.tragada(e, pd.DataFrame())
+
+# --- RESOLUCIÓN PROYECTO -> UBICACIONES DE STOCK (memo compartido por los loaders de inventario) ---
+# Cada consulta se memoiza por clave (cuenta analítica, nombre, proyecto, juego de palabras, raíces) con vigencia UBICACIONES_TTL_S;
+# las claves que faltan se piden a Odoo en un solo lote.
+_MEMO_UBIC = {}
+_MEMO_UBIC_LOCK = threading.Lock()
+
+def _memo_lote(tipo, claves, consultar):
+    ahora = time.time()
+    res, faltan = {}, []
+    with _MEMO_UBIC_LOCK:
+        for k in claves:
+            e = _MEMO_UBIC.get((tipo, k))
+            if e and ahora - e[0] < config.UBICACIONES_TTL_S: res[k] = e[1]
+            else: faltan.append(k)
+    if faltan:
+        nuevos = consultar(faltan)
+        with _MEMO_UBIC_LOCK:
+            for k in faltan:
+                res[k] = nuevos.get(k, [])
+                _MEMO_UBIC[(tipo, k)] = (ahora, res[k])
+    return res
+
+def _agrupar(registros, campo_clave, clave):
+    salida = {}
+    for r in registros: salida.setdefault(clave(r[campo_clave]), []).append(r['id'])
+    return salida
+
+def _proyectos_por_cuenta(ids):
+    regs = odoo.execute_kw('project.project', 'search_read', [[['analytic_account_id', 'in', ids]]], {'fields': ['analytic_account_id']})
+    return _agrupar(regs, 'analytic_account_id', lambda v: v[0] if v else 0)
 
+def _proyectos_por_nombre(nombres):
+    regs = odoo.execute_kw('project.project', 'search_read', [[['name', 'in', nombres]]], {'fields': ['name']})
+    return _agrupar(regs, 'name', lambda v: v)
+
+def _ubicaciones_por_proyecto(ids):
+    regs = odoo.execute_kw('stock.location', 'search_read', [[['x_studio_field_qCgKk', 'in', ids]]], {'fields': ['x_studio_field_qCgKk']})
+    return _agrupar(regs, 'x_studio_field_qCgKk', lambda v: v[0] if v else 0)
+
+def _ubicaciones_por_palabras(grupos):
+    # Un solo dominio OR con todos los ilike; el resultado es el de Odoo (acentos, mayúsculas, % y _ los resuelve el servidor)
+    palabras = grupos[0]
+    dominio = ['|'] * (len(palabras) - 1) + [['name', 'ilike', p] for p in palabras]
+    return {palabras: odoo.execute_kw('stock.location', 'search', [dominio])}
+
+def _arbol_ubicaciones(raices):
+    return {raices[0]: odoo.execute_kw('stock.location', 'search_read', [[['id', 'child_of', list(raices[0])]]], {'fields': ['complete_name', 'usage']})}
+
+def resolver_ubicaciones_proyecto(ids_an, names_an, project_id=None):
+    # Devuelve (ids de ubicaciones raíz del proyecto, árbol child_of con id/complete_name/usage)
+    ids_an = [int(x) for x in (ids_an or []) if x]
+    names_an = [n for n in (names_an or []) if n]
+    ids_loc = []
+    
+    # 1. Búsqueda DIRECTA por ID de Proyecto (Prioridad Alta)
+    if project_id:
+        try: ids_loc += _memo_lote('ubic_proyecto', [int(project_id)], _ubicaciones_por_proyecto)[int(project_id)]
+        except Exception as e: metricas.tragada(e)
+    
+    # 2. Búsqueda por Cuenta Analítica y por Nombre de Proyecto -> ids_proy
+    ids_proy = []
+    if ids_an:
+        try: ids_proy += [p for v in _memo_lote('proy_cuenta', ids_an, _proyectos_por_cuenta).values() for p in v]
+        except Exception as e: metricas.tragada(e)
+    if names_an:
+        try: ids_proy += [p for v in _memo_lote('proy_nombre', names_an, _proyectos_por_nombre).values() for p in v]
+        except Exception as e: metricas.tragada(e)
+    ids_proy = list(set(ids_proy))
+    if ids_proy: ids_loc += [l for v in _memo_lote('ubic_proyecto', ids_proy, _ubicaciones_por_proyecto).values() for l in v]
+    
+    # 3. Búsqueda por Nombre (Legacy / Fallback)
+    if names_an and not ids_loc:
+        palabras = tuple(sorted({n.split(' ')[0] for n in names_an if len(n) > 4}))
+        if palabras: ids_loc += _memo_lote('ubic_palabras', [palabras], _ubicaciones_por_palabras)[palabras]
+    
+    ids_loc = list(set(ids_loc))
+    arbol = _memo_lote('arbol', [tuple(sorted(ids_loc))], _arbol_ubicaciones)[tuple(sorted(ids_loc))] if ids_loc else []
+    return ids_loc, pd.DataFrame(arbol, columns=['id', 'complete_name', 'usage'])
+
+@metricas.medir
 @st.cache_data(ttl=900)
 def cargar_inventario_ubicacion_proyecto_v4(ids_an, names_an, project_id=None):
     try:
-        common = xmlrpc.client.ServerProxy(f'{URL}/xmlrpc/2/common')
-        uid = common.authenticate(DB, USERNAME, PASSWORD, {})
-        models = xmlrpc.client.ServerProxy(f'{URL}/xmlrpc/2/object')
-        
-        ids_loc = []
-        
-        # 1. Búsqueda DIRECTA por ID de Proyecto (Prioridad Alta)
-        if project_id:
-            try:
-                locs_by_proj = models.execute_kw(DB, uid, PASSWORD, 'stock.location', 'search', [[['x_studio_field_qCgKk', '=', project_id]]])
-                if locs_by_proj: ids_loc += locs_by_proj
-            except: pass
-
-        # 2. Búsqueda por Cuenta Analítica
-        ids_proy = []
-        if ids_an: 
-            try: 
-                ids_proy += models.execute_kw(DB, uid, PASSWORD, 'project.project', 'search', [[['analytic_account_id', 'in', [int(x) for x in ids_an if x]]]])
-            except: pass
-            
-            # 3. Búsqueda por Nombre de Proyecto (Siempre ejecutar para mayor robustez)
-        if names_an:
-            try:
-                # Buscar también por nombre para asegurar coincidencia
-                ids_proy += models.execute_kw(DB, uid, PASSWORD, 'project.project', 'search', [[['name', 'in', names_an]]])
-            except: pass
-        
-        # Eliminar duplicados de Proyectos encontrados
-        ids_proy = list(set(ids_proy))
-            
-        # Buscar ubicaciones usando los IDs de PROYECTO encontrados
-        if ids_proy:
-             ids_loc += models.execute_kw(DB, uid, PASSWORD, 'stock.location', 'search', [[['x_studio_field_qCgKk', 'in', ids_proy]]])
-
-            
-        # 3. Búsqueda por Nombre (Legacy / Fallback)
-        if names_an and not ids_loc:
-            for n in names_an:
-                if len(n)>4: ids_loc += models.execute_kw(DB, uid, PASSWORD, 'stock.location', 'search', [[['name', 'ilike', n.split(' ')[0]]]])
-        
-        ids_loc = list(set(ids_loc))
+        ids_loc, arbol = resolver_ubicaciones_proyecto(ids_an, names_an, project_id)
         if not ids_loc: return pd.DataFrame(), "NO_BODEGA", []
-        names = [l['complete_name'] for l in models.execute_kw(DB, uid, PASSWORD, 'stock.location', 'read', [ids_loc], {'fields': ['complete_name']})]
-        data = models.execute_kw(DB, uid, PASSWORD, 'stock.quant', 'read', [models.execute_kw(DB, uid, PASSWORD, 'stock.quant', 'search', [[['location_id', 'child_of', ids_loc], ['company_id', '=', COMPANY_ID]]])], {'fields': ['product_id', 'quantity']})
+        names = arbol.set_index('id').reindex(ids_loc)['complete_name'].dropna().tolist()
+        data = odoo.execute_kw('stock.quant', 'search_read', [[['location_id', 'in', arbol['id'].tolist()], ['company_id', '=', COMPANY_ID]]], {'fields': ['product_id', 'quantity']})
         df = pd.DataFrame(data)
         if df.empty: return pd.DataFrame(), "NO_STOCK", names
-        df['pid'] = df['product_id'].apply(lambda x: x[0])
-        df['pname'] = df['product_id'].apply(lambda x: x[1])
+        decodificar_m2o(df, 'product_id', 'pid', 'pname')
         grp = df.groupby(['pid', 'pname'])['quantity'].sum().reset_index()
-        costos = pd.DataFrame(models.execute_kw(DB, uid, PASSWORD, 'product.product', 'read', [grp['pid'].unique().tolist()], {'fields': ['standard_price']})).rename(columns={'id':'pid', 'standard_price':'Costo'})
+        costos = pd.DataFrame(odoo.execute_kw('product.product', 'read', [grp['pid'].unique().tolist()], {'fields': ['standard_price']})).rename(columns={'id':'pid', 'standard_price':'Costo'})
         fin = pd.merge(grp, costos, on='pid', how='left')
         fin['Valor_Total'] = fin['quantity'] * fin['Costo']
         return fin[fin['quantity']!=0], "OK", names
-    except Exception as e: return pd.DataFrame(), str(e), []
+    except Exception as e: return metricas.tragada(e, (pd.DataFrame(), str(e), []))
 
+@metricas.medir
 @st.cache_data(ttl=900)
 def cargar_historial_inventario_proyecto(ids_an, names_an, project_id=None):
     try:
-        common = xmlrpc.client.ServerProxy(f'{URL}/xmlrpc/2/common')
-        uid = common.authenticate(DB, USERNAME, PASSWORD, {})
-        models = xmlrpc.client.ServerProxy(f'{URL}/xmlrpc/2/object')
-        
-        ids_loc = []
-        
-        # 1. Búsqueda DIRECTA por ID de Proyecto (Prioridad Alta)
-        if project_id:
-            try:
-                locs_by_proj = models.execute_kw(DB, uid, PASSWORD, 'stock.location', 'search', [[['x_studio_field_qCgKk', '=', project_id]]])
-                if locs_by_proj: ids_loc += locs_by_proj
-            except: pass
-
-        # 2. Búsqueda por Cuenta Analítica o Nombre -> Poner en ids_proy
-        ids_proy = []
-        if ids_an: 
-            try: 
-                ids_proy += models.execute_kw(DB, uid, PASSWORD, 'project.project', 'search', [[['analytic_account_id', 'in', [int(x) for x in ids_an if x]]]])
-            except: pass
-            
-        if names_an:
-            try:
-                ids_proy += models.execute_kw(DB, uid, PASSWORD, 'project.project', 'search', [[['name', 'in', names_an]]])
-            except: pass
-        
-        ids_proy = list(set(ids_proy))
-            
-        # Buscar ubicaciones usando los IDs de PROYECTO encontrados
-        if ids_proy:
-             ids_loc += models.execute_kw(DB, uid, PASSWORD, 'stock.location', 'search', [[['x_studio_field_qCgKk', 'in', ids_proy]]])
-             
-        # 3. Búsqueda por Nombre (Legacy / Fallback)
-        if names_an and not ids_loc:
-            for n in names_an:
-                if len(n)>4: ids_loc += models.execute_kw(DB, uid, PASSWORD, 'stock.location', 'search', [[['name', 'ilike', n.split(' ')[0]]]])
-        
-        ids_loc = list(set(ids_loc))
-        if not ids_loc: return pd.DataFrame(), "NO_BODEGA"
+        ids_loc, arbol = resolver_ubicaciones_proyecto(ids_an, names_an, project_id)
+        if not ids_loc: return pd.DataFrame(), pd.DataFrame(), pd.DataFrame(), "NO_BODEGA"
+        # Todas las ubicaciones anidadas del proyecto (ya resueltas con child_of por el resolver)
+        child_locs = set(arbol['id'].tolist())
         
         # 4. Obtener pickings desde Órdenes de Venta ligadas a la Cuenta Analítica del Proyecto
         # Esto soluciona el caso donde el material sale de "BP/Stock" hacia el cliente pero pertenece al proyecto.
         ids_pickings_so = []
         if ids_an:
             # Buscar SOs de este proyecto
-            sos = models.execute_kw(DB, uid, PASSWORD, 'sale.order', 'search_read', [[['analytic_account_id', 'in', ids_an]]], {'fields': ['picking_ids']})
+            sos = odoo.execute_kw('sale.order', 'search_read', [[['analytic_account_id', 'in', ids_an]]], {'fields': ['picking_ids']})
             for so in sos:
                 if so.get('picking_ids'):
                     ids_pickings_so.extend(so['picking_ids'])
@@ -399,236 +994,337 @@ def cargar_historial_inventario_proyecto(ids_an, names_an, project_id=None):
         domain_moves_loc = [
             ['state', '=', 'done'],
             '|',
-            ['location_id', 'child_of', ids_loc],
-            ['location_dest_id', 'child_of', ids_loc],
+            ['location_id', 'in', list(child_locs)],
+            ['location_dest_id', 'in', list(child_locs)],
             ['company_id', '=', COMPANY_ID]
         ]
-        ids_moves_loc = models.execute_kw(DB, uid, PASSWORD, 'stock.move', 'search', [domain_moves_loc])
+        ids_moves_loc = odoo.execute_kw('stock.move', 'search', [domain_moves_loc])
         
         ids_moves_so = []
         if ids_pickings_so:
             domain_moves_so = [['state', '=', 'done'], ['picking_id', 'in', ids_pickings_so], ['company_id', '=', COMPANY_ID]]
-            ids_moves_so = models.execute_kw(DB, uid, PASSWORD, 'stock.move', 'search', [domain_moves_so])
+            ids_moves_so = odoo.execute_kw('stock.move', 'search', [domain_moves_so])
             
         ids_moves_all = list(set(ids_moves_loc + ids_moves_so))
         
-        if not ids_moves_all: return pd.DataFrame(), "NO_MOVES"
+        if not ids_moves_all: return pd.DataFrame(), pd.DataFrame(), pd.DataFrame(), "NO_MOVES"
         
         # 6. Leer los campos necesarios
         fields = ['product_id', 'product_uom_qty', 'quantity_done', 'location_id', 'location_dest_id', 'date']
-        moves_data = models.execute_kw(DB, uid, PASSWORD, 'stock.move', 'read', [ids_moves_all], {'fields': fields})
+        moves_data = odoo.read_paginado('stock.move', ids_moves_all, fields)
         
         df_moves = pd.DataFrame(moves_data)
-        if df_moves.empty: return pd.DataFrame(), "ERROR"
+        if df_moves.empty: return pd.DataFrame(), pd.DataFrame(), pd.DataFrame(), "ERROR"
         
         # Marcar cuáles movimientos entraron por ser de SO vs de Ubicación para el cálculo de Entregas
         # Si un movimiento NO toca child_locs (ej: sale directo de BP/Stock al Customer) lo aceptamos para Entregas
         df_moves['from_so'] = df_moves['id'].isin(ids_moves_so)
+        decodificar_m2o(df_moves, 'location_id', 'loc_src')
+        decodificar_m2o(df_moves, 'location_dest_id', 'loc_dst')
+        decodificar_m2o(df_moves, 'product_id', 'pid', 'Producto', nombre_nulo='Desc')
         
-        # 5. Filtrar Movimientos: Ensambles (Producción) y Entregas (Cliente)
-        # Identificaremos si la ubicación origen o destino es de tipo "production" o "customer"
+        # 5. Clasificar Movimientos: Ensambles (Producción), Entregas (Cliente) y Ajustes (PROJ/POST/)
+        # Tabla de ubicaciones involucradas con sus banderas; luego todo se resuelve por columnas (sin apply por fila)
+        # (las del árbol del proyecto ya vienen del resolver; solo se leen las externas)
+        all_locs = (set(df_moves['loc_src'].unique()) | set(df_moves['loc_dst'].unique())) - {0} - child_locs
+        locs_data = odoo.execute_kw('stock.location', 'read', [[int(x) for x in all_locs]], {'fields': ['usage', 'complete_name']}) if all_locs else []
+        locs = pd.concat([arbol, pd.DataFrame(locs_data, columns=['id', 'usage', 'complete_name'])], ignore_index=True).set_index('id')
+        nombres_loc = locs['complete_name'].fillna('').astype(str)
         
-        # Recolectar todos los IDs de ubicaciones involucradas
-        all_locs = set()
-        for x in df_moves['location_id'].dropna():
-            if isinstance(x, list) and x: all_locs.add(x[0])
-        for x in df_moves['location_dest_id'].dropna():
-            if isinstance(x, list) and x: all_locs.add(x[0])
-            
-        # Consultar su "usage" y "complete_name"
-        loc_info = {}
-        if all_locs:
-            locs_data = models.execute_kw(DB, uid, PASSWORD, 'stock.location', 'read', [list(all_locs)], {'fields': ['usage', 'complete_name']})
-            for l in locs_data:
-                loc_info[l['id']] = {
-                    'usage': l.get('usage', 'internal'),
-                    'name': l.get('complete_name', '')
-                }
+        locs['es_produccion'] = locs['usage'] == 'production'
+        locs['es_cliente'] = nombres_loc.str.contains('Partner Locations/Customers', regex=False)
+        locs['es_post'] = nombres_loc.str.contains('PROJ/POST/', regex=False)
+        # IN para el proyecto es si el destino físico es la bodega del proyecto; OUT si el origen lo es.
+        # Si el destino es el cliente y el movimiento vino por la SO, para el cliente esto es OUT (Entrega), no un IN al proyecto.
+        locs['es_proyecto'] = locs.index.isin(list(child_locs))
         
-        # Filtrar el dataframe para quedarnos SOLAMENTE con los movimientos que interactúan con Producción o Clientes (Estrictamente "Partner Locations/Customers")
-        def is_production_move(row):
-            src_id = row['location_id'][0] if isinstance(row['location_id'], list) else None
-            dst_id = row['location_dest_id'][0] if isinstance(row['location_dest_id'], list) else None
-            return loc_info.get(src_id, {}).get('usage') == 'production' or loc_info.get(dst_id, {}).get('usage') == 'production'
-
-        def is_customer_move(row):
-            src_id = row['location_id'][0] if isinstance(row['location_id'], list) else None
-            dst_id = row['location_dest_id'][0] if isinstance(row['location_dest_id'], list) else None
-            
-            src_name = loc_info.get(src_id, {}).get('name', '')
-            dst_name = loc_info.get(dst_id, {}).get('name', '')
-            
-            return 'Partner Locations/Customers' in str(src_name) or 'Partner Locations/Customers' in str(dst_name)
-            
-        def is_post_move(row):
-            src_id = row['location_id'][0] if isinstance(row['location_id'], list) else None
-            dst_id = row['location_dest_id'][0] if isinstance(row['location_dest_id'], list) else None
-            
-            src_name = loc_info.get(src_id, {}).get('name', '')
-            dst_name = loc_info.get(dst_id, {}).get('name', '')
-            
-            return 'PROJ/POST/' in str(src_name) or 'PROJ/POST/' in str(dst_name)
-            
-        df_prod = df_moves[df_moves.apply(is_production_move, axis=1)].copy()
-        df_cust = df_moves[df_moves.apply(is_customer_move, axis=1)].copy()
-        df_post = df_moves[df_moves.apply(is_post_move, axis=1)].copy()
+        def bandera(col_loc, flag): return df_moves[col_loc].map(locs[flag]).eq(True)
+        es_in = bandera('loc_dst', 'es_proyecto')
+        es_out = bandera('loc_src', 'es_proyecto')
+        dst_cliente = bandera('loc_dst', 'es_cliente')
+        src_cliente = bandera('loc_src', 'es_cliente')
+        m_prod = bandera('loc_src', 'es_produccion') | bandera('loc_dst', 'es_produccion')
+        m_cust = src_cliente | dst_cliente
+        m_post = bandera('loc_src', 'es_post') | bandera('loc_dst', 'es_post')
         
-        # Obtener todas las ubicaciones anidadas del proyecto para mayor seguridad
-        child_locs = set(models.execute_kw(DB, uid, PASSWORD, 'stock.location', 'search', [[['id', 'child_of', ids_loc]]]))
+        qty = df_moves['quantity_done'].fillna(df_moves['product_uom_qty']).fillna(0)
+        solo_out = qty.where(es_out & ~es_in, 0)
+        solo_in = qty.where(es_in & ~es_out, 0)
         
-        def is_in(row):
-            dest_id = row['location_dest_id'][0] if row['location_dest_id'] else 0
-            # Si el destino es el cliente y el movimiento vino por la SO, para el cliente esto es OUT (Entrega), no un IN al proyecto.
-            # IN para el proyecto es si el destino físico es la bodega del proyecto.
-            return dest_id in child_locs
-            
-        def is_out(row):
-            src_id = row['location_id'][0] if row['location_id'] else 0
-            return src_id in child_locs
-            
-        # 8. Calcular Cantidades - Producción
-        grp_prod = pd.DataFrame()
-        if not df_prod.empty:
-            df_prod['is_in_move'] = df_prod.apply(is_in, axis=1)
-            df_prod['is_out_move'] = df_prod.apply(is_out, axis=1)
-            df_prod['qty'] = df_prod['quantity_done'].fillna(df_prod['product_uom_qty']).fillna(0)
-            
-            # Mapeo a terminología MRP:
-            df_prod['Ensamblado_OUT'] = df_prod.apply(lambda r: r['qty'] if r['is_out_move'] and not r['is_in_move'] else 0, axis=1)
-            df_prod['Desensamblado_IN'] = df_prod.apply(lambda r: r['qty'] if r['is_in_move'] and not r['is_out_move'] else 0, axis=1)
-            
-            df_prod['pid'] = df_prod['product_id'].apply(lambda x: x[0] if x else 0)
-            df_prod['Producto'] = df_prod['product_id'].apply(lambda x: x[1] if x else 'Desc')
-            
-            grp_prod = df_prod.groupby(['pid', 'Producto']).agg({'Ensamblado_OUT':'sum', 'Desensamblado_IN':'sum'}).reset_index()
-            grp_prod['Neto_Ensamblado'] = grp_prod['Ensamblado_OUT'] - grp_prod['Desensamblado_IN']
-            grp_prod = grp_prod.sort_values('Neto_Ensamblado', ascending=False)
-            grp_prod = grp_prod[(grp_prod['Ensamblado_OUT'] != 0) | (grp_prod['Desensamblado_IN'] != 0)]
-
-        # 9. Calcular Cantidades - Clientes
-        grp_cust = pd.DataFrame()
-        if not df_cust.empty:
-            df_cust['qty'] = df_cust['quantity_done'].fillna(df_cust['product_uom_qty']).fillna(0)
-            
-            # Mapeo a terminología Cliente:
-            # Entregado = El destino es "Partner Locations/Customers" (ya el df_cust solo tiene movimientos de Customers, así que validamos si el destino es el Customer).
-            def cust_entregado(r):
-                dst_id = r['location_dest_id'][0] if r['location_dest_id'] else None
-                return r['qty'] if 'Partner Locations/Customers' in str(loc_info.get(dst_id, {}).get('name', '')) else 0
-                
-            def cust_devuelto(r):
-                src_id = r['location_id'][0] if r['location_id'] else None
-                return r['qty'] if 'Partner Locations/Customers' in str(loc_info.get(src_id, {}).get('name', '')) else 0
-            
-            df_cust['Entregado_OUT'] = df_cust.apply(cust_entregado, axis=1)
-            df_cust['Devuelto_IN'] = df_cust.apply(cust_devuelto, axis=1)
-            
-            df_cust['pid'] = df_cust['product_id'].apply(lambda x: x[0] if x else 0)
-            df_cust['Producto'] = df_cust['product_id'].apply(lambda x: x[1] if x else 'Desc')
-            
-            grp_cust = df_cust.groupby(['pid', 'Producto']).agg({'Entregado_OUT':'sum', 'Devuelto_IN':'sum'}).reset_index()
-            grp_cust['Neto_Entregado'] = grp_cust['Entregado_OUT'] - grp_cust['Devuelto_IN']
-            grp_cust = grp_cust.sort_values('Neto_Entregado', ascending=False)
-            grp_cust = grp_cust[(grp_cust['Entregado_OUT'] != 0) | (grp_cust['Devuelto_IN'] != 0)]
-
-        # 10. Calcular Cantidades - Ajustes Posteriores (PROJ/POST/)
-        grp_post = pd.DataFrame()
-        if not df_post.empty:
-            df_post['is_in_move'] = df_post.apply(is_in, axis=1)
-            df_post['is_out_move'] = df_post.apply(is_out, axis=1)
-            df_post['qty'] = df_post['quantity_done'].fillna(df_post['product_uom_qty']).fillna(0)
-            
-            # Mapeo a terminología Post:
-            df_post['Ajuste_OUT'] = df_post.apply(lambda r: r['qty'] if r['is_out_move'] and not r['is_in_move'] else 0, axis=1)
-            df_post['Ajuste_IN'] = df_post.apply(lambda r: r['qty'] if r['is_in_move'] and not r['is_out_move'] else 0, axis=1)
-            
-            df_post['pid'] = df_post['product_id'].apply(lambda x: x[0] if x else 0)
-            df_post['Producto'] = df_post['product_id'].apply(lambda x: x[1] if x else 'Desc')
-            
-            grp_post = df_post.groupby(['pid', 'Producto']).agg({'Ajuste_OUT':'sum', 'Ajuste_IN':'sum'}).reset_index()
-            grp_post['Neto_Ajuste'] = grp_post['Ajuste_OUT'] - grp_post['Ajuste_IN']
-            grp_post = grp_post.sort_values('Neto_Ajuste', ascending=False)
-            grp_post = grp_post[(grp_post['Ajuste_OUT'] != 0) | (grp_post['Ajuste_IN'] != 0)]
+        def resumir(mascara, col_out, serie_out, col_in, serie_in, col_neto):
+            if not mascara.any(): return pd.DataFrame()
+            d = df_moves.loc[mascara, ['pid', 'Producto']].assign(**{col_out: serie_out[mascara], col_in: serie_in[mascara]})
+            grp = d.groupby(['pid', 'Producto']).agg({col_out: 'sum', col_in: 'sum'}).reset_index()
+            grp[col_neto] = grp[col_out] - grp[col_in]
+            grp = grp.sort_values(col_neto, ascending=False)
+            return grp[(grp[col_out] != 0) | (grp[col_in] != 0)]
+        
+        # 8. Producción (terminología MRP)
+        grp_prod = resumir(m_prod, 'Ensamblado_OUT', solo_out, 'Desensamblado_IN', solo_in, 'Neto_Ensamblado')
+        # 9. Clientes: Entregado = destino "Partner Locations/Customers"; Devuelto = origen
+        grp_cust = resumir(m_cust, 'Entregado_OUT', qty.where(dst_cliente, 0), 'Devuelto_IN', qty.where(src_cliente, 0), 'Neto_Entregado')
+        # 10. Ajustes Posteriores (PROJ/POST/)
+        grp_post = resumir(m_post, 'Ajuste_OUT', solo_out, 'Ajuste_IN', solo_in, 'Neto_Ajuste')
 
         status_msg = "OK"
         if grp_prod.empty and grp_cust.empty and grp_post.empty:
             status_msg = "NO_MOVES"
             
         return grp_prod, grp_cust, grp_post, status_msg
-    except Exception as e: return pd.DataFrame(), pd.DataFrame(), pd.DataFrame(), str(e)
+    except Exception as e: return metricas.tragada(e, (pd.DataFrame(), pd.DataFrame(), pd.DataFrame(), str(e)))
+
+# Odoo no compara dos campos en un dominio (product_qty > qty_invoiced). Con facturación sobre lo pedido
+# qty_to_invoice ya es esa diferencia; con facturación sobre lo recibido falta lo no recibido, que cubre
+# receipt_status de la orden. Así el histórico ya facturado no se descarga; pandas solo confirma lo que llega.
+_DOMINIO_COMPRAS = [['state', 'in', ['purchase', 'done']], ['date_order', '>=', '2023-01-01'],
+                    '|', ['qty_to_invoice', '>', 0], ['order_id.receipt_status', '!=', 'full']]
+_CAMPOS_COMPRAS = ['order_id', 'partner_id', 'name', 'product_qty', 'qty_invoiced', 'price_unit', 'currency_id', 'date_order']
+
+@st.cache_data(ttl=900)
+def _compras_confirmadas_empresa():
+    # Respaldo para Odoo que no filtra por analytic_distribution: todas las líneas de la empresa, cacheadas una vez para todos los proyectos
+    data = odoo.search_read_paginado('purchase.order.line', _DOMINIO_COMPRAS + [['company_id', '=', COMPANY_ID]], _CAMPOS_COMPRAS + ['analytic_distribution'])
+    df = pd.DataFrame(data)
+    if not df.empty: df = df[df['product_qty'] > df['qty_invoiced']]
+    return df
 
 @st.cache_data(ttl=900)
-def cargar_compras_pendientes_v7_json_scanner(ids_an, tc):
+def _compras_pendientes(ids_an):
+    targets = [int(x) for x in ids_an if x]
+    if not targets: return pd.DataFrame()
     try:
-        common = xmlrpc.client.ServerProxy(f'{URL}/xmlrpc/2/common')
-        uid = common.authenticate(DB, USERNAME, PASSWORD, {})
-        models = xmlrpc.client.ServerProxy(f'{URL}/xmlrpc/2/object')
-        targets = [str(int(x)) for x in ids_an if x]
-        data = models.execute_kw(DB, uid, PASSWORD, 'purchase.order.line', 'read', [models.execute_kw(DB, uid, PASSWORD, 'purchase.order.line', 'search', [[['state', 'in', ['purchase', 'done']], ['company_id', '=', COMPANY_ID], ['date_order', '>=', '2023-01-01']]])], {'fields': ['order_id', 'partner_id', 'name', 'product_qty', 'qty_invoiced', 'price_unit', 'analytic_distribution', 'currency_id']})
-        df = pd.DataFrame(data)
-        if df.empty: return pd.DataFrame()
-        def es_mio(d):
-            try: return any(t in [str(k) for k in (d if isinstance(d,dict) else ast.literal_eval(str(d))).keys()] for t in targets)
-            except: return False
-        df = df[df['analytic_distribution'].apply(es_mio)].copy()
-        df['qty_pending'] = df['product_qty'] - df['qty_invoiced']
-        df = df[df['qty_pending'] > 0]
+        # El filtro por cuenta analítica y el de pendientes los resuelve Odoo
+        dominio = _DOMINIO_COMPRAS + [['company_id', '=', COMPANY_ID], ['analytic_distribution', 'in', targets]]
+        df = pd.DataFrame(odoo.search_read_paginado('purchase.order.line', dominio, _CAMPOS_COMPRAS))
+    except xmlrpc.client.Fault:
+        df = _compras_confirmadas_empresa()
+        if not df.empty:
+            dist = explotar_distribucion(df)
+            df = df[df['id'].isin(dist.loc[dist['id_cuenta_analitica'].isin(targets), 'id_linea'])]
+    if df.empty: return pd.DataFrame()
+    df = df.copy()
+    df['qty_pending'] = df['product_qty'] - df['qty_invoiced']
+    df = df[df['qty_pending'] > 0]
+    if df.empty: return pd.DataFrame()
+    decodificar_m2o(df, 'currency_id', col_nombre='Moneda')
+    decodificar_m2o(df, 'partner_id', col_nombre='Proveedor')
+    decodificar_m2o(df, 'order_id', col_nombre='OC')
+    df['Monto_Moneda'] = df['qty_pending'] * df['price_unit']
+    df['Fecha_Orden'] = pd.to_datetime(df['date_order'].where(df['date_order'].astype(bool), None))
+    df['Cantidad'] = df['qty_pending']
+    df['Producto'] = df['name']
+    return df[['OC', 'Proveedor', 'Producto', 'Cantidad', 'Moneda', 'Fecha_Orden', 'Monto_Moneda']].reset_index(drop=True)
+
+@metricas.medir
+def cargar_compras_pendientes_v7_json_scanner(ids_an, tc=None):
+    # La conversión va fuera de la caché: cambiar el TC en la UI no vuelve a consultar Odoo.
+    # Sin TC manual, cada línea en USD se convierte con la tasa de la fecha de su orden.
+    try:
+        df = _compras_pendientes(ids_an)
         if df.empty: return pd.DataFrame()
-        df['Monto_Pendiente'] = df.apply(lambda r: (r['qty_pending']*r['price_unit']) * (tc if r['currency_id'] and r['currency_id'][1]=='USD' else 1), axis=1)
-        df['Proveedor'] = df['partner_id'].apply(lambda x: x[1])
-        df['OC'] = df['order_id'].apply(lambda x: x[1])
-        df['Cantidad'] = df['qty_pending']
-        df['Producto'] = df['name']
-        df = df.drop(columns=['order_id', 'partner_id', 'analytic_distribution', 'currency_id', 'name'], errors='ignore')
+        monto = df['Monto_Moneda']
+        en_crc = monto * tc if tc else to_crc(monto, df['Fecha_Orden'])
+        df = df.assign(Monto_Pendiente=np.where(df['Moneda'] == 'USD', en_crc, monto))
         return df[['OC', 'Proveedor', 'Producto', 'Cantidad', 'Monto_Pendiente']]
-    except: return pd.DataFrame()
+    except Exception as e: return metricas.tragada(e, pd.DataFrame())
 
 @st.cache_data(ttl=900)
-def cargar_facturacion_estimada_v2(ids_analiticas, tc_usd):
+def _hitos_por_facturar(ids_analiticas):
+    if not ids_analiticas: return pd.DataFrame()
+    ids_clean_an = [int(x) for x in ids_analiticas if pd.notna(x) and x != 0]
+    ids_proys = odoo.execute_kw('project.project', 'search', [[['analytic_account_id', 'in', ids_clean_an]]])
+    if not ids_proys: return pd.DataFrame()
+    proyectos_data = odoo.execute_kw('project.project', 'read', [ids_proys], {'fields': ['name']})
+    if not proyectos_data: return pd.DataFrame()
+    nombres_buscar = [p['name'] for p in proyectos_data if p['name']]
+    if not nombres_buscar: return pd.DataFrame()
+    nombre_buscar = nombres_buscar[0] 
+    dominio = [['x_studio_field_sFPxe', 'ilike', nombre_buscar], ['x_studio_facturado', '=', False]]
+    ids_fact = odoo.execute_kw('x_facturas.proyectos', 'search', [dominio])
+    if not ids_fact: return pd.DataFrame()
+    registros = odoo.execute_kw('x_facturas.proyectos', 'read', [ids_fact], {'fields': ['x_name', 'x_Monto', 'x_Fecha']})
+    return pd.DataFrame(registros)
+
+@metricas.medir
+def cargar_facturacion_estimada_v2(ids_analiticas, tc_usd=None):
+    # Hitos en USD: con TC manual se usa ese; si no, la tasa vigente a la fecha del hito (las futuras toman la última)
     try:
-        if not ids_analiticas: return pd.DataFrame()
-        common = xmlrpc.client.ServerProxy(f'{URL}/xmlrpc/2/common')
-        uid = common.authenticate(DB, USERNAME, PASSWORD, {})
-        models = xmlrpc.client.ServerProxy(f'{URL}/xmlrpc/2/object')
-        ids_clean_an = [int(x) for x in ids_analiticas if pd.notna(x) and x != 0]
-        ids_proys = models.execute_kw(DB, uid, PASSWORD, 'project.project', 'search', [[['analytic_account_id', 'in', ids_clean_an]]])
-        if not ids_proys: return pd.DataFrame()
-        proyectos_data = models.execute_kw(DB, uid, PASSWORD, 'project.project', 'read', [ids_proys], {'fields': ['name']})
-        if not proyectos_data: return pd.DataFrame()
-        nombres_buscar = [p['name'] for p in proyectos_data if p['name']]
-        if not nombres_buscar: return pd.DataFrame()
-        nombre_buscar = nombres_buscar[0] 
-        dominio = [['x_studio_field_sFPxe', 'ilike', nombre_buscar], ['x_studio_facturado', '=', False]]
-        ids_fact = models.execute_kw(DB, uid, PASSWORD, 'x_facturas.proyectos', 'search', [dominio])
-        if not ids_fact: return pd.DataFrame()
-        registros = models.execute_kw(DB, uid, PASSWORD, 'x_facturas.proyectos', 'read', [ids_fact], {'fields': ['x_name', 'x_Monto', 'x_Fecha']})
-        df = pd.DataFrame(registros)
+        df = _hitos_por_facturar(ids_analiticas)
         if not df.empty:
-            df['Monto_CRC'] = df['x_Monto'] * tc_usd
+            df = df.copy()
+            fechas = pd.to_datetime(df['x_Fecha'].where(df['x_Fecha'].astype(bool), None)) if 'x_Fecha' in df.columns else None
+            df['Monto_CRC'] = df['x_Monto'] * tc_usd if tc_usd else to_crc(df['x_Monto'], fechas)
             df['Hito'] = df['x_name'] if 'x_name' in df.columns else "Hito"
             return df
         return pd.DataFrame()
-    except: return pd.DataFrame()
+    except Exception as e: return metricas.tragada(e, pd.DataFrame())
 
-def cargar_metas():
-    # URL RAW de GitHub del archivo metas.csv
-    GITHUB_CSV_URL = "https://raw.githubusercontent.com/jasonsrm12592/dashboard-artk/main/metas.csv"
-    
+# --- CUBO DE VENTAS (agregados precalculados por versión de datos) ---
+# Sumas de venta y conteo de facturas por año × mes × vendedor × provincia × zona × categoría.
+# Las gráficas filtran y re-agrupan el cubo (miles de filas) en vez de recorrer las facturas en cada cambio de widget.
+# El cliente va en un cubo aparte por año × vendedor: cruzado con el mes el cubo sería casi del tamaño de las facturas.
+# Los argumentos con _ no se hashean: la clave de caché es la versión de los datos.
+DIMENSIONES_CUBO = ['Anio', 'Mes_Num', 'Vendedor', 'Provincia', 'Zona_Comercial', 'Categoria_Cliente']
+
+@st.cache_data(ttl=3600, max_entries=4)
+def cubo_ventas(version, _df_main):
+    if _df_main.empty: return pd.DataFrame(columns=DIMENSIONES_CUBO + ['Venta_Neta', 'Venta_Neta_USD', 'Facturas'])
+    df = _df_main.assign(Anio=_df_main['invoice_date'].dt.year)
+    dims = [d for d in DIMENSIONES_CUBO if d in df.columns]
+    return df.groupby(dims, as_index=False, dropna=False, observed=True).agg(Venta_Neta=('Venta_Neta', 'sum'), Venta_Neta_USD=('Venta_Neta_USD', 'sum'), Facturas=('name', 'nunique'))
+
+@st.cache_data(ttl=3600, max_entries=4)
+def cubo_clientes(version, _df_main):
+    if _df_main.empty: return pd.DataFrame(columns=['Anio', 'Vendedor', 'Cliente', 'Venta_Neta'])
+    df = _df_main.assign(Anio=_df_main['invoice_date'].dt.year)
+    return df.groupby(['Anio', 'Vendedor', 'Cliente'], as_index=False, dropna=False, observed=True)['Venta_Neta'].sum()
+
+@st.cache_data(ttl=3600, max_entries=4)
+def cubo_planes(version_prod, version_an, _df_prod, _df_an):
+    # Venta de las líneas de producto repartida por plan analítico, por año × mes × plan.
+    # Las versiones son las de cada frame al cargarse (loader.con_version), no las vigentes al llamar
+    if _df_prod.empty: return pd.DataFrame(columns=['Anio', 'Mes_Num', 'Plan', 'Venta_Neta'])
+    d = repartir_por_plan(_df_prod, cargar_distribucion_productos(version_prod, _df_prod), _df_an, 'Venta_Neta')
+    d = d.assign(Anio=d['date'].dt.year, Mes_Num=d['date'].dt.month)
+    return d.groupby(['Anio', 'Mes_Num', 'Plan'], as_index=False, observed=True)['Venta_Neta'].sum()
+
+def rebanar(cubo, medidas, por, **filtros):
+    # Filtra el cubo (valor o lista por dimensión) y re-agrupa por las dimensiones pedidas
+    m = pd.Series(True, index=cubo.index)
+    for dim, val in filtros.items(): m &= cubo[dim].isin(val) if isinstance(val, (list, tuple, set)) else (cubo[dim] == val)
+    return cubo[m].groupby(por, as_index=False, observed=True)[medidas].sum()
+
+# --- PARTICIONES POR AÑO Y LISTAS DE DIMENSIONES (por versión de datos) ---
+# Filtrar un año es buscar en un dict, no recorrer toda la columna de fechas en cada rerun.
+# cache_resource no copia: las particiones se comparten y son de solo lectura (usar .assign/.copy antes de modificar).
+@st.cache_resource(ttl=3600, max_entries=4)
+def particiones_por_anio(version, _df, col_fecha):
+    if _df.empty or col_fecha not in _df.columns: return {}
+    return {int(a): g for a, g in _df.groupby(_df[col_fecha].dt.year, sort=True)}
+
+def filas_anio(particiones, anio, df_vacio):
+    # Partición del año o un frame vacío con las mismas columnas
+    return particiones.get(int(anio), df_vacio.iloc[:0])
+
+@st.cache_data(ttl=3600, max_entries=4)
+def dimensiones(version, _df_main):
+    def lista(col): return sorted(_df_main[col].dropna().unique()) if col in _df_main.columns else []
+    def por_anio(col, nulo):
+        # Valores observados en cada año, leídos del cubo; el nulo aparece solo si ese año tiene facturas sin valor
+        cubo = cubo_ventas(version, _df_main)
+        if col not in cubo.columns: return {}
+        return {int(a): sorted(g.dropna().astype(str).unique()) + ([nulo] if g.isna().any() else []) for a, g in cubo.groupby('Anio')[col]}
+    return {
+        'anios': sorted(particiones_por_anio(version, _df_main, 'invoice_date'), reverse=True),
+        'clientes': lista('Cliente'),
+        'vendedores': lista('Vendedor'),
+        'categorias': por_anio('Categoria_Cliente', "Sin Categoría"),
+        'zonas': por_anio('Zona_Comercial', "Sin Zona"),
+    }
+
+# --- ÍNDICE POR CLIENTE (Radiografía) ---
+# Posiciones de cada cliente en facturas y líneas + historial anual/mensual ya agregado, una vez por versión.
+# Abrir un cliente es buscar en dicts e .iloc sobre pocas filas, sin importar cuántos clientes o líneas haya.
+def _posiciones(df, col='Cliente'):
+    return df, df.groupby(col, observed=True).indices
+
+@st.cache_resource(ttl=3600, max_entries=2)
+def indice_clientes(version, _df_main, _df_prod):
+    vacio = np.array([], dtype=np.intp)
+    if _df_main.empty: return {'facturas': {}, 'lineas': {}, 'anual': (pd.DataFrame(columns=['Cliente', 'Anio', 'Venta_Neta']), {}), 'mensual': (pd.DataFrame(columns=['Cliente', 'Anio', 'Mes', 'Venta_Neta']), {}), 'vacio': vacio}
+    fechas = _df_main['invoice_date']
+    mensual = _df_main.assign(Anio=fechas.dt.year, Mes=fechas.dt.month).groupby(['Cliente', 'Anio', 'Mes'], as_index=False, observed=True)['Venta_Neta'].sum()
+    anual = mensual.groupby(['Cliente', 'Anio'], as_index=False, observed=True)['Venta_Neta'].sum()
+    lineas = {}
+    if not _df_prod.empty and 'ID_Factura' in _df_prod.columns:
+        cliente_linea = _df_prod['ID_Factura'].map(pd.Series(_df_main['Cliente'].values, index=_df_main['id'].values))
+        lineas = cliente_linea.groupby(cliente_linea, observed=True).indices
+    return {'facturas': _df_main.groupby('Cliente', observed=True).indices, 'lineas': lineas, 'anual': _posiciones(anual), 'mensual': _posiciones(mensual), 'vacio': vacio}
+
+def vista_cliente(indice, cli, df_main, df_prod):
+    # (facturas, líneas de producto, historial anual, historial mensual) del cliente
+    def tomar(par): return par[0].iloc[par[1].get(cli, indice['vacio'])].drop(columns='Cliente').reset_index(drop=True)
+    facturas = df_main.iloc[indice['facturas'].get(cli, indice['vacio'])]
+    lineas = df_prod.iloc[indice['lineas'].get(cli, indice['vacio'])] if not df_prod.empty else df_prod
+    return facturas, lineas, tomar(indice['anual']), tomar(indice['mensual'])
+
+# --- MOTOR DE RIESGO DE FUGA (compartido por Segmentación y Descargas) ---
+# Ciclo habitual = (última - primera compra) / (compras - 1): es el promedio de los intervalos entre compras, sin ordenar ni shift.
+# Las estadísticas por cliente se recalculan completas en cada versión de datos: la sincronización incremental
+# modifica facturas existentes (monto, fecha, cliente), así que no alcanza con sumar las nuevas. El groupby es barato.
+_CHURN = {}
+_CHURN_LOCK = threading.Lock()
+
+def _stats_clientes(df):
+    return df.groupby(df['Cliente'].astype(str)).agg(Primera=('invoice_date', 'min'), Ultima=('invoice_date', 'max'), Compras=('invoice_date', 'size'), Venta_Neta=('Venta_Neta', 'sum'))
+
+def _estadisticas_churn(version, df):
+    with _CHURN_LOCK:
+        estado = _CHURN.get('estado')
+        if estado is not None and estado['version'] == version: return estado['stats']
+    stats = _stats_clientes(df)
+    with _CHURN_LOCK:
+        _CHURN['estado'] = {'version': version, 'stats': stats}
+    return stats
+
+def clientes_en_riesgo(version, df_main, factor=1.5, dias_perdido=365):
+    # Clientes activos (< dias_perdido sin comprar) que superan factor × su ciclo habitual, por venta histórica
+    cols = ['Cliente', 'Ciclo_Habitual', 'Ultima_Compra', 'Dias_Sin_Comprar', 'Venta_Neta']
+    if df_main.empty: return pd.DataFrame(columns=cols)
+    s = _estadisticas_churn(version, df_main)
+    compras = s['Compras'].to_numpy()
+    ciclo = np.where(compras > 1, (s['Ultima'] - s['Primera']).dt.days.to_numpy() / np.maximum(compras - 1, 1), np.nan)
+    dias = (pd.Timestamp.now() - s['Ultima']).dt.days.to_numpy()
+    alerta = (dias > ciclo * factor) & (dias < dias_perdido) & (ciclo > 0)
+    r = pd.DataFrame({'Cliente': s.index[alerta], 'Ciclo_Habitual': ciclo[alerta], 'Ultima_Compra': s['Ultima'].to_numpy()[alerta], 'Dias_Sin_Comprar': dias[alerta], 'Venta_Neta': s['Venta_Neta'].to_numpy()[alerta]})
+    return r.sort_values('Venta_Neta', ascending=False, ignore_index=True)[cols]
+
+# --- METAS DE VENTA (metas.csv remoto con revalidación condicional) ---
+# Los reruns solo leen la copia en memoria. Al arrancar se toma la última descarga guardada en CACHE_DIR
+# (o el metas.csv local) y, vencido METAS_REVALIDAR_S, un hilo pide el remoto con If-None-Match /
+# If-Modified-Since: un 304 no descarga nada; si cambió, se reemplaza la copia y se guarda en disco.
+_METAS = {}
+_METAS_LOCK = threading.Lock()
+
+def _procesar_metas(df):
+    df['Mes'] = pd.to_datetime(df['Mes'])
+    df['Mes_Num'] = df['Mes'].dt.month
+    df['Anio'] = df['Mes'].dt.year
+    return df
+
+def _metas_iniciales():
+    df, meta = leer_de_disco('metas', _firma('metas', config.METAS_URL))
+    if df is not None:
+        return {'df': df, 'etag': meta.get('etag'), 'modificado': meta.get('modificado'), 'ts': datetime.fromisoformat(meta['obtenido_en']).timestamp()}
     try:
-        # Intentar leer desde GitHub
-        df = pd.read_csv(GITHUB_CSV_URL)
-        df['Mes'] = pd.to_datetime(df['Mes'])
-        df['Mes_Num'] = df['Mes'].dt.month
-        df['Anio'] = df['Mes'].dt.year
-        return df
+        if os.path.exists(config.METAS_ARCHIVO): return {'df': _procesar_metas(pd.read_csv(config.METAS_ARCHIVO)), 'ts': 0}
+    except Exception as e: metricas.tragada(e)
+    return {'df': pd.DataFrame({'Mes': [], 'Meta': [], 'Mes_Num': [], 'Anio': []}), 'ts': 0}
+
+def revalidar_metas():
+    with _METAS_LOCK:
+        encabezados = {h: _METAS[k] for h, k in (('If-None-Match', 'etag'), ('If-Modified-Since', 'modificado')) if _METAS.get(k)}
+    try:
+        peticion = urllib.request.Request(config.METAS_URL, headers=encabezados)
+        with urllib.request.urlopen(peticion, timeout=config.METAS_TIMEOUT_S) as r:
+            df = _procesar_metas(pd.read_csv(io.BytesIO(r.read())))
+            etag, modificado = r.headers.get('ETag'), r.headers.get('Last-Modified')
+        with _METAS_LOCK: _METAS.update(df=df, etag=etag, modificado=modificado)
+        guardar_en_disco('metas', _firma('metas', config.METAS_URL), df, {'etag': etag, 'modificado': modificado})
+    except urllib.error.HTTPError as e:
+        if e.code != 304: metricas.tragada(e)
     except Exception as e:
-        # Si falla (sin internet, etc), intentar leer archivo local
-        if os.path.exists("metas.csv"):
-            df = pd.read_csv("metas.csv")
-            df['Mes'] = pd.to_datetime(df['Mes'])
-            df['Mes_Num'] = df['Mes'].dt.month
-            df['Anio'] = df['Mes'].dt.year
-            return df
-            
-    return pd.DataFrame({'Mes': [], 'Meta': [], 'Mes_Num': [], 'Anio': []})
+        # Sin internet, etc.: se sigue sirviendo la copia actual y se reintenta en el próximo intervalo
+        metricas.tragada(e)
+    finally:
+        with _METAS_LOCK: _METAS.update(ts=time.time(), refrescando=False)
 
+@metricas.medir
+def cargar_metas():
+    with _METAS_LOCK:
+        if not _METAS: _METAS.update(_metas_iniciales())
+        lanzar = not _METAS.get('refrescando') and time.time() - _METAS['ts'] > config.METAS_REVALIDAR_S
+        if lanzar: _METAS['refrescando'] = True
+        df = _METAS['df']
+    if lanzar: threading.Thread(target=revalidar_metas, daemon=True).start()
+    return df.copy()
@@ -0,0 +1,112 @@
+# smoke_metas.py
+# Prueba de la revalidación condicional de metas.csv (services.revalidar_metas / cargar_metas) contra un
+# servidor http.server local que imita la copia publicada:
+# - 1ª consulta: 200 con ETag y Last-Modified -> se reemplaza la copia en memoria y se guarda en disco
+# - 2ª consulta: llega con If-None-Match / If-Modified-Since, responde 304 -> se sigue usando el mismo frame
+# - 3ª consulta: el archivo cambió, 200 con otro ETag -> se reemplaza la copia
+#
+# Uso:
+#   python smoke_metas.py
+import http.server
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+
+REPO = os.path.dirname(os.path.abspath(__file__))
+
+CSV_V1 = b"Mes,Meta,Dolares\n2025-01-01,100,10\n2025-02-01,200,20\n"
+CSV_V2 = b"Mes,Meta,Dolares\n2025-01-01,100,10\n2025-02-01,250,25\n2025-03-01,300,30\n"
+
+
+class MetasPublicadas(http.server.BaseHTTPRequestHandler):
+    # Contenido vigente y encabezados condicionales recibidos, compartidos por todas las peticiones
+    version = {'cuerpo': CSV_V1, 'etag': '"v1"', 'modificado': 'Wed, 01 Jan 2025 00:00:00 GMT'}
+    peticiones = []
+
+    def do_GET(self):
+        v = MetasPublicadas.version
+        condicion = {h: self.headers.get(h) for h in ('If-None-Match', 'If-Modified-Since')}
+        coincide = condicion['If-None-Match'] == v['etag']
+        MetasPublicadas.peticiones.append((condicion, 304 if coincide else 200))
+        if coincide:
+            self.send_response(304)
+            self.send_header('ETag', v['etag'])
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/csv')
+        self.send_header('Content-Length', str(len(v['cuerpo'])))
+        self.send_header('ETag', v['etag'])
+        self.send_header('Last-Modified', v['modificado'])
+        self.end_headers()
+        self.wfile.write(v['cuerpo'])
+
+    def log_message(self, *args):
+        pass
+
+
+def correr():
+    import streamlit as st
+    import config
+    import metricas
+
+    tmp = tempfile.mkdtemp(prefix='smoke_metas_')
+    srv = http.server.ThreadingHTTPServer(('127.0.0.1', 0), MetasPublicadas)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    config.CACHE_DIR = tmp
+    config.METAS_URL = f'http://127.0.0.1:{srv.server_address[1]}/metas.csv'
+    config.METAS_REVALIDAR_S = float('inf')
+    # services arma el cliente de Odoo al importarse; la prueba no hace ninguna llamada a Odoo
+    st.secrets._secrets = {'odoo': {'url': 'http://127.0.0.1:9', 'db': 'x', 'username': 'x', 'password': 'x', 'company_id': 1}}
+    import services
+
+    fallas = []
+    def verificar(cond, texto):
+        print(f"{'OK ' if cond else 'ERR'} {texto}", flush=True)
+        if not cond: fallas.append(texto)
+
+    try:
+        with metricas.errores_tragados() as errores:
+            services.revalidar_metas()
+            df_1 = services._METAS['df']
+            verificar(MetasPublicadas.peticiones[-1] == ({'If-None-Match': None, 'If-Modified-Since': None}, 200), "1ª consulta sin condición, 200")
+            verificar(df_1['Meta'].tolist() == [100, 200], "1ª consulta reemplaza la copia")
+
+            services.revalidar_metas()
+            condicion, estado = MetasPublicadas.peticiones[-1]
+            verificar(condicion == {'If-None-Match': '"v1"', 'If-Modified-Since': 'Wed, 01 Jan 2025 00:00:00 GMT'} and estado == 304,
+                      "2ª consulta con If-None-Match / If-Modified-Since, 304")
+            verificar(services._METAS['df'] is df_1, "304 reutiliza el cuerpo en memoria")
+            verificar(services.cargar_metas()['Meta'].tolist() == [100, 200], "cargar_metas sirve la copia tras el 304")
+
+            MetasPublicadas.version = {'cuerpo': CSV_V2, 'etag': '"v2"', 'modificado': 'Sat, 01 Feb 2025 00:00:00 GMT'}
+            services.revalidar_metas()
+            condicion, estado = MetasPublicadas.peticiones[-1]
+            verificar(condicion['If-None-Match'] == '"v1"' and estado == 200, "3ª consulta con el ETag viejo, 200")
+            verificar(services.cargar_metas()['Meta'].tolist() == [100, 250, 300], "el archivo cambiado reemplaza la copia")
+
+            df_disco, meta = services.leer_de_disco('metas', services._firma('metas', config.METAS_URL))
+            verificar(df_disco is not None and meta.get('etag') == '"v2"' and len(df_disco) == 3, "la última descarga queda en disco con su ETag")
+        verificar(not errores, f"sin errores tragados {errores or ''}".strip())
+        verificar(len(MetasPublicadas.peticiones) == 3, "una petición por revalidación")
+    finally:
+        srv.shutdown()
+        shutil.rmtree(tmp, ignore_errors=True)
+    return fallas
+
+
+def main():
+    sys.path.insert(0, REPO)
+    os.chdir(REPO)
+    logging.disable(logging.WARNING)
+    fallas = correr()
+    if fallas:
+        print(f'Fallaron {len(fallas)} verificaciones')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
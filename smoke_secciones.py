@@ -0,0 +1,64 @@
+# smoke_secciones.py
+# Prueba de humo: renderiza cada sección de app_dashboard.py una vez (streamlit AppTest) contra el Odoo
+# de imitación (odoo_fake.py) y falla si alguna levanta una excepción.
+# - La caché en disco va a una carpeta temporal y metas.csv se lee solo de la copia local (sin red)
+# - En Radiografía se abre además el primer cliente, para recorrer el índice por cliente
+#
+# Uso:
+#   python smoke_secciones.py                 # 2000 líneas contables
+#   python smoke_secciones.py --lineas 20000
+import argparse
+import logging
+import os
+import shutil
+import sys
+import tempfile
+
+REPO = os.path.dirname(os.path.abspath(__file__))
+
+
+def correr(lineas, timeout):
+    from streamlit.testing.v1 import AppTest
+    from odoo_fake import ServidorOdooFalso, DB, USUARIO, CLAVE, COMPANY_ID
+    import config
+
+    tmp = tempfile.mkdtemp(prefix='smoke_secciones_')
+    config.CACHE_DIR = tmp
+    config.METAS_REVALIDAR_S = float('inf')
+    srv = ServidorOdooFalso(lineas).iniciar()
+    os.chdir(REPO)
+    fallas = []
+    try:
+        at = AppTest.from_file(os.path.join(REPO, 'app_dashboard.py'), default_timeout=timeout)
+        at.secrets['odoo'] = {'url': srv.url, 'db': DB, 'username': USUARIO, 'password': CLAVE, 'company_id': COMPANY_ID}
+        at.run()
+        for nombre in at.radio(key='seccion_activa').options:
+            at.radio(key='seccion_activa').set_value(nombre).run()
+            if nombre.endswith('Radiografía') and not at.exception:
+                buscar = next(s for s in at.selectbox if s.label == 'Buscar Cliente:')
+                if buscar.options: buscar.set_value(buscar.options[0]).run()
+            errores = [e.value for e in at.exception] + [e.value for e in at.error]
+            print(f"{'OK ' if not errores else 'ERR'} {nombre}", flush=True)
+            for e in errores: print(f'    {e}', flush=True)
+            if errores: fallas.append(nombre)
+    finally:
+        srv.detener()
+        shutil.rmtree(tmp, ignore_errors=True)
+    return fallas
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Renderiza cada sección del dashboard una vez contra un Odoo de imitación')
+    parser.add_argument('--lineas', type=int, default=2000, help='Cantidad de account.move.line a generar')
+    parser.add_argument('--timeout', type=float, default=120, help='Segundos máximos por rerun')
+    args = parser.parse_args()
+    sys.path.insert(0, REPO)
+    logging.disable(logging.WARNING)
+    fallas = correr(args.lineas, args.timeout)
+    if fallas:
+        print(f'Fallaron {len(fallas)} secciones: {", ".join(fallas)}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,9 @@
 # ui.py
 import streamlit as st
-import pandas as pd
 import io
+import threading
+import xlsxwriter
+import perfil
 import plotly.graph_objects as go
 
 # Estilos CSS
@@ -69,12 +71,130 @@ def load_styles():
     </style>
     """, unsafe_allow_html=True)
 
-def convert_df_to_excel(df, sheet_name='Datos'):
+# --- MOTOR DE EXPORTACIÓN ---
+# XLSX en streaming (xlsxwriter constant_memory): cada fila se escribe y se descarta, la RAM no crece con el tamaño.
+# Un frame que no cabe en una hoja se reparte en hojas numeradas (Hoja, Hoja_2, ...).
+FILAS_POR_HOJA = 1048575   # límite de Excel (1.048.576) menos el encabezado
+FILAS_POR_BLOQUE = 50000   # filas convertidas a objetos Python por vez
+
+def _plano(df):
+    # Columnas object (dicts/listas como analytic_distribution, tipos mezclados) -> texto, como lo haría to_excel
+    cols = [c for c in df.columns if df[c].dtype == object]
+    return df.assign(**{c: df[c].where(df[c].isna(), df[c].astype(str)) for c in cols}) if cols else df
+
+def _valores(df):
+    # Columnas -> listas de objetos nativos; nulos (NaN/NaT/<NA>) -> None (celda vacía)
+    df = _plano(df)
+    return [df[c].astype(object).where(df[c].notna(), None).tolist() for c in df.columns]
+
+def libro_excel(hojas, avance=None):
+    # hojas: [(nombre_hoja, df), ...]; avance(fraccion) opcional para reportar progreso
     output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False, sheet_name=sheet_name)
+    total = max(sum(len(df) for _, df in hojas), 1)
+    escritas = 0
+    libro = xlsxwriter.Workbook(output, {'constant_memory': True, 'default_date_format': 'yyyy-mm-dd', 'nan_inf_to_errors': True, 'remove_timezone': True})
+    negrita = libro.add_format({'bold': True, 'border': 1})
+    for nombre, df in hojas:
+        for parte, inicio in enumerate(range(0, max(len(df), 1), FILAS_POR_HOJA)):
+            sufijo = f"_{parte + 1}" if parte else ""
+            hoja = libro.add_worksheet(nombre[:31 - len(sufijo)] + sufijo)
+            hoja.write_row(0, 0, [str(c) for c in df.columns], negrita)
+            fila = 1
+            for b in range(inicio, min(inicio + FILAS_POR_HOJA, len(df)), FILAS_POR_BLOQUE):
+                bloque = df.iloc[b:min(b + FILAS_POR_BLOQUE, inicio + FILAS_POR_HOJA)]
+                for valores in zip(*_valores(bloque)):
+                    hoja.write_row(fila, 0, valores)
+                    fila += 1
+                escritas += len(bloque)
+                if avance: avance(escritas / total)
+    libro.close()
+    if avance: avance(1.0)
     return output.getvalue()
 
+def convert_df_to_excel(df, sheet_name='Datos', avance=None):
+    return libro_excel([(sheet_name, df)], avance)
+
+def convert_df_to_csv_gz(df, avance=None):
+    output = io.BytesIO()
+    df.to_csv(output, index=False, compression={'method': 'gzip', 'compresslevel': 6})
+    if avance: avance(1.0)
+    return output.getvalue()
+
+def convert_df_to_parquet(df, avance=None):
+    output = io.BytesIO()
+    _plano(df).to_parquet(output, index=False, compression='zstd')
+    if avance: avance(1.0)
+    return output.getvalue()
+
+# Formato -> (función, extensión) para el detalle crudo que se baja a otras herramientas
+FORMATOS_EXPORT = {
+    "Excel": (convert_df_to_excel, ".xlsx"),
+    "CSV (gzip)": (convert_df_to_csv_gz, ".csv.gz"),
+    "Parquet": (convert_df_to_parquet, ".parquet"),
+}
+
+def exportar(df, formato, avance=None):
+    return FORMATOS_EXPORT[formato][0](df, avance=avance)
+
+# --- EXPORTACIONES BAJO DEMANDA ---
+# El archivo se genera solo al pedirlo, en un hilo aparte, y queda en memoria por (nombre, versión de datos):
+# volver a descargar los mismos datos no cuesta nada. Mientras se genera, un fragmento consulta el progreso.
+_EXPORTS = {}
+_EXPORTS_LOCK = threading.Lock()
+_EXPORTS_MAX = 16
+
+def _lanzar_export(clave, construir):
+    trabajo = {'estado': 'generando', 'progreso': 0.0, 'datos': None, 'error': None}
+    def avance(p): trabajo['progreso'] = min(max(float(p), 0.0), 1.0)
+    def correr():
+        try:
+            trabajo['datos'] = construir(avance)
+            trabajo['estado'] = 'listo'
+        except Exception as e:
+            trabajo['error'] = str(e)
+            trabajo['estado'] = 'error'
+    with _EXPORTS_LOCK:
+        # Descarta primero los archivos de versiones viejas del mismo export y luego los más antiguos.
+        # Un trabajo que sigue generando no se descarta: su fragmento de progreso lo sigue consultando
+        terminados = [k for k in _EXPORTS if _EXPORTS[k]['estado'] != 'generando']
+        for k in [k for k in terminados if k[0] == clave[0]]: del _EXPORTS[k]
+        terminados = [k for k in terminados if k in _EXPORTS]
+        while len(_EXPORTS) >= _EXPORTS_MAX and terminados: del _EXPORTS[terminados.pop(0)]
+        _EXPORTS[clave] = trabajo
+    threading.Thread(target=correr, daemon=True).start()
+    return trabajo
+
+@st.fragment(run_every=1)
+def _progreso_export(clave, etiqueta):
+    trabajo = _EXPORTS.get(clave)
+    if trabajo and trabajo['estado'] == 'generando':
+        st.progress(trabajo['progreso'], text=f"Generando {etiqueta}… {trabajo['progreso']:.0%}")
+    else:
+        st.rerun()
+
+def boton_export(etiqueta, nombre, version, construir, file_name):
+    # construir(avance) -> bytes; se ejecuta una sola vez por (nombre, version)
+    clave = (nombre, version)
+    with _EXPORTS_LOCK: trabajo = _EXPORTS.get(clave)
+    if trabajo is None or trabajo['estado'] == 'error':
+        if trabajo: st.error(f"No se pudo generar {etiqueta}: {trabajo['error']}")
+        if not st.button(f"⚙️ Generar {etiqueta}", key=f"gen_{nombre}"): return
+        trabajo = _lanzar_export(clave, construir)
+    if trabajo['estado'] == 'listo':
+        st.download_button(f"📥 {etiqueta}", data=trabajo['datos'], file_name=file_name, key=f"dl_{nombre}")
+    else:
+        _progreso_export(clave, etiqueta)
+
+def edad_legible(segundos):
+    if segundos < 60: return "hace instantes"
+    if segundos < 3600: return f"hace {segundos/60:.0f} min"
+    return f"hace {segundos/3600:.1f} h"
+
+def caption_edad_datos(estados):
+    # estados: {"Etiqueta": services.estado_cache(...)}; muestra qué tan frescos son los datos servidos
+    partes = [f"{k}: {edad_legible(e['edad_s'])}{' (actualizando…)' if e['refrescando'] else ''}" for k, e in estados.items() if e]
+    if partes: st.caption("🕒 Datos " + " · ".join(partes))
+
 def card_kpi(titulo, valor, color_class, nota="", formato="moneda"):
     try:
         val_float = float(valor)
@@ -110,3 +230,8 @@ def config_plotly(fig):
         legend=dict(orientation="h", y=1.1)
     )
     return fig
+
+def grafico(fig, bloque="Gráfico"):
+    # plotly_chart con el estilo común; con el perfilador activo separa el tiempo de figura y de serialización
+    with perfil.medir(bloque, 'figura'): fig = config_plotly(fig)
+    with perfil.medir(bloque, 'serializacion'): st.plotly_chart(fig, use_container_width=True)